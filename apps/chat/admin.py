@@ -11,6 +11,9 @@ from unfold.contrib.import_export.forms import ExportForm, ImportForm
 from .resources import ChatSessionResource , SessionMessageResource
 from django.urls import path
 from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import Count, F, Q
+from apps.core.cache_layers import usage_tracker
 
 # =========================================================
 # 1. إعدادات الأوبئة
@@ -148,7 +151,7 @@ class ChatSessionAdmin(ModelAdmin, ImportExportModelAdmin):
     change_form_template = "admin/chat/chatsession/change_form.html"
     
     # إضافة زر التصدير للقائمة الخارجية
-    list_display = ('priority_badge', 'health_id', 'refugee_name', 'last_activity', 'export_action_button')
+    list_display = ('priority_badge', 'health_id', 'refugee_name', 'unread_badge', 'last_activity', 'export_action_button')
     list_filter = ('priority', 'is_active', 'start_time')
     inlines = [MessageInline]
     list_fullwidth = True
@@ -205,7 +208,7 @@ class ChatSessionAdmin(ModelAdmin, ImportExportModelAdmin):
 
         # 1. جلب البيانات
         dataset = SessionMessageResource().export(
-            queryset=Message.objects.filter(session=session).order_by('timestamp')
+            queryset=Message.objects.filter(session=session).select_related('sender').order_by('timestamp').decrypted()
         )
         
         # 2. تصحيح الخطأ: استخدام دالة export('xlsx') بدلاً من .xlsx
@@ -222,9 +225,28 @@ class ChatSessionAdmin(ModelAdmin, ImportExportModelAdmin):
 
     # --- الحفاظ على priority_badge كما طلبت ---
     def priority_badge(self, obj):
-        return render_to_string('admin/chat/status.html', {'is_urgent': obj.priority == 2})
+        # data-* لكي يحدث صندوق الوارد الصف مباشرة / data-* attributes let the live inbox find and update the row
+        return render_to_string('admin/chat/status.html', {
+            'is_urgent': obj.priority == 2, 'session_id': obj.id, 'priority': obj.priority,
+        })
     priority_badge.short_description = "Status"
 
+    def get_queryset(self, request):
+        # عدد غير المقروء في نفس استعلام القائمة / Unread count in the changelist query itself
+        return super().get_queryset(request).select_related('refugee').annotate(
+            unread_count=Count('messages', filter=Q(messages__sender_id=F('refugee_id')) & (
+                Q(staff_read_at__isnull=True) | Q(messages__timestamp__gt=F('staff_read_at'))
+            ))
+        )
+
+    def unread_badge(self, obj):
+        count = getattr(obj, 'unread_count', 0)
+        return format_html(
+            '<span data-inbox-unread="{}" class="bg-red-600 text-white rounded-full px-2 py-0.5 text-xs font-bold"{}>{}</span>',
+            obj.id, '' if count else mark_safe(' style="display:none"'), count
+        )
+    unread_badge.short_description = "Unread"
+
     def health_id(self, obj): return obj.refugee.username
     def refugee_name(self, obj): return obj.refugee.full_name
 
@@ -334,4 +356,22 @@ class ImageAnalysisCacheAdmin(ModelAdmin):
 
 @admin.register(TranslationCache)
 class TranslationCacheAdmin(ModelAdmin):
-    list_display = ('source_text', 'translated_text', 'source_language', 'target_language')
\ No newline at end of file
+    list_display = ('source_text', 'translated_text', 'source_language', 'target_language', 'hit_count', 'last_used_at')
+    list_filter = ('source_language', 'target_language')
+    ordering = ('-hit_count',)
+    list_before_template = "admin/chat/translationcache/stats.html"
+
+    # إحصائيات الكاش فوق القائمة (الحجم ونسبة الإصابة)
+    # Cache stats above the list (size and hit ratio)
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        usage = usage_tracker.stats()
+        extra_context['cache_stats'] = {
+            'rows': TranslationCache.objects.count(),
+            'max_rows': getattr(settings, 'TRANSLATION_CACHE_MAX_ROWS', 50000),
+            'policy': getattr(settings, 'TRANSLATION_CACHE_EVICTION_POLICY', 'lru').upper(),
+            'hits': usage['hits'],
+            'misses': usage['misses'],
+            'hit_ratio': f"{usage['hit_ratio'] * 100:.1f}%" if usage['hit_ratio'] is not None else "-",
+        }
+        return super().changelist_view(request, extra_context=extra_context)
\ No newline at end of file
@@ -1,11 +1,26 @@
 import json
+import asyncio
 import traceback
+from functools import cached_property
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.core.cache import cache
-from asgiref.sync import sync_to_async 
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 from .models import ChatSession, Message
+from .services.presence_service import PresenceService
+from .services.notification_service import NotificationService
+from .services.inbox_service import StaffInboxService
+from .services.ingest_service import MessageIngestService
+from .wire import negotiate, MsgpackCodec
+from .outbox import Outbox
+from apps.core.rate_limit import RequestThrottle
+from apps.core.services import AsyncAzureTranslator
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    throttle = RequestThrottle('ws_message')
+
     async def connect(self):
         try:
             self.session_id = str(self.scope['url_route']['kwargs']['session_id'])
@@ -13,14 +28,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             self.user = self.scope.get("user")
 
-            if not self.user or self.user.is_anonymous:
-                try:
-                    session = await ChatSession.objects.aget(id=self.session_id)
-                    self.user = await sync_to_async(lambda: session.refugee)()
-                except ChatSession.DoesNotExist:
-                    self.user = None
+            # تحميل الجلسة والمشاركين مرة واحدة فقط لكل اتصال (وليس مع كل رسالة)
+            # Load the session and its participants once per connection (not on every frame)
+            try:
+                self.session = await ChatSession.objects.select_related('refugee', 'nurse').aget(id=self.session_id)
+            except ChatSession.DoesNotExist:
+                self.session = None
 
-            if not self.user:
+            # بدون مستخدم مسجل لا اتصال (ولا سجل محادثة) / No authenticated user, no socket (and no history)
+            if not self.session or not self.is_participant(self.user):
                 print(f"❌ Unauthorized WebSocket attempt for session: {self.session_id}")
                 await self.close()
                 return
@@ -29,28 +45,172 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
-            await self.accept()
+            # JSON افتراضياً، أو MessagePack إذا طلبه العميل / JSON by default, MessagePack if the client asks
+            self.codec = negotiate(self.scope.get('subprotocols'))
+            await self.accept(subprotocol=self.codec.subprotocol)
+            # كل ما يُرسل لهذا العميل يمر عبر طابور محدود / Everything sent to this client goes through a bounded queue
+            self.outbox = Outbox(self.write_event)
+            self.outbox.start()
             print(f"✅ WebSocket Connected (Async): User {self.user.id}")
 
-            # 🛑 تعديل 1: عند الاتصال، قم بتحديث الرسائل غير المقروءة إلى مقروءة وإشعار الطرف الآخر
-            # Mark unread messages as read when user connects
-            await Message.objects.filter(session_id=self.session_id, is_read=False).exclude(sender=self.user).aupdate(is_read=True)
-            
-            # إرسال إشعار للطرف الآخر بأنني قرأت الرسائل
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'read_receipt_event',
-                    'reader_id': self.user.id
-                }
-            )
+            # الحضور في Redis: نبلغ الطرف الآخر ونرسل لهذا العميل من المتصل الآن
+            # Presence in Redis: tell the others, and tell this client who is online right now
+            if await PresenceService.touch(self.session_id, self.user, self.channel_name):
+                await self.broadcast_presence(online=True)
+            online = await PresenceService.online_sides(self.session_id) or set()
+            for side in online - {PresenceService.side_of(self.user)}:
+                await self.send_event({'type': 'presence', 'side': side, 'online': True})
+
+            # إعادة الاتصال: نرسل فقط ما فات العميل في إطار واحد
+            # Reconnect: stream only what the client missed, in one frame
+            cursor = self.resume_cursor()
+            if cursor is not None:
+                await self.send_missed(cursor)
+
+            # عند الاتصال: تقديم علامة القراءة (صف واحد في ChatSession بدل تحديث الرسائل)
+            # On connect: advance the read watermark (one ChatSession row instead of a Message UPDATE)
+            self.mark_read()
             
         except Exception as e:
             print("❌ Error during connect:", e)
             traceback.print_exc()
             await self.close()
 
+    def is_participant(self, user):
+        # اللاجئ صاحب الجلسة أو الممرض المعين أو أي موظف / Session refugee, assigned nurse or any staff
+        if not user or user.is_anonymous:
+            return False
+        return user.is_staff or user.id in (self.session.refugee_id, self.session.nurse_id)
+
+    # ==============================================================================
+    # المزامنة بعد الانقطاع (?cursor=<آخر seq>) / Reconnect sync (?cursor=<last seen seq>)
+    # ==============================================================================
+    def resume_cursor(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return int(query['cursor'][0])
+        except (KeyError, ValueError, IndexError):
+            return None
+
+    def load_missed(self, cursor, limit):
+        messages = (
+            Message.objects.filter(session_id=self.session_id, seq__gt=cursor)
+            .select_related('session')
+            .order_by('seq')
+            .decrypted()[:limit + 1]
+        )
+        return [NotificationService.serialize(m) | {'is_read': m.is_seen} for m in messages]
+
+    async def send_missed(self, cursor):
+        limit = getattr(settings, 'SYNC_MAX_MESSAGES', 200)
+        missed = await sync_to_async(self.load_missed)(cursor, limit)
+        if not missed:
+            return
+        await self.send_event({
+            'type': 'sync',
+            'messages': missed[:limit],
+            # أكثر من الحد: العميل يعيد تحميل الصفحة / Over the limit: the client reloads the page
+            'has_more': len(missed) > limit,
+        })
+
+    # ==============================================================================
+    # علامات القراءة مع تأجيل ودمج الإشعارات / Read watermarks, debounced and coalesced
+    # ==============================================================================
+    def mark_read(self):
+        """
+        كل mark_read خلال فترة التأجيل يُدمج في كتابة واحدة وإشعار واحد
+        Every mark_read inside the debounce window collapses into one write and one receipt
+        """
+        self.pending_read_at = timezone.now()
+        if getattr(self, 'read_flush_task', None) is None:
+            self.read_flush_task = asyncio.create_task(self.flush_read_after_delay())
+
+    async def flush_read_after_delay(self):
+        await asyncio.sleep(getattr(settings, 'READ_RECEIPT_DEBOUNCE_SECONDS', 2.0))
+        self.read_flush_task = None
+        await self.flush_read()
+
+    async def flush_read(self):
+        read_at = getattr(self, 'pending_read_at', None)
+        if read_at is None:
+            return
+        self.pending_read_at = None
+        field = 'staff_read_at' if self.user.is_staff else 'refugee_read_at'
+        try:
+            # شرط التقدم فقط: لا إشعار إذا لم تتحرك العلامة / Only moves forward: no receipt if nothing advanced
+            advanced = await ChatSession.objects.filter(
+                Q(id=self.session_id) & (Q(**{f'{field}__isnull': True}) | Q(**{f'{field}__lt': read_at}))
+            ).aupdate(**{field: read_at})
+            # لا داعي للإشعار إذا لم يكن الطرف الآخر متصلاً / No receipt if the other side isn't connected
+            if advanced and await self.other_side_online():
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        'type': 'read_receipt_event',
+                        'reader_id': self.user.id,
+                        'read_at': read_at.isoformat(),
+                    }
+                )
+            # صندوق الوارد للطاقم: عدد غير المقروء تغير / Staff inbox: the unread count changed
+            if advanced and self.user.is_staff:
+                unread = await sync_to_async(StaffInboxService.unread_count)(self.session_id)
+                await self.channel_layer.group_send(
+                    StaffInboxService.GROUP,
+                    StaffInboxService.payload('unread', self.session_id, unread=unread)
+                )
+        except Exception as e:
+            print(f"⚠️ Read watermark update failed: {e}")
+
+    # ==============================================================================
+    # الحضور ومؤشر الكتابة (Redis + المجموعة الحالية فقط) / Presence and typing (Redis + existing group)
+    # ==============================================================================
+    async def other_side_online(self):
+        online = await PresenceService.online_sides(self.session_id)
+        if online is None:
+            return True
+        return bool(online - {PresenceService.side_of(self.user)})
+
+    async def broadcast_presence(self, online):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'presence_event',
+                'user_id': self.user.id,
+                'side': PresenceService.side_of(self.user),
+                'online': online,
+                'sender_channel': self.channel_name,
+            }
+        )
+
+    async def handle_typing(self, is_typing):
+        # "يكتب" مرة كل ثانيتين كحد أقصى / "typing" at most once every 2 seconds
+        now = asyncio.get_running_loop().time()
+        if is_typing and now - getattr(self, 'last_typing_sent', 0) < 2:
+            return
+        self.last_typing_sent = now if is_typing else 0
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing_event',
+                'user_id': self.user.id,
+                'side': PresenceService.side_of(self.user),
+                'is_typing': bool(is_typing),
+                'sender_channel': self.channel_name,
+            }
+        )
+
     async def disconnect(self, close_code):
+        if getattr(self, 'session', None) and self.is_participant(self.user):
+            if await PresenceService.leave(self.session_id, self.user, self.channel_name):
+                await self.broadcast_presence(online=False)
+
+        # لا نفقد آخر علامة قراءة عند الإغلاق / Don't lose the last watermark on close
+        task = getattr(self, 'read_flush_task', None)
+        if task is not None:
+            task.cancel()
+            self.read_flush_task = None
+            await self.flush_read()
+
         try:
             await self.channel_layer.group_discard(
                 self.room_group_name,
@@ -59,22 +219,56 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except:
             pass
 
-    async def receive(self, text_data):
+        outbox = getattr(self, 'outbox', None)
+        if outbox is not None:
+            await outbox.close(evicted=getattr(self, 'evicting', False))
+
+    # ==============================================================================
+    # الإرسال عبر الطابور وفصل العملاء العالقين / Queued sends and slow-consumer eviction
+    # ==============================================================================
+    # العميل يعيد الاتصال فوراً بمؤشره ويستلم 'sync' / The client reconnects at once with its cursor and gets a 'sync'
+    EVICTED = 4008
+
+    async def send_event(self, event):
+        outbox = getattr(self, 'outbox', None)
+        if outbox is None:
+            await self.write_event(event)
+        elif not outbox.put(event) and not getattr(self, 'evicting', False):
+            self.evicting = True
+            print(f"🐢 Evicting slow WebSocket: User {self.user.id}, depth {outbox.depth()}")
+            await self.close(code=self.EVICTED)
+
+    async def write_event(self, event):
+        if self.codec.binary:
+            await self.send(bytes_data=self.codec.encode(event, viewer=self.user))
+        else:
+            await self.send(text_data=self.codec.encode(event))
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = json.loads(text_data) if text_data is not None else MsgpackCodec.decode(bytes_data)
             
             # 🛑 تعديل 2: معالجة إشارة "تمت القراءة" القادمة من المتصفح
             if data.get('type') == 'mark_read':
-                # تحديث الرسائل في قاعدة البيانات
-                await Message.objects.filter(session_id=self.session_id, is_read=False).exclude(sender=self.user).aupdate(is_read=True)
-                # إبلاغ الطرف الآخر لتحديث واجهته (✔✔)
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'read_receipt_event',
-                        'reader_id': self.user.id
-                    }
-                )
+                self.mark_read()
+                return
+
+            if data.get('type') in ('ack', 'heartbeat') and data.get('seq') is not None:
+                self.outbox.ack(int(data['seq']))
+                if data['type'] == 'ack':
+                    return
+
+            if data.get('type') == 'heartbeat':
+                if await PresenceService.touch(self.session_id, self.user, self.channel_name):
+                    await self.broadcast_presence(online=True)
+                return
+
+            if data.get('type') == 'typing':
+                await self.handle_typing(data.get('is_typing', True))
+                return
+
+            if data.get('type') == 'message_batch':
+                await self.receive_batch(data.get('messages') or [])
                 return
 
             message_text = data.get('message', '').strip()
@@ -83,25 +277,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if not message_text:
                 return
 
-            if not user.is_staff:
-                cache_key = f"throttle_user_{user.id}"
-                LIMIT = 10000 
-                PERIOD = 60 
-                current_count = await sync_to_async(cache.get_or_set)(cache_key, 0, timeout=PERIOD)
-                if current_count >= LIMIT:
-                    await self.send(text_data=json.dumps({
-                        'error': 'Please slow down. You are sending too fast.',
-                        'type': 'error_alert'
-                    }))
-                    return
-                await sync_to_async(cache.incr)(cache_key)
+            # فحص ذري واحد في Redis (Lua) حسب الدور / One atomic Redis check (Lua), limits per role
+            retry_after = await self.throttle.acheck(user)
+            if retry_after:
+                await self.send_throttled(retry_after)
+                return
 
-            session = await ChatSession.objects.aget(id=self.session_id)
+            # ترجمة مباشرة بمهلة قصيرة (كاش أو Azure)؛ إن لم تكتمل تتولاها Celery
+            # Inline translation within a short budget (cache or Azure); otherwise Celery translates it
+            text_translated = await self.translate_inline(message_text)
 
+            # الجلسة محملة مسبقاً في connect: الاستعلام الوحيد هنا هو الإدخال
+            # Session was loaded in connect(): the only query here is the insert
             saved_message = await Message.objects.acreate(
-                session=session,
+                session=self.session,
                 sender=user,
                 text_original=message_text,
+                text_translated=text_translated,
                 is_read=False # الافتراضي، وسيتم تحديثه إذا كان الطرف الآخر متصلاً
             )
 
@@ -110,6 +302,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 {
                     'type': 'chat_message',
                     'id': str(saved_message.id),
+                    'seq': saved_message.seq,
                     'sender_id': user.id,
                     'text_original': saved_message.text_original,
                     'text_translated': saved_message.text_translated,
@@ -124,12 +317,131 @@ class ChatConsumer(AsyncWebsocketConsumer):
             print("❌ Error in receive:")
             traceback.print_exc()
 
+    @cached_property
+    def translator(self):
+        return AsyncAzureTranslator()
+
+    async def translate_inline(self, text):
+        """
+        نفس اتجاه الترجمة في process_message_ai، على حلقة الأحداث مباشرة
+        Same language pair as process_message_ai, awaited on the event loop. Returns None when
+        the budget runs out or anything fails, and the Celery task translates as before.
+        """
+        budget = getattr(settings, 'TRANSLATION_INLINE_TIMEOUT', 1.0)
+        if not budget:
+            return None
+        if self.user.role == 'REFUGEE':
+            target_lang = 'no'
+        else:
+            target_lang = self.session.refugee.native_language
+        try:
+            return await asyncio.wait_for(
+                self.translator.atranslate(text, self.user.native_language or 'en', target_lang),
+                timeout=budget
+            ) or None
+        except Exception as e:
+            print(f"⏳ Inline translation skipped, Celery will translate: {e!r}")
+            return None
+
+    async def send_throttled(self, retry_after):
+        await self.send_event({
+            'error': 'Please slow down. You are sending too fast.',
+            'type': 'error_alert',
+            'retry_after': round(retry_after, 1),
+        })
+
+    # ==============================================================================
+    # دفعة رسائل من طابور عدم الاتصال / Batched ingest of the browser's offline queue
+    # ==============================================================================
+    async def receive_batch(self, texts):
+        # العناصر غير النصية أو الفارغة ليست رسائل (العميل لا يرسلها أصلاً)
+        # Non-string or blank entries are not messages (the client filters them out before sending)
+        limit = getattr(settings, 'WS_MESSAGE_BATCH_MAX', 50)
+        texts = [t.strip() for t in texts if isinstance(t, str) and t.strip()]
+        if not texts:
+            return
+
+        # دفعة أكبر من الحد تُرفض كاملة بدل اقتطاعها: العميل يعيدها للطابور ويرسلها على أجزاء
+        # An oversized batch is rejected whole, never truncated: the client re-queues it and resends in chunks
+        if len(texts) > limit:
+            await self.send_event({'type': 'error_alert', 'batch_max': limit})
+            return
+
+        # فحص واحد بتكلفة عدد الرسائل / One check charged for every message in the batch
+        retry_after = await self.throttle.acheck(self.user, cost=len(texts))
+        if retry_after:
+            await self.send_throttled(retry_after)
+            return
+
+        messages = await sync_to_async(MessageIngestService.create_batch)(self.session, self.user, texts)
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'message_batch',
+                'messages': [NotificationService.serialize(m) | {'is_read': False} for m in messages],
+            }
+        )
+
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
+
+    async def message_batch(self, event):
+        await self.send_event(event)
+
+    async def patch_batch(self, event):
+        await self.send_event(event)
+
+    async def message_patch(self, event):
+        # الحقول المتغيرة فقط؛ العميل يدمجها في الرسالة الموجودة / Changed fields only, merged client-side
+        await self.send_event(event)
 
     # 🛑 تعديل 3: دالة جديدة لإرسال إشعار القراءة للفرونت إند
     async def read_receipt_event(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'read_receipt',
-            'reader_id': event['reader_id']
-        }))
\ No newline at end of file
+            'reader_id': event['reader_id'],
+            'read_at': event.get('read_at'),
+        })
+
+    async def presence_event(self, event):
+        if event['sender_channel'] == self.channel_name:
+            return
+        await self.send_event({
+            'type': 'presence',
+            'side': event['side'],
+            'online': event['online'],
+        })
+
+    async def typing_event(self, event):
+        if event['sender_channel'] == self.channel_name:
+            return
+        await self.send_event({
+            'type': 'typing',
+            'side': event['side'],
+            'is_typing': event['is_typing'],
+        })
+
+
+class StaffInboxConsumer(AsyncWebsocketConsumer):
+    """
+    اتصال واحد لكل ممرض يستقبل أحداث كل الجلسات (قائمة المحادثات في لوحة التحكم)
+    One socket per staff member carrying session-level events for every chat (admin changelist)
+    """
+    async def connect(self):
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated or not self.user.is_staff:
+            await self.close()
+            return
+        await self.channel_layer.group_add(StaffInboxService.GROUP, self.channel_name)
+        await self.accept()
+        print(f"✅ Staff inbox connected: User {self.user.id}")
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(StaffInboxService.GROUP, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # قناة للدفع فقط / Push-only channel
+        pass
+
+    async def inbox_event(self, event):
+        await self.send(text_data=json.dumps(event['payload']))
@@ -0,0 +1,162 @@
+# apps/chat/crypto.py
+import zlib
+import hashlib
+import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import nh3
+from django.conf import settings
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+DECRYPT_ERROR = "[Encrypted Data - Error]"
+
+# ==============================================================================
+# صيغة التخزين / On-disk format
+#   v0 (قديم / legacy):  <fernet token of utf-8 text>
+#   v1:                  "z1:" + <fernet token of zlib(utf-8 text)>
+# رموز Fernet لا تحتوي ":" لذلك البادئة لا تلتبس / Fernet tokens never contain ":", so the prefix is unambiguous
+# ==============================================================================
+ZLIB_PREFIX = 'z1:'
+FORMAT_VERSION = 1
+
+
+def compress_threshold():
+    return getattr(settings, 'DB_ENCRYPTION_COMPRESS_MIN_BYTES', 512)
+
+
+# ==============================================================================
+# 1. Fernet (مبني مرة واحدة لكل عملية / built once per process)
+# ==============================================================================
+def current_keys():
+    """
+    المفتاح الأول للتشفير، والباقي لفك تشفير البيانات القديمة فقط
+    First key encrypts; the others only decrypt older rows until rotation finishes.
+    """
+    keys = getattr(settings, 'DB_ENCRYPTION_KEYS', None) or [settings.DB_ENCRYPTION_KEY]
+    return tuple(keys)
+
+
+@lru_cache(maxsize=8)
+def build_fernet(keys):
+    # المفاتيح tuple لكي تُخزن وتُرسل لعمليات أخرى / keys is a tuple so it is hashable and picklable
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+@lru_cache(maxsize=8)
+def primary_fernet(keys):
+    return Fernet(keys[0])
+
+
+def key_fingerprint(keys):
+    """بصمة المفتاح الأساسي (لا تكشف المفتاح) / Primary key fingerprint (does not reveal the key)"""
+    return hashlib.sha256(keys[0].encode('utf-8')).hexdigest()[:12]
+
+
+def _split_format(ciphertext):
+    if ciphertext.startswith(ZLIB_PREFIX):
+        return True, ciphertext[len(ZLIB_PREFIX):]
+    return False, ciphertext
+
+
+def is_current(keys, ciphertext):
+    """هل النص مشفر بالمفتاح الأساسي؟ (تحقق HMAC فقط بدون فك) / Signed by the primary key? (HMAC check only)"""
+    try:
+        primary_fernet(keys).extract_timestamp(_split_format(ciphertext)[1].encode('utf-8'))
+        return True
+    except InvalidToken:
+        return False
+
+
+def is_compressible_legacy(fernet, ciphertext, min_bytes=None):
+    """
+    صف قديم (v0) سيُضغط فعلاً عند إعادة تشفيره (نفس قرار encrypt_one)
+    Legacy (v0) row that encrypt_one would actually store compressed: the real plaintext
+    is at least min_bytes and zlib makes it smaller. Incompressible rows stay v0, so a
+    rotation pass does not keep rewriting them. The token length only pre-filters short rows.
+    """
+    min_bytes = compress_threshold() if min_bytes is None else min_bytes
+    if not min_bytes or ciphertext.startswith(ZLIB_PREFIX) or len(ciphertext) * 3 // 4 < min_bytes:
+        return False
+    try:
+        data = fernet.decrypt(ciphertext.encode('utf-8'))
+    except InvalidToken:
+        return False
+    return len(data) >= min_bytes and len(zlib.compress(data, 6)) < len(data)
+
+
+def decrypt_one(fernet, ciphertext):
+    if not ciphertext:
+        return ciphertext
+    try:
+        compressed, token = _split_format(ciphertext)
+        data = fernet.decrypt(token.encode('utf-8'))
+        if compressed:
+            data = zlib.decompress(data)
+        return data.decode('utf-8')
+    except Exception as e:
+        logger.error(f"Decryption failed: {e}")
+        return DECRYPT_ERROR
+
+
+def encrypt_one(fernet, text, compress_min=None):
+    if not text:
+        return text
+    clean_value = nh3.clean(text, tags=set())
+    data = clean_value.encode('utf-8')
+
+    # الضغط قبل التشفير (النص المشفر لا يقبل الضغط) / Compress before encrypting (ciphertext doesn't compress)
+    compress_min = compress_threshold() if compress_min is None else compress_min
+    if compress_min and len(data) >= compress_min:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return ZLIB_PREFIX + fernet.encrypt(packed).decode('utf-8')
+    return fernet.encrypt(data).decode('utf-8')
+
+
+# ==============================================================================
+# 2. Bulk API (دفعات متوازية للتصدير والمهام الخلفية / parallel chunks for exports and batch jobs)
+# ==============================================================================
+# دوال على مستوى الوحدة لكي تعمل مع ProcessPoolExecutor (pickle)
+# Module-level so they pickle for ProcessPoolExecutor
+def _decrypt_chunk(keys, chunk):
+    fernet = build_fernet(keys)
+    return [decrypt_one(fernet, value) for value in chunk]
+
+
+def _encrypt_chunk(keys, chunk, compress_min):
+    fernet = build_fernet(keys)
+    return [encrypt_one(fernet, value, compress_min) for value in chunk]
+
+
+def _run_chunked(func, values, keys, chunk_size, workers, pool, extra=()):
+    values = list(values)
+    keys = keys or current_keys()
+    chunk_size = chunk_size or getattr(settings, 'DB_CRYPTO_CHUNK_SIZE', 500)
+    workers = workers or getattr(settings, 'DB_CRYPTO_WORKERS', 4)
+    pool = pool or getattr(settings, 'DB_CRYPTO_POOL', 'thread')
+
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    # دفعة واحدة: لا داعي لتكلفة إنشاء المجمع / A single chunk isn't worth a pool
+    if len(chunks) <= 1 or workers <= 1 or pool == 'serial':
+        return [result for chunk in chunks for result in func(keys, chunk, *extra)]
+
+    # عمال Celery (prefork) لا يمكنهم إنشاء عمليات فرعية: استخدم 'thread' هناك
+    # Celery prefork workers are daemonic and can't fork children: use 'thread' there
+    executor_class = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+    with executor_class(max_workers=min(workers, len(chunks))) as executor:
+        results = executor.map(func, [keys] * len(chunks), chunks, *[[arg] * len(chunks) for arg in extra])
+        return [result for chunk in results for result in chunk]
+
+
+def decrypt_many(ciphertexts, keys=None, chunk_size=None, workers=None, pool=None):
+    """يفك تشفير قائمة نصوص بالترتيب نفسه / Decrypts a list of ciphertexts, order preserved"""
+    return _run_chunked(_decrypt_chunk, ciphertexts, keys, chunk_size, workers, pool)
+
+
+def encrypt_many(texts, keys=None, chunk_size=None, workers=None, pool=None):
+    """يشفر قائمة نصوص بالترتيب نفسه / Encrypts a list of plain texts, order preserved"""
+    # الإعدادات تُقرأ هنا لأن عمليات المجمع قد لا تحمّل Django / Read settings here: pool processes may not load Django
+    return _run_chunked(_encrypt_chunk, texts, keys, chunk_size, workers, pool, extra=(compress_threshold(),))
@@ -0,0 +1,42 @@
+import time
+import random
+import string
+
+from django.core.management.base import BaseCommand
+
+from apps.chat.crypto import build_fernet, current_keys, decrypt_one, encrypt_one, decrypt_many, encrypt_many
+
+
+class Command(BaseCommand):
+    help = "Compare per-row Fernet encrypt/decrypt with the bulk thread/process pool path (rows per second)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000)
+        parser.add_argument('--size', type=int, default=300, help="Characters per message.")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        alphabet = string.ascii_letters + ' æøå'
+        texts = [''.join(rng.choices(alphabet, k=options['size'])) for _ in range(options['rows'])]
+        fernet = build_fernet(current_keys())
+
+        # المسار الحالي: صف بصف في خيط واحد / Current path: row by row, single thread
+        ciphertexts = self._measure("encrypt per-row", lambda: [encrypt_one(fernet, t) for t in texts])
+        self._measure("decrypt per-row", lambda: [decrypt_one(fernet, c) for c in ciphertexts])
+
+        for pool in ('thread', 'process'):
+            bulk = dict(workers=options['workers'], chunk_size=options['chunk_size'], pool=pool)
+            self._measure(f"encrypt_many ({pool} x{options['workers']})", lambda: encrypt_many(texts, **bulk))
+            result = self._measure(f"decrypt_many ({pool} x{options['workers']})", lambda: decrypt_many(ciphertexts, **bulk))
+            if result != texts:
+                self.stderr.write(f"❌ decrypt_many ({pool}) returned different plaintexts")
+
+    def _measure(self, label, func):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{label:<32} {len(result) / elapsed:>12,.0f} rows/s  ({elapsed:.2f}s)")
+        return result
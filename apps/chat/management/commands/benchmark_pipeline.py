@@ -0,0 +1,115 @@
+import time
+import uuid
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.test.utils import override_settings
+
+from apps.accounts.models import User
+from apps.chat.models import ChatSession, Message, TranslationCache
+from apps.chat.tasks import process_message_ai
+from apps.core.backends import StubFaults
+
+
+class Command(BaseCommand):
+    help = "Benchmark process_message_ai throughput offline, with every AI backend replaced by the local stub."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=2, help="Like CELERY_WORKER_CONCURRENCY.")
+        parser.add_argument('--distinct', type=int, default=50, help="Distinct texts (lower = more cache hits).")
+        parser.add_argument('--latency-ms', type=float, default=80.0)
+        parser.add_argument('--distribution', default='lognormal', choices=['fixed', 'uniform', 'normal', 'lognormal'])
+        parser.add_argument('--jitter', type=float, default=0.5)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--throttle-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated users and messages.")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        stub = {
+            'AI_BACKENDS': {'translation': 'stub', 'vision': 'stub', 'transcription': 'stub'},
+            'AI_STUB_OPTIONS': {
+                'latency_distribution': options['distribution'],
+                'latency_ms': options['latency_ms'],
+                'latency_jitter': options['jitter'],
+                'error_rate': options['error_rate'],
+                'throttle_rate': options['throttle_rate'],
+                'seed': options['seed'],
+            },
+        }
+
+        with override_settings(**stub):
+            StubFaults.reseed(options['seed'])
+            refugee, nurse, messages = self._seed(run_id, options)
+            try:
+                self._run(messages, options)
+            finally:
+                if not options['keep']:
+                    texts = {m.text_original for m in messages}
+                    TranslationCache.objects.filter(
+                        source_hash__in=[TranslationCache.make_hash(t) for t in texts]
+                    ).delete()
+                    refugee.delete()
+                    nurse.delete()
+
+    def _seed(self, run_id, options):
+        refugee = User.objects.create_user(
+            username=f"bench-r-{run_id}", email=f"bench-r-{run_id}@example.test",
+            password=None, role='REFUGEE', native_language='ar', full_name="Benchmark Refugee",
+        )
+        nurse = User.objects.create_user(
+            username=f"bench-n-{run_id}", email=f"bench-n-{run_id}@example.test",
+            password=None, role='NURSE', is_staff=True, native_language='no', full_name="Benchmark Nurse",
+        )
+        session = ChatSession.objects.create(refugee=refugee, nurse=nurse)
+
+        # bulk_create لا يرسل post_save، لذلك لا تُرسل مهام Celery / bulk_create skips post_save, so no Celery dispatch
+        # ولا يمر بـ Message.save()، لذلك نحجز نطاق seq بأنفسنا / Nor Message.save(), so reserve the seq range here
+        count = options['messages']
+        with transaction.atomic():
+            first_seq = ChatSession.allocate_seq(session.id, count=count) - count + 1
+            messages = Message.objects.bulk_create([
+                Message(
+                    session=session,
+                    sender=refugee,
+                    language_code='ar',
+                    text_original=f"bench {run_id} text {i % options['distinct']}",
+                    seq=first_seq + i,
+                )
+                for i in range(count)
+            ])
+        return refugee, nurse, messages
+
+    def _run(self, messages, options):
+        latencies = []
+
+        def process(message_id):
+            close_old_connections()
+            started = time.perf_counter()
+            try:
+                process_message_ai(str(message_id))
+            except Exception as e:
+                # retry() خارج عامل Celery يرفع استثناء / retry() outside a worker raises
+                self.stderr.write(f"⚠️ {message_id}: {e}")
+            latencies.append(time.perf_counter() - started)
+            close_old_connections()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(process, [m.id for m in messages]))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(messages)} messages in {elapsed:.2f}s -> {len(messages) / elapsed:.1f} msg/s "
+            f"(concurrency={options['concurrency']}, distinct={options['distinct']})"
+        ))
+        self.stdout.write(
+            f"latency p50={statistics.median(latencies) * 1000:.1f}ms "
+            f"p95={p95 * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms"
+        )
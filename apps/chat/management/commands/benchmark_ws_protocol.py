@@ -0,0 +1,63 @@
+import json
+import random
+import string
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from apps.chat.wire import JsonCodec, MsgpackCodec
+
+
+class Command(BaseCommand):
+    help = "Compare bytes per WebSocket frame for JSON, msgpack and msgpack+deflate on synthetic chat events."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--size', type=int, default=120, help="Characters per message text.")
+        parser.add_argument('--sync-size', type=int, default=50, help="Messages per reconnect 'sync' frame.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = [''.join(rng.choices(string.ascii_lowercase + 'æøå', k=rng.randint(2, 9))) for _ in range(400)]
+        started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+        def text():
+            out = []
+            while sum(len(w) + 1 for w in out) < options['size']:
+                out.append(rng.choice(words))
+            return ' '.join(out)
+
+        def message(i):
+            return {
+                'type': 'chat_message', 'id': 100000 + i, 'seq': i + 1, 'sender_id': rng.choice([7, 12]),
+                'text_original': text(), 'text_translated': text(),
+                'ai_analysis': "Symptom: headache, Urgency: low" if i % 3 == 0 else "",
+                'is_urgent': False, 'timestamp': (started + timedelta(seconds=i * 17)).isoformat(),
+                'image_url': None, 'audio_url': None,
+            }
+
+        events = [message(i) for i in range(options['messages'])]
+        step = options['sync_size']
+        syncs = [{'type': 'sync', 'messages': events[i:i + step], 'has_more': False} for i in range(0, len(events), step)]
+        refugee = SimpleNamespace(id=7, is_staff=False)
+        staff = SimpleNamespace(id=12, is_staff=True)
+
+        codecs = [('json', JsonCodec()), ('msgpack', MsgpackCodec()), ('msgpack+deflate', MsgpackCodec(deflate=True))]
+        for label, frames in (('chat_message', events), ('sync', syncs)):
+            self.stdout.write(f"--- {label} ({len(frames)} frames) ---")
+            baseline = None
+            for name, codec in codecs:
+                for viewer_name, viewer in (('staff', staff), ('refugee', refugee)):
+                    size = sum(len(self._encode(codec, e, viewer)) for e in frames)
+                    baseline = baseline or size
+                    self.stdout.write(
+                        f"{name:<16} {viewer_name:<8} {size / len(frames):>10,.0f} B/frame  "
+                        f"({size / baseline:.0%} of json)"
+                    )
+
+    @staticmethod
+    def _encode(codec, event, viewer):
+        encoded = codec.encode(event, viewer=viewer)
+        return encoded.encode('utf-8') if isinstance(encoded, str) else encoded
@@ -0,0 +1,22 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from apps.chat.crypto import compress_threshold
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert existing encrypted rows to the compressed storage format in the background "
+        "(runs the throttled, resumable re-encryption job)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='store_true', help="Only print the checkpoint.")
+
+    def handle(self, *args, **options):
+        if not compress_threshold():
+            self.stderr.write("DB_ENCRYPTION_COMPRESS_MIN_BYTES is 0, compression is disabled.")
+            return
+        # نفس المهمة: تعيد كتابة الصفوف القديمة بالمفتاح والصيغة الحاليين
+        # Same job: it rewrites legacy rows under the current key and format
+        call_command('rotate_encryption_keys', status=options['status'], stdout=self.stdout, stderr=self.stderr)
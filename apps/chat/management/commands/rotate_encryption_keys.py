@@ -0,0 +1,29 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from apps.chat.tasks import rotate_encryption_keys
+from apps.chat.services.key_rotation_service import KeyRotationService, ROTATION_MODELS
+
+
+class Command(BaseCommand):
+    help = "Start (or resume) re-encrypting every encrypted column under the first key in DB_ENCRYPTION_KEYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='store_true', help="Only print the checkpoint.")
+        parser.add_argument('--restart', action='store_true', help="Forget the checkpoint and start over.")
+
+    def handle(self, *args, **options):
+        service = KeyRotationService()
+        if options['restart']:
+            cache.delete(KeyRotationService.CHECKPOINT_KEY)
+
+        if not options['status']:
+            rotate_encryption_keys.delay()
+            self.stdout.write(self.style.SUCCESS(f"🔑 Rotation to key {service.fingerprint} queued."))
+
+        state = service.checkpoint()
+        table = ROTATION_MODELS[state['model']].__name__ if state['model'] < len(ROTATION_MODELS) else '-'
+        self.stdout.write(
+            f"key={state['key']} table={table} scanned={state['scanned']} "
+            f"rotated={state['rotated']} done={state['done']}"
+        )
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.models import User
+from apps.core.services import AzureTranslator
+from apps.core.rate_limit import TranslatorThrottled
+from apps.core.circuit_breaker import CircuitOpen
+from apps.chat.services.ui_catalog_service import UICatalogService, CATALOG_VERSION, SOURCE_LANGUAGE
+
+
+class Command(BaseCommand):
+    help = "Pre-translate the refugee-facing UI strings into every supported language (run at deploy time)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild even if the current version exists.")
+
+    def handle(self, *args, **options):
+        translator = AzureTranslator()
+        # LANGUAGE_CHOICES فيها تكرار (ps) لذلك نستخدم dict / LANGUAGE_CHOICES has duplicates, hence dict
+        languages = [code for code in dict(User.LANGUAGE_CHOICES) if code != SOURCE_LANGUAGE]
+
+        built, skipped, failed = 0, 0, 0
+        for language in languages:
+            if not options['force'] and UICatalogService.is_built(language):
+                skipped += 1
+                continue
+            try:
+                entry = UICatalogService.build(translator, language)
+            except (TranslatorThrottled, CircuitOpen) as e:
+                # كل لغة تُحفظ فور بنائها؛ الباقي يُبنى في الخلفية عند أول طلب
+                # Each language is stored as soon as it is built; the rest rebuild in the background on first use
+                self.stderr.write(f"⏳ Stopped at '{language}': {e}")
+                break
+            if entry:
+                built += 1
+                self.stdout.write(f"✅ {language}")
+            else:
+                failed += 1
+                self.stderr.write(f"❌ {language}")
+
+        deferred = len(languages) - built - skipped - failed
+        self.stdout.write(self.style.SUCCESS(
+            f"UI catalog v{CATALOG_VERSION}: {built} built, {skipped} up to date, {failed} failed, {deferred} deferred."
+        ))
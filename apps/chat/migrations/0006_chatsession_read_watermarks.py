@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_translationcache_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='refugee_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='staff_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-17 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chatsession_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'seq'], name='chat_msg_session_seq_idx'),
+        ),
+        # ترقيم الرسائل الحالية بترتيب الوقت / Number existing messages in timestamp order
+        migrations.RunSQL(
+            sql="""
+                UPDATE chat_message AS m SET seq = r.rn
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY timestamp, id) AS rn
+                    FROM chat_message
+                ) AS r
+                WHERE m.id = r.id;
+                UPDATE chat_chatsession AS s
+                SET last_seq = COALESCE((SELECT MAX(seq) FROM chat_message WHERE session_id = s.id), 0);
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_seq'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'timestamp'], name='chat_msg_session_ts_idx'),
+        ),
+    ]
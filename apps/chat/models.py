@@ -1,16 +1,17 @@
 import uuid 
 import hashlib
 import logging
-import nh3
 import base64
 
 from django.db import models
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.db.models.functions import Now
-from django.db import transaction 
+from django.db import transaction
+from django.db.models.query_utils import DeferredAttribute
+from django.utils.functional import Promise
 
-from cryptography.fernet import Fernet
+from .crypto import build_fernet, current_keys, decrypt_one, encrypt_one, decrypt_many
 
 logger = logging.getLogger(__name__)
 User = settings.AUTH_USER_MODEL
@@ -20,30 +21,221 @@ User = settings.AUTH_USER_MODEL
 # (انسخ الكلاسات الأولى من ملفك السابق وضعها هنا)
 # (Copy first classes from your previous file and place here)
 
+class EncryptedValue(Promise):
+    """
+    قيمة مشفرة لا تُفك إلا عند أول استخدام كنص (ثم تُحفظ في الذاكرة)
+    Ciphertext loaded from the DB, decrypted (and memoised) only on first use
+    as a string. Model attributes are swapped for the plain str on first access
+    (see LazyDecryptDescriptor); this object only leaks through .values().
+    Subclasses Promise so templates and DjangoJSONEncoder call str() on it.
+    """
+    __slots__ = ('ciphertext', '_fernet', '_plain')
+
+    def __init__(self, ciphertext, fernet):
+        self.ciphertext = ciphertext
+        self._fernet = fernet
+        self._plain = None
+
+    def decrypt(self):
+        if self._plain is None:
+            self._plain = decrypt_one(self._fernet, self.ciphertext)
+        return self._plain
+
+    @property
+    def is_decrypted(self):
+        return self._plain is not None
+
+    def __str__(self): return self.decrypt()
+    def __repr__(self): return f"<EncryptedValue {'decrypted' if self.is_decrypted else 'pending'}>"
+    def __bool__(self): return bool(self.ciphertext)
+    def __len__(self): return len(self.decrypt())
+    def __hash__(self): return hash(self.decrypt())
+    def __eq__(self, other): return self.decrypt() == (str(other) if isinstance(other, EncryptedValue) else other)
+    def __contains__(self, item): return item in self.decrypt()
+    def __add__(self, other): return self.decrypt() + str(other)
+    def __radd__(self, other): return str(other) + self.decrypt()
+    def __reduce__(self): return (str, (self.decrypt(),))
+
+    def __getattr__(self, name):
+        # باقي دوال str (strip, lower, ...) / Remaining str methods (strip, lower, ...)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.decrypt(), name)
+
+
+class LazyDecryptDescriptor(DeferredAttribute):
+    """
+    يفك التشفير عند أول قراءة للحقل فقط / Decrypts on first attribute read only
+    """
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, EncryptedValue):
+            value = value.decrypt()
+            instance.__dict__[self.field.attname] = value
+        return value
+
+
 class EncryptedTextField(models.TextField):
+    descriptor_class = LazyDecryptDescriptor
+
     def __init__(self, *args, **kwargs):
-        key = settings.DB_ENCRYPTION_KEY
-        self.fernet = Fernet(key)
+        self.fernet = build_fernet(current_keys())
         super().__init__(*args, **kwargs)
 
+    def pre_save(self, model_instance, add):
+        # إذا لم يُقرأ الحقل أبداً نعيد النص المشفر كما هو (بدون فك ثم إعادة تشفير)
+        # Untouched fields go back as-is (no decrypt/re-encrypt round trip)
+        raw = model_instance.__dict__.get(self.attname)
+        if isinstance(raw, EncryptedValue):
+            return raw
+        return super().pre_save(model_instance, add)
+
     def get_prep_value(self, value):
-        if not value: return value
-        clean_value = nh3.clean(value, tags=set())
-        encrypted_data = self.fernet.encrypt(clean_value.encode('utf-8'))
-        return encrypted_data.decode('utf-8')
+        if isinstance(value, EncryptedValue):
+            return value.ciphertext
+        return encrypt_one(self.fernet, value)
     
     def from_db_value(self, value, expression, connection):
         if not value: return value
-        try:
-            decrypted_data = self.fernet.decrypt(value.encode('utf-8'))
-            return decrypted_data.decode('utf-8')
-        except Exception as e:
-            logger.error(f"Decryption failed: {e}")
-            return f"[Encrypted Data - Error]"
+        # لا نفك التشفير هنا: فقط عند الاستخدام / No decryption here, only on use
+        return EncryptedValue(value, self.fernet)
         
     def to_python(self, value):
+        if isinstance(value, EncryptedValue):
+            return value.decrypt()
         return value
 
+
+def bulk_decrypt(instances, fields):
+    """
+    فك تشفير حقول كل الصفوف دفعة واحدة (بالتوازي) بدل صف بصف
+    Decrypt the given fields of every row in one parallel pass instead of row by row
+    """
+    pending = []
+    for obj in instances:
+        if not isinstance(obj, models.Model):
+            continue
+        for name in fields:
+            value = obj.__dict__.get(name)
+            if isinstance(value, EncryptedValue) and not value.is_decrypted:
+                pending.append(value)
+    if not pending:
+        return
+    for value, plain in zip(pending, decrypt_many([v.ciphertext for v in pending])):
+        value._plain = plain
+
+
+class EncryptedQuerySet(models.QuerySet):
+    """
+    اختياري: qs.decrypted() يفك تشفير النتائج بالجملة عند التحميل
+    Opt-in: qs.decrypted() bulk-decrypts results as they load (also with .iterator())
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bulk_decrypt = ()
+
+    def decrypted(self, *fields):
+        clone = self._chain()
+        if fields:
+            clone._bulk_decrypt = tuple(self.model._meta.get_field(f).attname for f in fields)
+        else:
+            clone._bulk_decrypt = tuple(
+                f.attname for f in self.model._meta.concrete_fields if isinstance(f, EncryptedTextField)
+            )
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._bulk_decrypt = self._bulk_decrypt
+        return clone
+
+    def _fetch_all(self):
+        loaded = self._result_cache is not None
+        super()._fetch_all()
+        if self._bulk_decrypt and not loaded:
+            bulk_decrypt(self._result_cache, self._bulk_decrypt)
+
+    def _iterator(self, use_chunked_fetch, chunk_size):
+        rows = super()._iterator(use_chunked_fetch, chunk_size)
+        if not self._bulk_decrypt:
+            yield from rows
+            return
+        # نجمع دفعة تكفي كل العمال ثم نفكها معاً / Buffer enough rows to keep every worker busy
+        buffer_size = getattr(settings, 'DB_CRYPTO_CHUNK_SIZE', 500) * getattr(settings, 'DB_CRYPTO_WORKERS', 4)
+        batch = []
+        for obj in rows:
+            batch.append(obj)
+            if len(batch) >= buffer_size:
+                bulk_decrypt(batch, self._bulk_decrypt)
+                yield from batch
+                batch = []
+        bulk_decrypt(batch, self._bulk_decrypt)
+        yield from batch
+
+
+class DirtyFieldsMixin:
+    """
+    يحفظ فقط الحقول التي تغيرت منذ التحميل (بدون إعادة تنظيف وتشفير الباقي)
+    save() on a loaded row only writes the fields that changed since it was loaded,
+    so unchanged encrypted columns are neither re-sanitised, re-encrypted nor rewritten.
+    A save with no changes stays a normal full save, so its query and signals still run.
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def _snapshot(self, fields=None):
+        names = fields or [f.attname for f in self._meta.concrete_fields]
+        loaded = getattr(self, '_loaded_values', {})
+        for name in names:
+            attname = self._meta.get_field(name).attname
+            if attname in self.__dict__:
+                loaded[attname] = self.__dict__[attname]
+        self._loaded_values = loaded
+
+    def get_dirty_fields(self):
+        """None = غير معروف (صف جديد) / None = unknown (never loaded), save everything"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        dirty = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if getattr(field, 'auto_now', False) or field.attname not in loaded:
+                dirty.append(field.name)
+                continue
+            old, new = loaded[field.attname], self.__dict__[field.attname]
+            if new is old:
+                continue
+            # النص المفكوك محفوظ في الذاكرة فالمقارنة لا تكلف فك تشفير إضافي
+            # The decrypted text is memoised, so this compare costs no extra decryption
+            if isinstance(old, EncryptedValue): old = old.decrypt()
+            if isinstance(new, EncryptedValue): new = new.decrypt()
+            if old != new:
+                dirty.append(field.name)
+        return dirty
+
+    def save(self, *args, **kwargs):
+        if not args and not self._state.adding and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            dirty = self.get_dirty_fields()
+            # لا شيء تغير = حفظ عادي (update_fields=[] كان سيتخطى الاستعلام والإشارات بصمت)
+            # Nothing changed = normal save (update_fields=[] would silently skip the query and signals)
+            if dirty:
+                kwargs['update_fields'] = dirty
+        super().save(*args, **kwargs)
+        self._snapshot(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot(fields)
+
+
 class DangerKeyword(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     word = models.CharField(max_length=100, unique=True, verbose_name="Det farlige ordet (norsk)")
@@ -63,11 +255,35 @@ class ChatSession(models.Model):
     last_activity = models.DateTimeField(auto_now=True)
     PRIORITY_CHOICES = [(1, 'Nurse (Normal)'), (2, 'Doctor (Urgent)')]
     priority = models.IntegerField(choices=PRIORITY_CHOICES, default=1, verbose_name="Priority Level")
+    # علامات القراءة: كل رسائل الطرف الآخر حتى هذا الوقت مقروءة (بدل تحديث كل رسالة)
+    # Read watermarks: every message from the other side up to this time is read (no per-message UPDATE)
+    refugee_read_at = models.DateTimeField(null=True, blank=True)
+    staff_read_at = models.DateTimeField(null=True, blank=True)
+    # آخر رقم تسلسلي للرسائل (للمزامنة بعد انقطاع الاتصال) / Last message sequence number (reconnect sync)
+    last_seq = models.PositiveBigIntegerField(default=0, editable=False)
     class Meta: ordering = ['-priority', '-last_activity']
+
+    @classmethod
+    def allocate_seq(cls, session_id, count=1):
+        """
+        يحجز count أرقام متتالية ويعيد آخرها، داخل معاملة الإدخال نفسها
+        Reserves `count` consecutive numbers and returns the last one. Must run inside the
+        transaction that inserts the messages: the UPDATE keeps the session row locked until
+        that INSERT commits, so concurrent senders commit in seq order and a resume cursor
+        never skips a message that was still in flight.
+        """
+        if not transaction.get_connection().in_atomic_block:
+            raise transaction.TransactionManagementError(
+                "allocate_seq() must run in the transaction that inserts the messages."
+            )
+        if not cls.objects.filter(id=session_id).update(last_seq=models.F('last_seq') + count):
+            return None
+        # قراءة قيمتنا نحن: الصف مقفل حتى نهاية المعاملة / Reads our own value: the row stays locked until commit
+        return cls.objects.filter(id=session_id).values_list('last_seq', flat=True).get()
     def __str__(self): return f"Chat: {self.refugee.full_name} ({self.get_priority_display()})"
 
 
-class Message(models.Model):
+class Message(DirtyFieldsMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -82,9 +298,20 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     is_urgent = models.BooleanField(default=False, verbose_name="Urgent / Doctor")
+    # رقم تسلسلي متزايد داخل الجلسة / Monotonically increasing number within the session
+    seq = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    # يزيد مع كل تحديث يُبث كـ message_patch / Bumped with every update broadcast as a message_patch
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = EncryptedQuerySet.as_manager()
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['session', 'seq'], name='chat_msg_session_seq_idx'),
+            # صفحات السجل (keyset على الوقت) / History pages (keyset on timestamp)
+            models.Index(fields=['session', 'timestamp'], name='chat_msg_session_ts_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # منطق "بيانات" فقط (تحديد اللغة الافتراضية)
@@ -92,10 +319,50 @@ class Message(models.Model):
         if self.sender_id and not self.language_code:
             self.language_code = self.sender.native_language
 
+        if self._state.adding and self.seq is None and self.session_id:
+            # الرقم والإدخال في معاملة واحدة: قفل الجلسة يبقى حتى يُحفظ الصف
+            # Seq and INSERT in one transaction: the session row lock is held until the row commits
+            with transaction.atomic():
+                self.seq = ChatSession.allocate_seq(self.session_id)
+                super().save(*args, **kwargs)
+            return
+
         # حفظ نقي (المنطق كله انتقل إلى signals.py)
         # Pure save (All logic moved to signals.py)
         super().save(*args, **kwargs)
 
+    def save_with_version(self, update_fields):
+        """
+        يحفظ الحقول ويزيد الإصدار في نفس UPDATE (ذري بين عدة عمال) ثم يقرأ الرقم الجديد
+        Saves `update_fields` and bumps the version in the same UPDATE (atomic across workers),
+        then reads the new number back for the message_patch.
+        """
+        self.version = models.F('version') + 1
+        self.save(update_fields=[*update_fields, 'version'])
+        self.refresh_from_db(fields=['version'])
+
+    @classmethod
+    def bulk_update_with_version(cls, messages, fields):
+        """نفس save_with_version لدفعة: bulk_update واحد وقراءة واحدة / save_with_version for a batch: one bulk_update, one read"""
+        for message in messages:
+            message.version = models.F('version') + 1
+        cls.objects.bulk_update(messages, [*fields, 'version'])
+        versions = dict(cls.objects.filter(id__in=[m.pk for m in messages]).values_list('id', 'version'))
+        for message in messages:
+            message.version = versions[message.pk]
+
+    @property
+    def is_seen(self):
+        """
+        مقروءة إذا تجاوزتها علامة قراءة الطرف الآخر (is_read يُحدَّث لاحقاً بالدفعات)
+        Read once the other side's watermark passed it (is_read is backfilled lazily)
+        """
+        if self.is_read:
+            return True
+        session = self.session
+        watermark = session.staff_read_at if self.sender_id == session.refugee_id else session.refugee_read_at
+        return bool(watermark and self.timestamp <= watermark)
+
     def __str__(self):
         return f"{self.sender.username}: Message"
 
@@ -112,6 +379,11 @@ class TranslationCache(models.Model):
     source_text = EncryptedTextField()
     translated_text = EncryptedTextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # تُحدَّث على دفعات بواسطة flush_translation_cache_usage (وليس عند كل استخدام)
+    # Updated in batches by flush_translation_cache_usage (not on every hit)
+    hit_count = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    objects = EncryptedQuerySet.as_manager()
     class Meta: unique_together = ('source_hash', 'source_language', 'target_language')
     @staticmethod
     def make_hash(text): return hashlib.sha256(text.strip().lower().encode('utf-8')).hexdigest()
@@ -165,6 +437,8 @@ class ImageAnalysisCache(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = EncryptedQuerySet.as_manager()
+
     def __str__(self):
         return f"Image Hash: {self.image_hash[:10]}..."
 
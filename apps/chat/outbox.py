@@ -0,0 +1,167 @@
+# apps/chat/outbox.py
+import time
+import asyncio
+import logging
+from collections import deque, Counter
+
+from django.conf import settings
+
+from apps.core.async_redis import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# طابور إرسال محدود لكل اتصال / Bounded outbound queue per WebSocket connection
+#
+# Daphne's send() never blocks, so a client on a slow link is invisible to the
+# consumer: its bytes pile up in the transport and the channel layer keeps feeding it.
+# Two signals are tracked instead:
+#   queued   -> events handled but not yet written (drained by one writer task)
+#   inflight -> chat messages written but not yet acknowledged by the client
+#               (only once the client has sent its first {"type": "ack"})
+# Above the high-water mark, read receipts / typing / presence are coalesced (latest wins).
+# A connection over the hard limit, or with an ack older than the timeout, is evicted;
+# it reconnects with its cursor and gets a 'sync' frame instead of the backlog.
+# ==============================================================================
+METRICS_KEY = 'ws:outbox:metrics'
+
+# أحداث غير أساسية: الأحدث يلغي ما قبله / Non-essential events: the newest replaces older ones
+COALESCE_KEYS = {
+    'typing': lambda e: ('typing', e.get('side')),
+    'presence': lambda e: ('presence', e.get('side')),
+    'read_receipt': lambda e: ('read_receipt', e.get('reader_id')),
+}
+
+# أعمدة توزيع أقصى عمق لكل اتصال / Buckets for the peak depth of each connection
+DEPTH_BUCKETS = (1, 10, 50, 100, 200)
+
+
+def coalesce_key(event):
+    key = COALESCE_KEYS.get(event.get('type'))
+    return key(event) if key else None
+
+
+class Outbox:
+    def __init__(self, write, high_water=None, max_depth=None, ack_timeout=None):
+        self.write = write
+        self.high_water = high_water or getattr(settings, 'WS_OUTBOX_HIGH_WATER', 50)
+        self.max_depth = max_depth or getattr(settings, 'WS_OUTBOX_MAX_DEPTH', 200)
+        self.ack_timeout = ack_timeout or getattr(settings, 'WS_ACK_TIMEOUT_SECONDS', 60)
+        self.queue = deque()
+        self.inflight = deque()  # (seq, sent_at)
+        self.acks_enabled = False
+        self.stats = Counter()
+        self.peak = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def depth(self):
+        return len(self.queue) + len(self.inflight)
+
+    def put(self, event):
+        """
+        يعيد False إذا يجب فصل الاتصال (عميل عالق)
+        Returns False when the connection should be evicted (stuck client).
+        """
+        if self.stuck():
+            return False
+
+        key = coalesce_key(event)
+        if key is not None and self.depth() >= self.high_water:
+            for i, queued in enumerate(self.queue):
+                if coalesce_key(queued) == key:
+                    self.queue[i] = event
+                    self.stats['coalesced'] += 1
+                    return True
+            # ضغط مرتفع والعميل سيعيد المزامنة لاحقاً: نسقط الحدث / Under pressure: drop, state resyncs later
+            if self.depth() >= self.max_depth:
+                self.stats['dropped'] += 1
+                return True
+
+        if self.depth() >= self.max_depth:
+            self.stats['dropped'] += 1
+            return False
+
+        self.queue.append(event)
+        self.stats['enqueued'] += 1
+        self.peak = max(self.peak, self.depth())
+        self.wakeup.set()
+        return True
+
+    def ack(self, seq):
+        """العميل استلم كل الرسائل حتى seq / The client has everything up to seq"""
+        self.acks_enabled = True
+        while self.inflight and self.inflight[0][0] <= seq:
+            self.inflight.popleft()
+
+    def stuck(self):
+        if len(self.queue) >= self.max_depth:
+            return True
+        if self.inflight and time.monotonic() - self.inflight[0][1] > self.ack_timeout:
+            return True
+        return False
+
+    def _track(self, event):
+        if not self.acks_enabled:
+            return
+        now = time.monotonic()
+        if event.get('type') in ('sync', 'message_batch'):
+            seqs = [m.get('seq') for m in event.get('messages', [])]
+        else:
+            seqs = [event.get('seq')] if event.get('type') == 'chat_message' else []
+        for seq in seqs:
+            if seq and (not self.inflight or seq > self.inflight[-1][0]):
+                self.inflight.append((seq, now))
+
+    async def run(self):
+        # كاتب واحد لكل اتصال: يفرغ الطابور بالترتيب / One writer per connection, drains in order
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            event = self.queue.popleft()
+            try:
+                await self.write(event)
+                self._track(event)
+            except Exception as e:
+                self.stats['dropped'] += 1
+                logger.warning(f"⚠️ WebSocket write failed: {e}")
+
+    async def close(self, evicted=False):
+        if self.task:
+            self.task.cancel()
+        if evicted:
+            self.stats['evicted'] += 1
+        await self.record()
+
+    async def record(self):
+        """يجمع عدادات الاتصال في Redis عند إغلاقه / Folds this connection's counters into Redis on close"""
+        bucket = next((f"peak_le_{b}" for b in DEPTH_BUCKETS if self.peak <= b), f"peak_gt_{DEPTH_BUCKETS[-1]}")
+        try:
+            redis = get_async_redis()
+            pipe = redis.pipeline()
+            for name, value in self.stats.items():
+                if value:
+                    pipe.hincrby(METRICS_KEY, name, value)
+            pipe.hincrby(METRICS_KEY, bucket, 1)
+            pipe.hincrby(METRICS_KEY, 'connections', 1)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Could not record outbox metrics: {e}")
+
+
+def outbox_snapshot():
+    """
+    عدادات التسليم لكل الاتصالات (للوحة التحكم) / Delivery counters across connections (dashboard)
+    """
+    try:
+        from django_redis import get_redis_connection
+        redis = get_redis_connection('default')
+        return {k.decode(): int(v) for k, v in redis.hgetall(METRICS_KEY).items()}
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read outbox metrics: {e}")
+        return {}
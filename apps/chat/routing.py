@@ -7,4 +7,6 @@ websocket_urlpatterns = [
     # هذا يغنيك عن كتابة Regex ويقبل الشرطات (-) تلقائياً
     # This saves you from writing Regex and accepts hyphens (-) automatically
     path('ws/chat/<uuid:session_id>/', consumers.ChatConsumer.as_asgi()),
+    # صندوق وارد الطاقم لكل الجلسات / Staff inbox for every session
+    path('ws/staff/inbox/', consumers.StaffInboxConsumer.as_asgi()),
 ]
\ No newline at end of file
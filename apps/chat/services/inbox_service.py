@@ -0,0 +1,74 @@
+import logging
+
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from django.db.models import F, Q
+
+from apps.chat.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class StaffInboxService:
+    """
+    قناة واحدة لكل الممرضين بأحداث على مستوى الجلسة (بدل اتصال لكل جلسة)
+    One push channel for all staff with session-level events (instead of one socket per session):
+        new_message  -> messages were saved (with the session's unread count after refugee messages)
+        priority     -> TriageService escalated or de-escalated the session
+        unread       -> staff read the session, so its unread count changed
+    Publishing never raises: the inbox is a convenience, the changelist still works on reload.
+    """
+    GROUP = 'staff_inbox'
+
+    @staticmethod
+    def unread_count(session_id):
+        """
+        رسائل اللاجئ بعد علامة قراءة الطاقم (استعلام واحد على فهرس الجلسة/الوقت)
+        Refugee messages past the staff watermark, one query on the (session, timestamp) index
+        """
+        return Message.objects.filter(
+            Q(session_id=session_id, sender_id=F('session__refugee_id')) & (
+                Q(session__staff_read_at__isnull=True) | Q(timestamp__gt=F('session__staff_read_at'))
+            )
+        ).count()
+
+    @classmethod
+    def payload(cls, event, session_id, **data):
+        return {
+            'type': 'inbox_event',
+            'payload': {'type': event, 'session_id': str(session_id), **data},
+        }
+
+    @classmethod
+    def publish(cls, event, session_id, **data):
+        try:
+            async_to_sync(get_channel_layer().group_send)(cls.GROUP, cls.payload(event, session_id, **data))
+        except Exception as e:
+            logger.warning(f"⚠️ Staff inbox publish failed: {e}")
+
+    @classmethod
+    def messages_created(cls, messages, from_staff):
+        """
+        حدث واحد لكل دفعة من جلسة واحدة (الرسالة المفردة دفعة من واحدة)
+        One event per saved batch from one session (a single message is a batch of one).
+        `from_staff` comes from the sender the caller already holds, so nothing is loaded per
+        message; a staff reply leaves the unread count unchanged, so its COUNT is skipped.
+        """
+        last = messages[-1]
+        data = {
+            'message_id': str(last.id),
+            'count': len(messages),
+            'from_staff': from_staff,
+            'timestamp': last.timestamp.isoformat(),
+        }
+        if not from_staff:
+            data['unread'] = cls.unread_count(last.session_id)
+        cls.publish('new_message', last.session_id, **data)
+
+    @classmethod
+    def message_created(cls, message, from_staff):
+        cls.messages_created([message], from_staff)
+
+    @classmethod
+    def priority_changed(cls, session_id, priority):
+        cls.publish('priority', session_id, priority=priority)
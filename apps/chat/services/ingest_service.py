@@ -0,0 +1,53 @@
+import logging
+
+from django.db import transaction
+from django.db.models.functions import Now
+
+from apps.chat.models import ChatSession, Message
+from apps.chat.tasks import process_message_batch_ai
+from .triage_service import TriageService
+from .inbox_service import StaffInboxService
+
+logger = logging.getLogger(__name__)
+
+
+class MessageIngestService:
+    """
+    إدخال دفعة رسائل نصية (طابور عدم الاتصال) بتكلفة رسالة واحدة تقريباً
+    Ingests a batch of text messages (offline queue) at roughly the cost of one:
+    one seq range, one bulk_create, one last_activity UPDATE, one Celery task.
+    bulk_create skips Message.save() and post_save, so the signal's side effects are done here once.
+    """
+    @staticmethod
+    def create_batch(session, sender, texts):
+        if not texts:
+            return []
+
+        # نطاق seq والإدخال في معاملة واحدة: قفل صف الجلسة يبقى حتى يُحفظ الإدخال
+        # Seq range and INSERT in one transaction: the session row stays locked until the batch commits
+        with transaction.atomic():
+            last_seq = ChatSession.allocate_seq(session.id, count=len(texts))
+            first_seq = last_seq - len(texts) + 1
+            messages = Message.objects.bulk_create([
+                Message(
+                    session=session,
+                    sender=sender,
+                    text_original=text,
+                    language_code=sender.native_language or '',
+                    seq=first_seq + i,
+                )
+                for i, text in enumerate(texts)
+            ])
+
+            # نفس منطق signals.py لكن مرة واحدة للدفعة / Same as signals.py, once per batch
+            ChatSession.objects.filter(id=session.id).update(last_activity=Now())
+            if sender.is_staff:
+                TriageService.deescalate_session(session.id)
+
+            ids = [str(m.id) for m in messages]
+            transaction.on_commit(lambda: process_message_batch_ai.delay(ids))
+            # حدث صندوق وارد واحد للدفعة / One staff inbox event for the whole batch
+            transaction.on_commit(lambda: StaffInboxService.messages_created(messages, from_staff=sender.is_staff))
+
+        logger.info(f"📦 Ingested {len(messages)} queued messages for session {session.id}.")
+        return messages
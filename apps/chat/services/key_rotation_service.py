@@ -0,0 +1,144 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.chat.models import Message, TranslationCache, ImageAnalysisCache, EncryptedTextField, EncryptedValue
+from apps.chat.crypto import (
+    current_keys, build_fernet, key_fingerprint, is_current, is_compressible_legacy, DECRYPT_ERROR, FORMAT_VERSION
+)
+
+logger = logging.getLogger(__name__)
+
+# الجداول المشفرة بالترتيب / Encrypted tables, in rotation order
+ROTATION_MODELS = [Message, TranslationCache, ImageAnalysisCache]
+
+
+class KeyRotationService:
+    """
+    إعادة تشفير كل الصفوف بالمفتاح الأساسي على دفعات صغيرة أثناء عمل النظام
+    Re-encrypts every row under the primary key in small keyset-paginated batches,
+    one short bulk_update transaction per batch, throttled to a target rows/s.
+    Progress is checkpointed in Redis, so the job can stop and resume at any point.
+    Each batch reads and writes under SELECT ... FOR UPDATE SKIP LOCKED, so a row being
+    saved by a task is never overwritten with the value read before that save; rows skipped
+    because they were locked are picked up by another sweep before the pass is marked done.
+    Rows are also moved to the current storage format (large legacy rows get compressed).
+    """
+    CHECKPOINT_KEY = 'key_rotation:checkpoint'
+    LOCK_KEY = 'key_rotation:lock'
+
+    def __init__(self, batch_size=None, rows_per_second=None, max_seconds=None):
+        self.batch_size = batch_size or getattr(settings, 'KEY_ROTATION_BATCH_SIZE', 500)
+        self.rows_per_second = rows_per_second or getattr(settings, 'KEY_ROTATION_ROWS_PER_SECOND', 200)
+        self.max_seconds = max_seconds or getattr(settings, 'KEY_ROTATION_MAX_SECONDS', 240)
+        self.keys = current_keys()
+        self.fernet = build_fernet(self.keys)
+        # المفتاح + إصدار الصيغة: أي تغيير في أحدهما يبدأ دورة جديدة / Key + format: a change in either starts a new pass
+        self.fingerprint = f"{key_fingerprint(self.keys)}-v{FORMAT_VERSION}"
+
+    @staticmethod
+    def encrypted_fields(model):
+        return [f for f in model._meta.concrete_fields if isinstance(f, EncryptedTextField)]
+
+    def checkpoint(self):
+        state = cache.get(self.CHECKPOINT_KEY)
+        # مفتاح أساسي جديد = دورة جديدة من البداية / New primary key = start a new pass
+        if not state or state.get('key') != self.fingerprint:
+            state = {
+                'key': self.fingerprint, 'model': 0, 'last_pk': None,
+                'scanned': 0, 'rotated': 0, 'skipped': 0, 'done': False,
+            }
+        return state
+
+    def rotate_batch(self, model, last_pk):
+        """
+        دفعة واحدة: يعيد (آخر pk، المفحوص، المعاد تشفيره، المتخطى لأنه مقفل)
+        One batch: (last pk, scanned, rotated, skipped because locked)
+        """
+        fields = self.encrypted_fields(model)
+        qs = model.objects.order_by('pk')
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+        pks = list(qs.values_list('pk', flat=True)[:self.batch_size])
+        if not pks:
+            return None, 0, 0, 0
+
+        with transaction.atomic():
+            # القراءة والكتابة في نفس المعاملة: لا نكتب فوق حفظ متزامن
+            # Read and write in one transaction so a concurrent save is never overwritten
+            rows = list(
+                model.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=pks).order_by('pk')
+                .only('pk', *[f.attname for f in fields])
+            )
+
+            stale = []
+            for obj in rows:
+                raw = [v for v in (obj.__dict__.get(f.attname) for f in fields) if isinstance(v, EncryptedValue)]
+                if all(
+                    is_current(self.keys, v.ciphertext) and not is_compressible_legacy(self.fernet, v.ciphertext)
+                    for v in raw
+                ):
+                    continue
+                # لا نكتب فوق بيانات لا يمكن فكها (مفتاح مفقود) / Never overwrite rows no configured key can read
+                if any(v.decrypt() == DECRYPT_ERROR for v in raw):
+                    logger.error(f"❌ {model.__name__} {obj.pk}: no configured key decrypts it, left untouched.")
+                    continue
+                stale.append(obj)
+
+            if stale:
+                # القراءة تفك بأي مفتاح (MultiFernet) والحفظ يشفر بالمفتاح الأساسي
+                # Reading decrypts with any key (MultiFernet); saving encrypts with the primary one
+                model.objects.bulk_update(stale, [f.name for f in fields])
+        return pks[-1], len(rows), len(stale), len(pks) - len(rows)
+
+    def run(self):
+        """
+        يعمل حتى max_seconds ثم يتوقف؛ يعيد True إذا انتهى كل شيء
+        Works for up to max_seconds, then yields; returns True when every table is done,
+        False when there is more to do, None if another worker holds the lock.
+        """
+        if not cache.add(self.LOCK_KEY, 1, timeout=self.max_seconds + 60):
+            logger.info("🔑 Key rotation already running elsewhere, skipping.")
+            return None
+
+        try:
+            state = self.checkpoint()
+            started = time.monotonic()
+            while state['model'] < len(ROTATION_MODELS):
+                if time.monotonic() - started > self.max_seconds:
+                    break
+
+                batch_started = time.monotonic()
+                model = ROTATION_MODELS[state['model']]
+                last_pk, scanned, rotated, skipped = self.rotate_batch(model, state['last_pk'])
+                if last_pk is None:
+                    logger.info(f"🔑 {model.__name__} re-encrypted under key {self.fingerprint}.")
+                    state['model'] += 1
+                    state['last_pk'] = None
+                    if state['model'] == len(ROTATION_MODELS) and state.get('skipped'):
+                        # صفوف كانت مقفلة: جولة أخرى (الصفوف الحالية تُفحص بـ HMAC فقط)
+                        # Some rows were locked: sweep again (current rows only cost an HMAC check)
+                        logger.info(f"🔑 {state['skipped']} locked rows skipped, starting another sweep.")
+                        state['model'] = 0
+                        state['skipped'] = 0
+                else:
+                    state['last_pk'] = str(last_pk)
+                    state['scanned'] += scanned
+                    state['rotated'] += rotated
+                    state['skipped'] = state.get('skipped', 0) + skipped
+                cache.set(self.CHECKPOINT_KEY, state, timeout=None)
+
+                # تحديد السرعة لحماية قاعدة البيانات / Throttle to the target rows/s
+                pause = scanned / self.rows_per_second - (time.monotonic() - batch_started)
+                if pause > 0:
+                    time.sleep(pause)
+
+            state['done'] = state['model'] >= len(ROTATION_MODELS)
+            cache.set(self.CHECKPOINT_KEY, state, timeout=None)
+            return state['done']
+        finally:
+            cache.delete(self.LOCK_KEY)
@@ -3,31 +3,107 @@ from asgiref.sync import async_to_sync
 
 class NotificationService:
     @staticmethod
-    def broadcast_message_update(message):
+    def serialize(message):
         """
-        إرسال تحديث للواجهة الأمامية (ممرض ولاجئ)
-        Send update to frontend (Nurse and Refugee)
+        شكل الرسالة كما تراه الواجهة (للبث وللمزامنة بعد الانقطاع)
+        Client-facing message shape, shared by broadcasts and reconnect sync
         """
-        if not message.session_id:
-            return
-
-        channel_layer = get_channel_layer()
-        
         payload = {
-            'type': 'chat_message',
             'id': str(message.id),
-            'sender_id': message.sender.id,
+            'seq': message.seq,
+            'version': message.version,
+            'sender_id': message.sender_id,
             'text_original': message.text_original,
             'text_translated': message.text_translated,
             'ai_analysis': message.ai_analysis,
             'is_urgent': message.is_urgent,
             'timestamp': message.timestamp.isoformat(),
         }
-
         if message.image:
             payload['image_url'] = message.image.url
+        if message.audio:
+            payload['audio_url'] = message.audio.url
+        return payload
+
+    @staticmethod
+    def serialize_changes(message, fields):
+        """الحقول التي تغيرت فقط، بأسماء الواجهة / Only the changed fields, under their client-facing names"""
+        changes = {}
+        for name in fields:
+            if name in ('image', 'audio'):
+                file = getattr(message, name)
+                changes[f'{name}_url'] = file.url if file else None
+            else:
+                changes[name] = getattr(message, name)
+        return changes
+
+    @staticmethod
+    def broadcast_message_update(message):
+        """
+        إرسال تحديث للواجهة الأمامية (ممرض ولاجئ)
+        Send update to frontend (Nurse and Refugee)
+        """
+        if not message.session_id:
+            return
+
+        channel_layer = get_channel_layer()
+
+        payload = {'type': 'chat_message', **NotificationService.serialize(message)}
 
         async_to_sync(channel_layer.group_send)(
             f'chat_{message.session_id}',
             payload
-        )
\ No newline at end of file
+        )
+
+    @staticmethod
+    def broadcast_message_patch(message, fields):
+        """
+        تحديث جزئي بعد المعالجة (ترجمة، تحليل، تفريغ صوت): الحقول المتغيرة فقط
+        Partial update after processing (translation, analysis, transcription): only the changed
+        fields plus a version, so clients merge it into the bubble and drop out-of-order patches.
+        The caller saves with Message.save_with_version first, so the version is already bumped.
+        """
+        if not message.session_id or not fields:
+            return
+
+        # يُبث دائماً: الحضور قد يتأخر عن اتصال جديد، والمزامنة لا تعيد إلا seq أحدث
+        # Always published: presence can lag a fresh connection, and resume only replays newer seqs
+
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            f'chat_{message.session_id}',
+            {
+                'type': 'message_patch',
+                'id': str(message.id),
+                'version': message.version,
+                'sender_id': message.sender_id,
+                **NotificationService.serialize_changes(message, fields),
+            }
+        )
+
+    @staticmethod
+    def broadcast_message_patches(messages, fields):
+        """
+        نفس message_patch لدفعة رسائل من جلسة واحدة: بث واحد
+        message_patch for a batch from one session: one group_send. The caller saves with
+        Message.bulk_update_with_version first.
+        """
+        if not messages or not fields or not messages[0].session_id:
+            return
+
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            f'chat_{messages[0].session_id}',
+            {
+                'type': 'patch_batch',
+                'patches': [
+                    {
+                        'id': str(m.id),
+                        'version': m.version,
+                        'sender_id': m.sender_id,
+                        **NotificationService.serialize_changes(m, fields),
+                    }
+                    for m in messages
+                ],
+            }
+        )
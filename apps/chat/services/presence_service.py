@@ -0,0 +1,86 @@
+import time
+import logging
+
+from django.conf import settings
+
+from apps.core.async_redis import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceService:
+    """
+    سجل الحضور في Redis فقط (بدون أي كتابة في قاعدة البيانات)
+    Ephemeral presence registry, Redis only. One sorted set per session:
+        presence:{session_id}  member "{side}:{user_id}:{channel_name}"  score = last heartbeat
+    A connection counts as online while its heartbeat is younger than PRESENCE_TTL_SECONDS,
+    so crashed workers age out without cleanup. Every call fails open.
+    """
+    STAFF = 'staff'
+    REFUGEE = 'refugee'
+
+    @staticmethod
+    def key(session_id):
+        return f"presence:{session_id}"
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, 'PRESENCE_TTL_SECONDS', 60)
+
+    @staticmethod
+    def side_of(user):
+        return PresenceService.STAFF if user.is_staff else PresenceService.REFUGEE
+
+    @classmethod
+    def member(cls, user, channel_name):
+        return f"{cls.side_of(user)}:{user.id}:{channel_name}"
+
+    @classmethod
+    def _sides(cls, members):
+        return {m.decode().split(':', 1)[0] for m in members}
+
+    @classmethod
+    async def touch(cls, session_id, user, channel_name):
+        """
+        اتصال أو نبضة: يعيد True إذا أصبح هذا الطرف متصلاً الآن
+        Join or heartbeat. Returns True when this side just came online (worth broadcasting).
+        """
+        key, now, ttl = cls.key(session_id), time.time(), cls.ttl()
+        try:
+            redis = get_async_redis()
+            pipe = redis.pipeline()
+            pipe.zremrangebyscore(key, 0, now - ttl)
+            pipe.zrange(key, 0, -1)
+            pipe.zadd(key, {cls.member(user, channel_name): now})
+            pipe.expire(key, ttl * 2)
+            _, before, _, _ = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Presence unavailable: {e}")
+            return False
+        return cls.side_of(user) not in cls._sides(before)
+
+    @classmethod
+    async def leave(cls, session_id, user, channel_name):
+        """يعيد True إذا لم يبقَ أحد من هذا الطرف / Returns True when nobody from this side is left"""
+        key = cls.key(session_id)
+        try:
+            redis = get_async_redis()
+            pipe = redis.pipeline()
+            pipe.zrem(key, cls.member(user, channel_name))
+            pipe.zrangebyscore(key, time.time() - cls.ttl(), '+inf')
+            _, remaining = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Presence unavailable: {e}")
+            return False
+        return cls.side_of(user) not in cls._sides(remaining)
+
+    @classmethod
+    async def online_sides(cls, session_id):
+        """None = غير معروف (Redis متوقف) / None = unknown (Redis down), callers should assume online"""
+        try:
+            redis = get_async_redis()
+            members = await redis.zrangebyscore(cls.key(session_id), time.time() - cls.ttl(), '+inf')
+        except Exception as e:
+            logger.warning(f"⚠️ Presence unavailable: {e}")
+            return None
+        return cls._sides(members)
@@ -1,4 +1,5 @@
 from apps.chat.models import DangerKeyword, ChatSession
+from .inbox_service import StaffInboxService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,11 +36,14 @@ class TriageService:
     def escalate_session(session_id):
         """تحويل الجلسة إلى طبيب (أحمر) / Escalate session to doctor (Red)"""
         if session_id:
-            ChatSession.objects.filter(id=session_id).update(priority=2)
-            logger.info(f"Session {session_id} escalated to DOCTOR.")
+            # التحديث والإشعار فقط عند تغير الأولوية فعلاً / Write and notify only when the priority actually changes
+            if ChatSession.objects.filter(id=session_id).exclude(priority=2).update(priority=2):
+                logger.info(f"Session {session_id} escalated to DOCTOR.")
+                StaffInboxService.priority_changed(session_id, 2)
 
     @staticmethod
     def deescalate_session(session_id):
         """إعادة الجلسة لممرض (أخضر) / De-escalate session to nurse (Green)"""
         if session_id:
-            ChatSession.objects.filter(id=session_id).update(priority=1)
\ No newline at end of file
+            if ChatSession.objects.filter(id=session_id).exclude(priority=1).update(priority=1):
+                StaffInboxService.priority_changed(session_id, 1)
\ No newline at end of file
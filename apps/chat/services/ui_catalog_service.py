@@ -0,0 +1,111 @@
+import json
+import hashlib
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# النصوص الثابتة التي يراها اللاجئ (المصدر بالإنجليزية)
+# Static refugee-facing strings (English source)
+# ==============================================================================
+UI_STRINGS = {
+    'privacy_warning': "🔒 For your privacy, do not write your name or health ID here. We identify you automatically.",
+    'chat_title': "Conversation with the nurse",
+    'nurse_label': "Nurse",
+    'input_placeholder': "Write your message here...",
+    'recording_hint': "Recording... Release to send",
+    'delete_account': "Delete Account",
+    'delete_account_confirm': "Are you sure you want to delete your account permanently? This action cannot be undone and all your medical history will be lost.",
+    'logout': "Logout",
+    'send_image': "Send image",
+    'hold_to_record': "Hold to Record",
+    'nurse_online': "Nurse is online",
+    'nurse_typing': "Nurse is typing...",
+}
+
+SOURCE_LANGUAGE = 'en'
+
+
+def _compute_version():
+    raw = json.dumps(UI_STRINGS, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:12]
+
+
+CATALOG_VERSION = _compute_version()
+
+
+class UICatalogService:
+    """
+    فهرس نصوص الواجهة مترجم مسبقاً لكل لغة (يُبنى عند النشر)
+    Per-language UI catalog, pre-translated at deploy time by `warm_ui_catalog`.
+    Versioned by a hash of the source strings, so it only rebuilds when they change.
+    Views read from process memory (zero I/O), then Redis once per process. If Redis
+    lost it (restart, eviction) the page shows English and one Celery task rebuilds it.
+    """
+    _memory = {}
+
+    @staticmethod
+    def cache_key(language, version=CATALOG_VERSION):
+        return f"ui_catalog:{version}:{language}"
+
+    @classmethod
+    def get(cls, language):
+        if not language or language == SOURCE_LANGUAGE:
+            return dict(UI_STRINGS)
+
+        entry = cls._memory.get(language)
+        if entry is not None:
+            return entry
+
+        try:
+            entry = cache.get(cls.cache_key(language))
+        except Exception as e:
+            logger.warning(f"⚠️ UI catalog read error: {e}")
+            entry = None
+
+        if entry is None:
+            # لا نتصل بـ Azure أثناء عرض الصفحة: نعود للإنجليزية ونعيد البناء في الخلفية
+            # Never call Azure on a page view: fall back to English and rebuild in the background
+            cls.schedule_build(language)
+            return dict(UI_STRINGS)
+
+        # نملأ الناقص من المصدر / Fill any missing key from the source strings
+        entry = {**UI_STRINGS, **entry}
+        cls._memory[language] = entry
+        return entry
+
+    @classmethod
+    def schedule_build(cls, language):
+        """مهمة بناء واحدة لكل لغة وليس لكل صفحة / One rebuild task per language, not one per page view"""
+        try:
+            if not cache.add(f"{cls.cache_key(language)}:building", 1, timeout=300):
+                return
+            from apps.chat.tasks import build_ui_catalog
+            build_ui_catalog.delay(language)
+            logger.warning(f"⚠️ UI catalog missing for '{language}' (v{CATALOG_VERSION}), rebuilding in the background.")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not schedule UI catalog rebuild for '{language}': {e}")
+
+    @classmethod
+    def is_built(cls, language):
+        return cache.get(cls.cache_key(language)) is not None
+
+    @classmethod
+    def build(cls, translator, language):
+        """ترجمة كل النصوص للغة واحدة وحفظها / Translate every string for one language and store it"""
+        keys = list(UI_STRINGS.keys())
+        translated = translator.translate_many([UI_STRINGS[k] for k in keys], SOURCE_LANGUAGE, language)
+        if all(text == UI_STRINGS[key] for key, text in zip(keys, translated)):
+            # فشلت الترجمة بالكامل: لا نحفظ نسخة إنجليزية على أنها مترجمة
+            # Translation failed entirely: don't store English as the translated catalog
+            logger.error(f"❌ UI catalog build failed for '{language}'")
+            return None
+        entry = {
+            key: (text or UI_STRINGS[key])
+            for key, text in zip(keys, translated)
+        }
+        cache.set(cls.cache_key(language), entry, timeout=None)
+        cls._memory[language] = entry
+        return entry
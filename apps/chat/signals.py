@@ -5,6 +5,7 @@ from django.db.models.functions import Now
 from .models import Message, ChatSession
 from .tasks import process_message_ai
 from .services.triage_service import TriageService
+from .services.inbox_service import StaffInboxService
 
 import os
 from django.db.models.signals import post_delete
@@ -43,7 +44,10 @@ def message_post_save(sender, instance, created, **kwargs):
     refugee_needs_processing = (
         is_refugee and (
             (instance.text_original and not instance.text_translated) or
-            (instance.image and not instance.ai_analysis)
+            (instance.image and not instance.ai_analysis) or
+            # ترجمها ChatConsumer مباشرة: الفرز الطبي ما زال في Celery
+            # Translated inline by ChatConsumer: medical triage still runs in Celery
+            (created and instance.text_original)
         )
     )
 
@@ -62,6 +66,11 @@ def message_post_save(sender, instance, created, **kwargs):
         # Use on_commit to ensure data is saved before Worker starts
         transaction.on_commit(lambda: process_message_ai.delay(str(instance.id))) 
 
+    # 5. إشعار صندوق الوارد للطاقم (رسالة جديدة فقط)
+    # 5. Staff inbox push (new messages only)
+    if created and instance.session_id:
+        transaction.on_commit(lambda: StaffInboxService.message_created(instance, from_staff=is_nurse))
+
 
 
 @receiver(post_delete, sender=Message)
@@ -4,16 +4,22 @@ import logging
 from celery import shared_task
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
 from datetime import timedelta
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from openai import AzureOpenAI
 
-from .models import Message, EpidemicAlert
+from .models import Message, EpidemicAlert, TranslationCache, ChatSession
 from .services.image_service import ImageService
 from .services.triage_service import TriageService
 from .services.notification_service import NotificationService
+from .services.key_rotation_service import KeyRotationService
+from .services.ui_catalog_service import UICatalogService
 from apps.core.services import AzureTranslator
+from apps.core.backends import get_backend
+from apps.core.rate_limit import TranslatorThrottled
+from apps.core.cache_layers import usage_tracker
+from apps.core.circuit_breaker import CircuitBreaker, CircuitOpen, WHISPER, is_openai_outage
 from apps.core.vision_analysis import MedicalImageAnalyzer
 
 logger = logging.getLogger(__name__)
@@ -22,8 +28,8 @@ logger = logging.getLogger(__name__)
 # 🎙️ Audio Transcription Task (New Addition)
 # ==============================================================================
 
-@shared_task
-def transcribe_voice_note(message_id):
+@shared_task(bind=True, max_retries=10)
+def transcribe_voice_note(self, message_id):
     """
     مهمة خلفية لتحويل الصوت إلى نص باستخدام Azure OpenAI (Whisper)
     """
@@ -39,14 +45,16 @@ def transcribe_voice_note(message_id):
             logger.warning(f"⚠️ Message {message_id} has no audio file.")
             return
 
+        # إذا كانت خدمة Whisper معطلة لا ننتظر المهلة، نعيد المحاولة بعد فترة التعافي
+        # If Whisper is down, skip the timeout and retry once the breaker may half-open
+        breaker = CircuitBreaker(WHISPER, is_outage=is_openai_outage)
+        if not breaker.allow():
+            raise CircuitOpen(WHISPER)
+
         logger.info(f"🎙️ Transcribing audio for message {message_id}...")
 
-        # 2. إعداد عميل Azure OpenAI
-        client = AzureOpenAI(
-            api_key=settings.AZURE_OPENAI_KEY,
-            api_version="2024-02-01",
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT
-        )
+        # 2. إعداد عميل Azure OpenAI (أو البديل المحلي حسب AI_BACKENDS)
+        client = get_backend('transcription')
 
         # 3. معالجة الملف (تحميله مؤقتاً لأن Azure API يحتاج ملفاً فعلياً)
         # نحصل على الامتداد (.webm, .wav, .mp3)
@@ -63,34 +71,27 @@ def transcribe_voice_note(message_id):
             # 4. الإرسال إلى Azure Whisper
             with open(temp_file_path, "rb") as audio_file:
                 # 🛑 تأكد أن اسم الـ Deployment في Azure هو "whisper"
-                result = client.audio.transcriptions.create(
-                    model="whisper", 
-                    file=audio_file,
-                )
+                try:
+                    result = client.audio.transcriptions.create(
+                        model="whisper", 
+                        file=audio_file,
+                    )
+                except Exception as api_error:
+                    if is_openai_outage(api_error):
+                        breaker.record_failure()
+                    raise
+                breaker.record_success()
             
             transcribed_text = result.text
             logger.info(f"✅ Transcription result: {transcribed_text}")
 
             # 5. تحديث الرسالة
             message.text_original = transcribed_text
-            message.save()
+            message.save_with_version(['text_original'])
 
             # 6. إرسال التحديث للشات (Real-time update)
-            # لتحديث النص "Processing..." إلى النص الحقيقي
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f'chat_{message.session.id}',
-                {
-                    'type': 'chat_message',
-                    'id': str(message.id),
-                    'sender_id': message.sender.id,
-                    'text_original': message.text_original, # النص الجديد
-                    'text_translated': message.text_translated,
-                    'timestamp': message.timestamp.isoformat(),
-                    'is_read': message.is_read,
-                    'audio_url': message.audio.url, 
-                }
-            )
+            # لتحديث النص "Processing..." إلى النص الحقيقي (النص الجديد فقط بدل الرسالة كاملة)
+            NotificationService.broadcast_message_patch(message, ['text_original'])
             
             # 🛑 بعد تحويل الصوت لنص، نرسل الرسالة لمهمة المعالجة (ترجمة + تحليل خطر)
             # لكي يتم ترجمة النص الصوتي أيضاً
@@ -101,6 +102,9 @@ def transcribe_voice_note(message_id):
             if os.path.exists(temp_file_path):
                 os.remove(temp_file_path)
 
+    except CircuitOpen as e:
+        logger.warning(f"🔌 Whisper circuit open, retrying message {message_id} in {breaker.recovery_timeout}s.")
+        raise self.retry(countdown=breaker.recovery_timeout, exc=e)
     except Exception as e:
         logger.error(f"❌ Error transcribing audio: {e}")
 
@@ -108,24 +112,18 @@ def transcribe_voice_note(message_id):
 # 🤖 Existing AI Processing Task
 # ==============================================================================
 
-@shared_task
-def process_message_ai(message_id):
+@shared_task(bind=True, max_retries=8)
+def process_message_ai(self, message_id):
     try:
         # جلب الرسالة مع البيانات المرتبطة
         message = Message.objects.select_related('session', 'sender', 'session__refugee').get(id=message_id)
         fields_to_update = []
         is_urgent_detected = False
 
-        # 1. ضغط الصورة
-        if message.image:
-            compressed = ImageService.compress_image(message.image)
-            if compressed:
-                filename = os.path.basename(message.image.name)
-                filename = os.path.splitext(filename)[0] + '.jpg'
-                message.image.save(filename, compressed, save=False)
-                fields_to_update.append('image')
-
-        # 2. الترجمة (للصوت المفرغ أو النص العادي)
+        # 1. الترجمة أولاً (للصوت المفرغ أو النص العادي): قد ترفع TranslatorThrottled فتُعاد المهمة،
+        # لذلك لا نرفع أي ملف قبلها (وإلا كل إعادة ترفع نسخة جديدة وتترك القديمة يتيمة)
+        # 1. Translate first: it may raise TranslatorThrottled and retry the task, so no file is
+        # uploaded before it (otherwise every retry would upload a new copy and orphan the last one)
         if message.text_original and not message.text_translated:
             translator = AzureTranslator()
             
@@ -143,9 +141,19 @@ def process_message_ai(message_id):
             message.text_translated = translation
             fields_to_update.append('text_translated')
 
-            if message.sender.role == 'REFUGEE':
-                if TriageService.check_for_danger(translation):
-                    is_urgent_detected = True
+        # الفرز على الترجمة سواء جاءت من هنا أو من ChatConsumer / Triage the translation whether it came from here or ChatConsumer
+        if message.sender.role == 'REFUGEE' and message.text_translated:
+            if TriageService.check_for_danger(message.text_translated):
+                is_urgent_detected = True
+
+        # 2. ضغط الصورة
+        if message.image:
+            compressed = ImageService.compress_image(message.image)
+            if compressed:
+                filename = os.path.basename(message.image.name)
+                filename = os.path.splitext(filename)[0] + '.jpg'
+                message.image.save(filename, compressed, save=False)
+                fields_to_update.append('image')
 
         # 3. تحليل الصورة
         if message.image and not message.ai_analysis:
@@ -165,15 +173,79 @@ def process_message_ai(message_id):
 
         # 5. الحفظ والإشعار
         if fields_to_update:
-            message.save(update_fields=fields_to_update)
-            NotificationService.broadcast_message_update(message)
+            message.save_with_version(fields_to_update)
+            NotificationService.broadcast_message_patch(message, fields_to_update)
             logger.info(f"Message {message_id} processed successfully.")
 
+    except TranslatorThrottled as e:
+        # بدلاً من النوم داخل العامل نعيد جدولة المهمة / Reschedule instead of blocking the worker
+        logger.warning(f"⏳ Message {message_id} deferred: {e}")
+        raise self.retry(countdown=e.retry_after, exc=e)
     except Message.DoesNotExist:
         logger.error(f"Message {message_id} not found.")
     except Exception as e:
         logger.error(f"Task processing error: {e}")
 
+@shared_task(bind=True, max_retries=8)
+def process_message_batch_ai(self, message_ids):
+    """
+    نسخة الدفعات من process_message_ai لرسائل النص (طابور عدم الاتصال)
+    Batched process_message_ai for text messages from one sender: one translate_many call,
+    one bulk_update and one broadcast for the whole batch.
+    """
+    try:
+        messages = [
+            m for m in Message.objects.filter(id__in=message_ids)
+            .select_related('session', 'sender', 'session__refugee').order_by('seq')
+            if m.text_original and not m.text_translated
+        ]
+        if not messages:
+            return
+
+        first = messages[0]
+        is_refugee = first.sender.role == 'REFUGEE'
+        target_lang = 'no' if is_refugee else first.session.refugee.native_language
+        translations = AzureTranslator().translate_many(
+            [m.text_original for m in messages],
+            first.language_code or 'en',
+            target_lang
+        )
+
+        is_urgent_detected = False
+        for message, translation in zip(messages, translations):
+            message.text_translated = translation
+            if is_refugee and TriageService.check_for_danger(translation):
+                message.is_urgent = True
+                is_urgent_detected = True
+
+        fields = ['text_translated', 'is_urgent']
+        Message.bulk_update_with_version(messages, fields)
+        if is_urgent_detected:
+            TriageService.escalate_session(first.session_id)
+
+        NotificationService.broadcast_message_patches(messages, fields)
+        logger.info(f"Batch of {len(messages)} messages processed successfully.")
+
+    except TranslatorThrottled as e:
+        logger.warning(f"⏳ Message batch deferred: {e}")
+        raise self.retry(countdown=e.retry_after, exc=e)
+    except Exception as e:
+        logger.error(f"Batch processing error: {e}")
+
+@shared_task(bind=True, max_retries=5)
+def build_ui_catalog(self, language):
+    """
+    يعيد بناء فهرس الواجهة للغة واحدة إذا اختفى من Redis (مثلاً بعد إعادة التشغيل)
+    Rebuilds one language's UI catalog when it went missing from Redis (e.g. after a restart)
+    """
+    if UICatalogService.is_built(language):
+        return
+    try:
+        UICatalogService.build(AzureTranslator(), language)
+    except TranslatorThrottled as e:
+        logger.warning(f"⏳ UI catalog '{language}' deferred: {e}")
+        raise self.retry(countdown=e.retry_after, exc=e)
+
 # ==============================================================================
 # 🦠 Epidemic Early Warning Task
 # ==============================================================================
@@ -193,7 +265,7 @@ def check_epidemic_outbreak():
     recent_messages = Message.objects.filter(
         timestamp__gte=time_threshold,
         sender__role='REFUGEE'
-    ).select_related('session')
+    ).select_related('session').decrypted('text_translated', 'ai_analysis')
 
     detected_cases = {k: set() for k in epidemic_signatures.keys()}
 
@@ -204,7 +276,7 @@ def check_epidemic_outbreak():
         for category, keywords in epidemic_signatures.items():
             for word in keywords:
                 if word in text_content:
-                    detected_cases[category].add(msg.session.refugee.id)
+                    detected_cases[category].add(msg.session.refugee_id)
                     break 
 
     for category, affected_users in detected_cases.items():
@@ -251,4 +323,117 @@ def delete_old_data():
         count += 1
 
     if count > 0:
-        logger.info(f"🧹 GDPR Cleanup: Deleted {count} old messages.")
\ No newline at end of file
+        logger.info(f"🧹 GDPR Cleanup: Deleted {count} old messages.")
+
+# ==============================================================================
+# 🗂️ Translation Cache Maintenance
+# ==============================================================================
+
+@shared_task
+def flush_translation_cache_usage():
+    """
+    كتابة عدادات الاستخدام المتراكمة في Redis إلى الجدول على دفعات
+    Write-behind: apply the hit counters accumulated in Redis in batched UPDATEs
+    (one UPDATE per distinct hit count and chunk, not one per hit).
+    """
+    usage_tracker.push()
+    try:
+        usage = usage_tracker.drain()
+    except Exception as e:
+        logger.warning(f"⚠️ Could not drain cache usage: {e}")
+        return
+
+    if not usage:
+        return
+
+    by_count = {}
+    for key, hits in usage.items():
+        by_count.setdefault(hits, []).append(key)
+
+    now = timezone.now()
+    CHUNK = 500
+    with transaction.atomic():
+        for hits, keys in by_count.items():
+            for i in range(0, len(keys), CHUNK):
+                condition = Q()
+                for text_hash, src, dest in keys[i:i + CHUNK]:
+                    condition |= Q(source_hash=text_hash, source_language=src, target_language=dest)
+                TranslationCache.objects.filter(condition).update(
+                    hit_count=F('hit_count') + hits,
+                    last_used_at=now
+                )
+
+    logger.info(f"🗂️ Cache usage flushed for {len(usage)} entries.")
+
+
+@shared_task
+def evict_translation_cache():
+    """
+    إبقاء جدول الكاش ضمن الحد المسموح (LRU أو LFU)
+    Keep TranslationCache within TRANSLATION_CACHE_MAX_ROWS using an LRU or LFU policy.
+    """
+    budget = getattr(settings, 'TRANSLATION_CACHE_MAX_ROWS', 50000)
+    policy = getattr(settings, 'TRANSLATION_CACHE_EVICTION_POLICY', 'lru')
+
+    total = TranslationCache.objects.count()
+    excess = total - budget
+    if excess <= 0:
+        return
+
+    last_used = Coalesce('last_used_at', 'created_at')
+    if policy == 'lfu':
+        ordering = ['hit_count', last_used.asc()]
+    else:
+        ordering = [last_used.asc(), 'hit_count']
+
+    # نجلب المعرفات فقط (بدون فك تشفير) / Fetch ids only (no decryption)
+    victims = list(
+        TranslationCache.objects.order_by(*ordering).values_list('id', flat=True)[:excess]
+    )
+
+    deleted = 0
+    CHUNK = 1000
+    for i in range(0, len(victims), CHUNK):
+        deleted += TranslationCache.objects.filter(id__in=victims[i:i + CHUNK]).delete()[0]
+
+    logger.info(f"🧹 Translation cache eviction ({policy}): removed {deleted} of {total} rows.")
+
+
+@shared_task
+def apply_read_watermarks():
+    """
+    تحديث is_read متأخراً من علامات القراءة (تحديث واحد لكل جلسة وطرف)
+    Lazily backfill is_read from the read watermarks: one UPDATE per active session and side
+    """
+    since = timezone.now() - timedelta(minutes=15)
+    sessions = ChatSession.objects.filter(
+        Q(refugee_read_at__gte=since) | Q(staff_read_at__gte=since)
+    ).values('id', 'refugee_id', 'refugee_read_at', 'staff_read_at')
+
+    updated = 0
+    for session in sessions:
+        unread = Message.objects.filter(session_id=session['id'], is_read=False)
+        if session['staff_read_at']:
+            updated += unread.filter(
+                sender_id=session['refugee_id'], timestamp__lte=session['staff_read_at']
+            ).update(is_read=True)
+        if session['refugee_read_at']:
+            updated += unread.exclude(sender_id=session['refugee_id']).filter(
+                timestamp__lte=session['refugee_read_at']
+            ).update(is_read=True)
+
+    if updated:
+        logger.info(f"✔✔ {updated} messages marked read from watermarks.")
+
+
+@shared_task
+def rotate_encryption_keys():
+    """
+    إعادة تشفير البيانات بالمفتاح الجديد على مراحل قصيرة (تستأنف من نقطة الحفظ)
+    Re-encrypt data under the new primary key in short runs, each resuming from the checkpoint
+    """
+    done = KeyRotationService().run()
+    if done is False:
+        rotate_encryption_keys.apply_async(countdown=1)
+    elif done:
+        logger.info("🔑 Key rotation finished, old keys can be removed from DB_ENCRYPTION_KEYS.")
@@ -1,8 +1,37 @@
-from django.test import TestCase
+import os
+import uuid
+import asyncio
+from io import StringIO
+from types import SimpleNamespace
+from datetime import timedelta
+from contextlib import contextmanager, ExitStack
+from django.test import TestCase, SimpleTestCase, override_settings
 from django.contrib.auth import get_user_model
-from unittest.mock import patch  # أداة المحاكاة (Mocking) / Mocking tool
-from .models import ChatSession, Message, DangerKeyword
-from .tasks import process_message_ai  # نستورد المهمة لتشغيلها يدوياً / Import task to run manually
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.transaction import TransactionManagementError
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from cryptography.fernet import Fernet
+from asgiref.sync import async_to_sync
+from unittest.mock import patch, AsyncMock, MagicMock  # أداة المحاكاة (Mocking) / Mocking tool
+from apps.core.rate_limit import TranslatorThrottled
+from .models import ChatSession, Message, DangerKeyword, EncryptedTextField, EncryptedValue
+from .tasks import process_message_ai, process_message_batch_ai, transcribe_voice_note, apply_read_watermarks  # نستورد المهمة لتشغيلها يدوياً / Import task to run manually
+from .services.ui_catalog_service import UICatalogService, UI_STRINGS
+from .crypto import encrypt_many, decrypt_many, build_fernet, is_current, is_compressible_legacy, ZLIB_PREFIX
+from .outbox import Outbox
+from .wire import MsgpackCodec, JsonCodec, negotiate, MSGPACK, MSGPACK_DEFLATE, RAW, DEFLATED
+from .consumers import ChatConsumer
+from .services.key_rotation_service import KeyRotationService, ROTATION_MODELS
+from .services.notification_service import NotificationService
+from .services.ingest_service import MessageIngestService
+from .services.presence_service import PresenceService
+from .services.inbox_service import StaffInboxService
+from .services.triage_service import TriageService
 
 User = get_user_model()
 
@@ -97,6 +126,44 @@ class TriageSystemTest(TestCase):
         self.assertTrue(msg.is_urgent) # الرسالة تم تمييزها كطارئة / Message marked as urgent
         self.assertEqual(self.session.priority, 2) # الجلسة تحولت لطبيب / Session changed to Doctor
 
+    @patch('apps.core.services.AzureTranslator.translate')
+    def test_inline_translated_message_is_still_triaged(self, mock_translate):
+        """
+        رسالة ترجمها ChatConsumer مباشرة: لا ترجمة ثانية لكن الفرز الطبي يعمل
+        A message translated inline by ChatConsumer: no second translation, triage still runs
+        """
+        msg = Message.objects.create(
+            session=self.session,
+            sender=self.refugee,
+            text_original="لدي دم كثير",
+            text_translated="Jeg har mye blod"
+        )
+
+        process_message_ai(str(msg.id))
+
+        mock_translate.assert_not_called()
+        msg.refresh_from_db()
+        self.assertTrue(msg.is_urgent)
+
+    @patch('apps.chat.tasks.ImageService.compress_image')
+    @patch('apps.core.services.AzureTranslator.translate', side_effect=TranslatorThrottled(5))
+    def test_throttled_translation_uploads_nothing(self, mock_translate, mock_compress):
+        """
+        الترجمة قبل رفع الصورة: إعادة المهمة لا تترك ملفات يتيمة
+        Translation runs before the image upload, so a retried task leaves no orphaned files
+        """
+        msg = Message.objects.create(
+            session=self.session,
+            sender=self.refugee,
+            text_original="مرحبا",
+            image='chat_images/rash.png'
+        )
+
+        with self.assertRaises(TranslatorThrottled):
+            process_message_ai(str(msg.id))
+
+        mock_compress.assert_not_called()
+
     def test_nurse_reply_deescalation(self):
         """
         اختبار 3: رد الممرض.
@@ -122,4 +189,1032 @@ class TriageSystemTest(TestCase):
         # ثالثاً: التحقق
         # Third: Verify
         self.session.refresh_from_db()
-        self.assertEqual(self.session.priority, 1) # يجب أن تعود خضراء / Should return green
\ No newline at end of file
+        self.assertEqual(self.session.priority, 1) # يجب أن تعود خضراء / Should return green
+
+class UICatalogTest(SimpleTestCase):
+    def setUp(self):
+        UICatalogService._memory.clear()
+
+    @patch('apps.chat.tasks.build_ui_catalog.delay')
+    @patch('apps.chat.services.ui_catalog_service.cache')
+    def test_missing_catalog_falls_back_to_english_without_translating(self, mock_cache, mock_delay):
+        """
+        إذا لم يُبنَ الفهرس (أو فقده Redis) نعرض الإنجليزية ونعيد البناء في Celery
+        If the catalog is not built (or Redis lost it) we show English and rebuild it in Celery
+        """
+        mock_cache.get.return_value = None
+        mock_cache.add.return_value = True
+
+        ui = UICatalogService.get('ar')
+
+        self.assertEqual(ui['privacy_warning'], UI_STRINGS['privacy_warning'])
+        mock_delay.assert_called_once_with('ar')
+
+    @patch('apps.chat.tasks.build_ui_catalog.delay')
+    @patch('apps.chat.services.ui_catalog_service.cache')
+    def test_rebuild_is_scheduled_once_per_language(self, mock_cache, mock_delay):
+        mock_cache.get.return_value = None
+        mock_cache.add.return_value = False  # مهمة قيد التنفيذ / a rebuild is already queued
+
+        UICatalogService.get('ar')
+
+        mock_delay.assert_not_called()
+
+    @patch('apps.chat.management.commands.warm_ui_catalog.AzureTranslator')
+    @patch('apps.chat.services.ui_catalog_service.UICatalogService.is_built', return_value=False)
+    @patch('apps.chat.services.ui_catalog_service.UICatalogService.build')
+    def test_warm_up_keeps_finished_languages_when_throttled(self, mock_build, mock_is_built, mock_translator):
+        """
+        عند 429 يتوقف التسخين لكن اللغات المبنية تبقى محفوظة
+        A throttled warm-up stops, but the languages it finished stay stored
+        """
+        mock_build.side_effect = [{'logout': 'تسجيل الخروج'}, TranslatorThrottled(30), {'logout': 'x'}]
+        out = StringIO()
+
+        call_command('warm_ui_catalog', stdout=out, stderr=StringIO())
+
+        self.assertEqual(mock_build.call_count, 2)
+        self.assertIn("1 built", out.getvalue())
+
+    @patch('apps.chat.services.ui_catalog_service.cache')
+    def test_catalog_is_memoised_in_process(self, mock_cache):
+        mock_cache.get.return_value = {'logout': 'تسجيل الخروج'}
+
+        UICatalogService.get('ar')
+        ui = UICatalogService.get('ar')
+
+        self.assertEqual(ui['logout'], 'تسجيل الخروج')
+        self.assertEqual(ui['chat_title'], UI_STRINGS['chat_title'])
+        self.assertEqual(mock_cache.get.call_count, 1)  # مرة واحدة فقط / only once
+
+class LazyDecryptionTest(SimpleTestCase):
+    def setUp(self):
+        self.field = EncryptedTextField()
+        self.ciphertext = self.field.get_prep_value("مرحبا")
+
+    def test_value_is_not_decrypted_until_used(self):
+        """
+        فك التشفير يحدث عند الاستخدام فقط ومرة واحدة
+        Decryption happens on use only, and once
+        """
+        value = self.field.from_db_value(self.ciphertext, None, None)
+        self.assertIsInstance(value, EncryptedValue)
+        self.assertFalse(value.is_decrypted)
+
+        self.assertEqual(str(value), "مرحبا")
+        self.assertTrue(value.is_decrypted)
+
+    def test_untouched_value_is_saved_without_re_encryption(self):
+        value = self.field.from_db_value(self.ciphertext, None, None)
+
+        self.assertEqual(self.field.get_prep_value(value), self.ciphertext)
+        self.assertFalse(value.is_decrypted)
+
+
+class BulkCryptoTest(SimpleTestCase):
+    def test_bulk_round_trip_keeps_order_across_chunks(self):
+        texts = [f"melding {i}" for i in range(7)] + [""]
+
+        ciphertexts = encrypt_many(texts, chunk_size=2, workers=3, pool='thread')
+
+        self.assertEqual(decrypt_many(ciphertexts, chunk_size=3, workers=2, pool='thread'), texts)
+
+    def test_long_text_is_compressed_and_legacy_tokens_still_read(self):
+        field = EncryptedTextField()
+        long_text = "Pasienten har hatt feber og hoste i tre dager. " * 40
+
+        stored = field.get_prep_value(long_text)
+        legacy = field.fernet.encrypt(long_text.encode('utf-8')).decode('utf-8')
+
+        self.assertTrue(stored.startswith(ZLIB_PREFIX))
+        self.assertLess(len(stored), len(legacy))
+        self.assertEqual(decrypt_many([stored, legacy]), [long_text, long_text])
+
+    def test_only_legacy_rows_that_shrink_are_compressible(self):
+        """
+        الصفوف التي لن تُضغط عند إعادة التشفير لا تُعاد كتابتها في كل دورة
+        Rows that re-encryption would not compress are not rewritten on every pass
+        """
+        fernet = EncryptedTextField().fernet
+        legacy = lambda data: fernet.encrypt(data).decode('utf-8')
+        repetitive = ("Pasienten har hatt feber og hoste i tre dager. " * 40).encode('utf-8')
+
+        self.assertTrue(is_compressible_legacy(fernet, legacy(repetitive), min_bytes=512))
+        # الرمز يوحي بأكثر من 512 بايت لكن النص الفعلي أقصر / Token suggests >512 bytes, real text is shorter
+        self.assertFalse(is_compressible_legacy(fernet, legacy(b"a" * 480), min_bytes=512))
+        self.assertFalse(is_compressible_legacy(fernet, legacy(os.urandom(2048)), min_bytes=512))
+        self.assertFalse(is_compressible_legacy(fernet, ZLIB_PREFIX + legacy(repetitive), min_bytes=512))
+
+
+class DirtyFieldsTest(SimpleTestCase):
+    def test_only_changed_fields_are_dirty(self):
+        """
+        قراءة حقل مشفر لا تجعله متغيراً؛ تعديل حقل آخر فقط هو ما يُحفظ
+        Reading an encrypted field doesn't dirty it; only the edited field is saved
+        """
+        field = Message._meta.get_field('text_original')
+        token = field.get_prep_value("Hei")
+        message = Message.from_db(
+            'default', ['id', 'text_original', 'language_code'],
+            [uuid.uuid4(), field.from_db_value(token, None, None), 'no'],
+        )
+
+        self.assertEqual(message.text_original, "Hei")
+        self.assertEqual(message.get_dirty_fields(), [])
+
+        message.language_code = 'ar'
+        self.assertEqual(message.get_dirty_fields(), ['language_code'])
+
+    def loaded_message(self):
+        return Message.from_db('default', ['id', 'sender_id', 'language_code'], [uuid.uuid4(), None, 'no'])
+
+    @patch('django.db.models.Model.save')
+    def test_save_writes_only_dirty_fields(self, mock_save):
+        message = self.loaded_message()
+        message.language_code = 'ar'
+
+        message.save()
+
+        self.assertEqual(mock_save.call_args.kwargs['update_fields'], ['language_code'])
+
+    @patch('django.db.models.Model.save')
+    def test_save_without_changes_is_a_normal_save(self, mock_save):
+        """
+        حفظ بدون تغييرات لا يصبح update_fields=[] (الذي يتخطى الاستعلام والإشارات)
+        A save with no changes does not become update_fields=[] (which skips the query and signals)
+        """
+        self.loaded_message().save()
+
+        mock_save.assert_called_once()
+        self.assertNotIn('update_fields', mock_save.call_args.kwargs)
+
+    @patch('django.db.models.Model.save')
+    def test_explicit_update_fields_are_kept(self, mock_save):
+        message = self.loaded_message()
+        message.language_code = 'ar'
+
+        message.save(update_fields=['is_read'])
+
+        self.assertEqual(mock_save.call_args.kwargs['update_fields'], ['is_read'])
+
+
+class OutboxTest(SimpleTestCase):
+    def test_typing_is_coalesced_under_pressure(self):
+        """
+        فوق الحد: مؤشر الكتابة الأحدث يحل محل القديم بدل أن يتراكم
+        Above the high-water mark the newest typing event replaces the queued one
+        """
+        outbox = Outbox(write=None, high_water=2, max_depth=10, ack_timeout=60)
+        outbox.put({'type': 'chat_message', 'seq': 1})
+        outbox.put({'type': 'typing', 'side': 'staff', 'is_typing': True})
+        outbox.put({'type': 'typing', 'side': 'staff', 'is_typing': False})
+
+        self.assertEqual(outbox.depth(), 2)
+        self.assertFalse(outbox.queue[-1]['is_typing'])
+        self.assertEqual(outbox.stats['coalesced'], 1)
+
+    def test_overflow_asks_for_eviction(self):
+        outbox = Outbox(write=None, high_water=1, max_depth=2, ack_timeout=60)
+        self.assertTrue(outbox.put({'type': 'chat_message', 'seq': 1}))
+        self.assertTrue(outbox.put({'type': 'chat_message', 'seq': 2}))
+        self.assertFalse(outbox.put({'type': 'chat_message', 'seq': 3}))
+
+    def test_only_the_latest_non_essential_event_per_key_is_kept(self):
+        """
+        فوق الحد: آخر typing/presence/read_receipt لكل مفتاح فقط، والرسائل لا تُدمج أبداً
+        Above high_water only the latest typing/presence/read_receipt per key survives; chat messages never merge
+        """
+        outbox = Outbox(write=None, high_water=2, max_depth=20, ack_timeout=60)
+        outbox.put({'type': 'chat_message', 'seq': 1})
+        outbox.put({'type': 'chat_message', 'seq': 2})
+        for i in range(3):
+            outbox.put({'type': 'typing', 'side': 'staff', 'n': i})
+            outbox.put({'type': 'typing', 'side': 'refugee', 'n': i})
+            outbox.put({'type': 'presence', 'side': 'staff', 'n': i})
+            outbox.put({'type': 'read_receipt', 'reader_id': 7, 'n': i})
+        outbox.put({'type': 'chat_message', 'seq': 3})
+
+        kept = [(e['type'], e.get('side') or e.get('reader_id'), e.get('n')) for e in outbox.queue]
+        self.assertEqual(kept, [
+            ('chat_message', None, None),
+            ('chat_message', None, None),
+            ('typing', 'staff', 2),
+            ('typing', 'refugee', 2),
+            ('presence', 'staff', 2),
+            ('read_receipt', 7, 2),
+            ('chat_message', None, None),
+        ])
+        self.assertEqual(outbox.stats['coalesced'], 8)
+
+    def test_nothing_is_coalesced_below_high_water(self):
+        outbox = Outbox(write=None, high_water=10, max_depth=20, ack_timeout=60)
+        outbox.put({'type': 'typing', 'side': 'staff', 'is_typing': True})
+        outbox.put({'type': 'typing', 'side': 'staff', 'is_typing': False})
+
+        self.assertEqual(outbox.depth(), 2)
+        self.assertEqual(outbox.stats['coalesced'], 0)
+
+    @patch('apps.chat.outbox.time.monotonic', return_value=1000.0)
+    def test_acks_are_tracked_only_after_the_first_ack(self, mock_clock):
+        """
+        عميل قديم لا يرسل ack أبداً: لا يُعتبر عالقاً مهما طال الوقت
+        An older client that never acks is never considered stuck, however long it takes
+        """
+        outbox = Outbox(write=None, high_water=10, max_depth=20, ack_timeout=60)
+        outbox._track({'type': 'chat_message', 'seq': 1})
+        mock_clock.return_value = 5000.0
+
+        self.assertEqual(len(outbox.inflight), 0)
+        self.assertFalse(outbox.stuck())
+        self.assertTrue(outbox.put({'type': 'chat_message', 'seq': 2}))
+
+        # أول ack يفعّل التتبع / The first ack turns tracking on
+        outbox.ack(1)
+        outbox._track({'type': 'chat_message', 'seq': 2})
+        outbox._track({'type': 'sync', 'messages': [{'seq': 2}, {'seq': 3}, {'seq': 4}]})
+        self.assertEqual([seq for seq, _ in outbox.inflight], [2, 3, 4])
+
+    @patch('apps.chat.outbox.time.monotonic', return_value=1000.0)
+    def test_unacked_message_past_the_timeout_asks_for_eviction(self, mock_clock):
+        """
+        عميل فعّل ack ثم توقف عن الرد: يُفصل بعد انتهاء المهلة
+        A client that started acking and then went silent is evicted once the ack timeout passes
+        """
+        outbox = Outbox(write=None, high_water=10, max_depth=20, ack_timeout=60)
+        outbox.ack(0)
+        outbox._track({'type': 'chat_message', 'seq': 1})
+        outbox._track({'type': 'chat_message', 'seq': 2})
+
+        mock_clock.return_value = 1059.0
+        self.assertTrue(outbox.put({'type': 'chat_message', 'seq': 3}))
+
+        mock_clock.return_value = 1061.0
+        self.assertTrue(outbox.stuck())
+        self.assertFalse(outbox.put({'type': 'chat_message', 'seq': 4}))
+
+    @patch('apps.chat.outbox.time.monotonic', return_value=1000.0)
+    def test_ack_releases_inflight_messages(self, mock_clock):
+        outbox = Outbox(write=None, high_water=10, max_depth=20, ack_timeout=60)
+        outbox.ack(0)
+        for seq in (1, 2, 3):
+            outbox._track({'type': 'chat_message', 'seq': seq})
+
+        outbox.ack(2)
+        self.assertEqual([seq for seq, _ in outbox.inflight], [3])
+
+        outbox.ack(3)
+        mock_clock.return_value = 5000.0
+        self.assertFalse(outbox.stuck())
+
+
+class SlowClientEvictionTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='slow_refugee', password='password123', role='REFUGEE')
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+
+    def consumer(self, query_string=b''):
+        consumer = ChatConsumer()
+        consumer.user = self.refugee
+        consumer.session_id = str(self.session.id)
+        consumer.scope = {'query_string': query_string}
+        consumer.close = AsyncMock()
+        return consumer
+
+    def test_evicted_client_catches_up_with_sync_on_reconnect(self):
+        """
+        فصل بالرمز 4008 ثم إعادة الاتصال بالمؤشر: إطار sync واحد بكل ما فات
+        Closed with 4008, then reconnects with its cursor: one sync frame with everything it missed
+        """
+        for i in range(3):
+            Message.objects.create(session=self.session, sender=self.refugee, text_original=f"melding {i}")
+
+        slow = self.consumer()
+        slow.outbox = Outbox(write=None, high_water=1, max_depth=2, ack_timeout=60)
+        for seq in (1, 2, 3, 4):
+            async_to_sync(slow.send_event)({'type': 'chat_message', 'seq': seq})
+
+        # فصل مرة واحدة فقط مهما وصل بعدها / Closed exactly once, whatever arrives afterwards
+        slow.close.assert_awaited_once_with(code=ChatConsumer.EVICTED)
+        self.assertTrue(slow.evicting)
+
+        again = self.consumer(query_string=b'cursor=1')
+        again.send_event = AsyncMock()
+        async_to_sync(again.send_missed)(again.resume_cursor())
+
+        frame = again.send_event.await_args.args[0]
+        self.assertEqual(frame['type'], 'sync')
+        self.assertEqual([m['seq'] for m in frame['messages']], [2, 3])
+        self.assertFalse(frame['has_more'])
+
+
+
+class TranscriptionBreakerTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='voice_refugee', password='password123', role='REFUGEE')
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+        self.message = Message.objects.create(
+            session=self.session, sender=self.refugee, text_original='Processing...', audio='voice_notes/test.webm'
+        )
+
+    @override_settings(CIRCUIT_BREAKER_RECOVERY_TIMEOUT=45)
+    @patch('apps.chat.tasks.get_backend')
+    @patch('apps.chat.tasks.CircuitBreaker.allow', return_value=False)
+    def test_open_circuit_retries_after_cooldown(self, mock_allow, mock_backend):
+        """
+        الدائرة مفتوحة: المهمة تعاد بعد فترة التعافي بدل أن تنتهي / Open circuit: the task is retried, not dropped
+        """
+        with patch.object(transcribe_voice_note, 'retry', side_effect=RuntimeError('retry')) as mock_retry:
+            with self.assertRaises(RuntimeError):
+                transcribe_voice_note.run(self.message.id)
+
+        mock_backend.assert_not_called()
+        self.assertEqual(mock_retry.call_args.kwargs['countdown'], 45)
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeyRotationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.old_key = Fernet.generate_key().decode()
+        self.new_key = Fernet.generate_key().decode()
+        self.refugee = User.objects.create_user(username='rotation_refugee', password='password123', role='REFUGEE')
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+        with self.keys(self.old_key):
+            for i in range(5):
+                Message.objects.create(session=self.session, sender=self.refugee, text_original=f"melding {i}")
+        self.pks = sorted(Message.objects.values_list('pk', flat=True))
+
+    @contextmanager
+    def keys(self, *keys):
+        """
+        نفس DB_ENCRYPTION_KEYS لكل الحقول والخدمة / Same DB_ENCRYPTION_KEYS for every field and the service
+        """
+        with ExitStack() as stack:
+            fernet = build_fernet(keys)
+            for model in ROTATION_MODELS:
+                for field in KeyRotationService.encrypted_fields(model):
+                    stack.enter_context(patch.object(field, 'fernet', fernet))
+            stack.enter_context(patch('apps.chat.services.key_rotation_service.current_keys', return_value=keys))
+            yield
+
+    def ciphertext(self, pk):
+        return Message.objects.values_list('text_original', flat=True).get(pk=pk).ciphertext
+
+    def test_rotation_re_encrypts_every_row_under_the_primary_key(self):
+        with self.keys(self.new_key, self.old_key):
+            done = KeyRotationService(batch_size=2, rows_per_second=10 ** 6).run()
+
+        self.assertTrue(done)
+        for pk in self.pks:
+            self.assertTrue(is_current((self.new_key,), self.ciphertext(pk)))
+        with self.keys(self.new_key):
+            texts = sorted(str(m.text_original) for m in Message.objects.all())
+        self.assertEqual(texts, [f"melding {i}" for i in range(5)])
+
+    def test_run_resumes_from_checkpoint(self):
+        """
+        الاستئناف يبدأ بعد آخر pk محفوظ / A resumed run starts after the checkpointed pk
+        """
+        with self.keys(self.new_key, self.old_key):
+            service = KeyRotationService(batch_size=2, rows_per_second=10 ** 6)
+            state = service.checkpoint()
+            state['last_pk'] = str(self.pks[2])
+            cache.set(KeyRotationService.CHECKPOINT_KEY, state)
+
+            self.assertTrue(service.run())
+
+        for pk in self.pks[:3]:
+            self.assertFalse(is_current((self.new_key,), self.ciphertext(pk)))
+        for pk in self.pks[3:]:
+            self.assertTrue(is_current((self.new_key,), self.ciphertext(pk)))
+        self.assertEqual(cache.get(KeyRotationService.CHECKPOINT_KEY)['rotated'], 2)
+
+    def test_new_primary_key_restarts_the_pass(self):
+        cache.set(KeyRotationService.CHECKPOINT_KEY, {'key': 'older', 'model': 2, 'last_pk': 'x', 'done': True})
+        with self.keys(self.new_key, self.old_key):
+            state = KeyRotationService().checkpoint()
+
+        self.assertEqual((state['model'], state['last_pk'], state['done']), (0, None, False))
+
+
+class MessageSyncTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='sync_refugee', password='password123', role='REFUGEE')
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+
+    def test_allocate_seq_reserves_consecutive_ranges(self):
+        self.assertEqual(ChatSession.allocate_seq(self.session.id), 1)
+        self.assertEqual(ChatSession.allocate_seq(self.session.id, count=3), 4)
+        self.assertEqual(ChatSession.allocate_seq(self.session.id), 5)
+        self.assertIsNone(ChatSession.allocate_seq(uuid.uuid4()))
+
+    @patch('apps.chat.models.transaction.get_connection')
+    def test_allocate_seq_requires_the_insert_transaction(self, mock_connection):
+        """
+        خارج معاملة الإدخال يُحرر القفل قبل الإدخال فيُرفض الاستدعاء
+        Outside the inserting transaction the lock would be released before the INSERT, so it is refused
+        """
+        mock_connection.return_value.in_atomic_block = False
+
+        with self.assertRaises(TransactionManagementError):
+            ChatSession.allocate_seq(self.session.id)
+
+    def test_saved_messages_get_increasing_seq(self):
+        first = Message.objects.create(session=self.session, sender=self.refugee, text_original="en")
+        second = Message.objects.create(session=self.session, sender=self.refugee, text_original="to")
+
+        self.assertEqual((first.seq, second.seq), (1, 2))
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.last_seq, 2)
+
+    def test_load_missed_returns_only_messages_after_cursor(self):
+        """
+        المزامنة ترسل فقط ما بعد المؤشر، بالترتيب، مع رسالة إضافية لمعرفة has_more
+        Sync sends only what follows the cursor, in order, plus one extra row to detect has_more
+        """
+        for i in range(5):
+            Message.objects.create(session=self.session, sender=self.refugee, text_original=f"melding {i}")
+        consumer = ChatConsumer()
+        consumer.session_id = str(self.session.id)
+
+        missed = consumer.load_missed(cursor=1, limit=2)
+
+        self.assertEqual([m['seq'] for m in missed], [2, 3, 4])
+        self.assertEqual(missed[0]['text_original'], "melding 1")
+        self.assertIn('is_read', missed[0])
+        self.assertEqual(consumer.load_missed(cursor=5, limit=2), [])
+
+
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='history_refugee', password='password123', role='REFUGEE')
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+        Message.objects.create(session=self.session, sender=self.refugee, text_original="hei")
+        self.client.force_login(self.refugee)
+
+    def get(self, **params):
+        return self.client.get(reverse('chat_history'), params)
+
+    def test_page_is_returned_for_the_owner(self):
+        response = self.get(session_id=str(self.session.id))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 1)
+
+    def test_malformed_ids_are_rejected_with_400(self):
+        """
+        معرفات غير صالحة تعيد 400 وليس 500 / Malformed ids return 400, not 500
+        """
+        self.assertEqual(self.get(session_id='not-a-uuid').status_code, 400)
+        self.assertEqual(self.get().status_code, 400)
+        response = self.get(session_id=str(self.session.id), before='2026-01-01T00:00:00+00:00|not-a-uuid')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get(session_id=str(self.session.id), before='garbage').status_code, 400)
+
+
+class MessagePatchBroadcastTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='patch_refugee', password='password123', role='REFUGEE')
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+        self.message = Message.objects.create(session=self.session, sender=self.refugee, text_original="hei")
+
+    @patch('apps.chat.services.notification_service.get_channel_layer')
+    def test_patch_is_published_and_versioned_even_when_nobody_looks_online(self, mock_layer):
+        """
+        البث لا يعتمد على الحضور: اتصال جديد قد لا يظهر بعد / Publishing never depends on presence
+        """
+        mock_layer.return_value.group_send = AsyncMock()
+        self.message.text_translated = "hello"
+        self.message.save_with_version(['text_translated'])
+        NotificationService.broadcast_message_patch(self.message, ['text_translated'])
+
+        group, event = mock_layer.return_value.group_send.call_args.args
+        self.assertEqual(group, f'chat_{self.session.id}')
+        self.assertEqual((event['type'], event['version'], event['text_translated']), ('message_patch', 2, "hello"))
+
+    def test_version_is_bumped_in_the_same_update(self):
+        """
+        الإصدار يزيد داخل UPDATE الحفظ نفسه، وليس باستعلام ثانٍ
+        The version is bumped inside the save's own UPDATE, not by a second statement
+        """
+        self.message.text_translated = "hello"
+
+        with CaptureQueriesContext(connection) as queries:
+            self.message.save_with_version(['text_translated'])
+
+        updates = [q['sql'] for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE') and Message._meta.db_table in q['sql']]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.message.version, 2)
+        self.assertEqual(Message.objects.get(id=self.message.id).version, 2)
+
+    @patch('apps.chat.services.notification_service.get_channel_layer')
+    def test_patch_batch_is_one_group_send(self, mock_layer):
+        mock_layer.return_value.group_send = AsyncMock()
+        second = Message.objects.create(session=self.session, sender=self.refugee, text_original="to")
+        Message.bulk_update_with_version([self.message, second], ['text_translated'])
+        NotificationService.broadcast_message_patches([self.message, second], ['text_translated'])
+
+        mock_layer.return_value.group_send.assert_called_once()
+        event = mock_layer.return_value.group_send.call_args.args[1]
+        self.assertEqual([p['version'] for p in event['patches']], [2, 2])
+
+
+class MessageBatchIngestTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(
+            username='batch_refugee', password='password123', role='REFUGEE', native_language='ar'
+        )
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+        Message.objects.create(session=self.session, sender=self.refugee, text_original="før")
+        ChatSession.objects.filter(id=self.session.id).update(last_activity=timezone.now() - timedelta(days=1))
+
+    @patch('apps.chat.services.ingest_service.StaffInboxService.messages_created')
+    @patch('apps.chat.services.ingest_service.process_message_batch_ai')
+    def test_batch_gets_one_seq_range_and_one_task(self, mock_task, mock_inbox):
+        """
+        دفعة واحدة = نطاق seq واحد، تحديث نشاط واحد، ومهمة Celery واحدة
+        One batch = one seq range, one last_activity update and one Celery task
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            messages = MessageIngestService.create_batch(self.session, self.refugee, ["en", "to", "tre"])
+
+        self.assertEqual([m.seq for m in messages], [2, 3, 4])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.last_seq, 4)
+        self.assertGreater(self.session.last_activity, timezone.now() - timedelta(minutes=1))
+        mock_task.delay.assert_called_once_with([str(m.id) for m in messages])
+        mock_inbox.assert_called_once_with(messages, from_staff=False)
+        self.assertEqual(messages[0].language_code, 'ar')
+
+    @patch('apps.chat.services.triage_service.StaffInboxService.priority_changed')
+    @patch('apps.chat.tasks.NotificationService.broadcast_message_patches')
+    @patch('apps.chat.tasks.AzureTranslator')
+    def test_batch_task_translates_in_one_call(self, mock_translator, mock_broadcast, mock_priority):
+        DangerKeyword.objects.create(word="blod", is_active=True)
+        with patch('apps.chat.services.ingest_service.process_message_batch_ai'):
+            messages = MessageIngestService.create_batch(self.session, self.refugee, ["واحد", "اثنان"])
+        mock_translator.return_value.translate_many.return_value = ["en", "mye blod"]
+
+        process_message_batch_ai.run([str(m.id) for m in messages])
+
+        mock_translator.return_value.translate_many.assert_called_once_with(["واحد", "اثنان"], 'ar', 'no')
+        stored = {m.seq: m for m in Message.objects.filter(id__in=[m.id for m in messages])}
+        self.assertEqual(str(stored[2].text_translated), "en")
+        self.assertEqual((stored[2].is_urgent, stored[3].is_urgent), (False, True))
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.priority, 2)
+        mock_priority.assert_called_once_with(self.session.id, 2)
+        mock_broadcast.assert_called_once()
+        self.assertEqual(mock_broadcast.call_args.args[1], ['text_translated', 'is_urgent'])
+
+
+class MessageBatchFrameTest(SimpleTestCase):
+    @override_settings(WS_MESSAGE_BATCH_MAX=2)
+    @patch('apps.chat.consumers.MessageIngestService.create_batch')
+    def test_oversized_batch_is_rejected_not_truncated(self, mock_create):
+        """
+        الدفعة الأكبر من الحد لا تُقتطع: الخادم يعيد الحد والعميل يعيد الإرسال
+        An oversized batch is not truncated: the server returns the limit and the client resends
+        """
+        consumer = ChatConsumer()
+        consumer.send_event = AsyncMock()
+
+        async_to_sync(consumer.receive_batch)(["en", "to", "tre"])
+
+        mock_create.assert_not_called()
+        consumer.send_event.assert_awaited_once_with({'type': 'error_alert', 'batch_max': 2})
+
+
+
+class InlineTranslationTest(SimpleTestCase):
+    def consumer_for(self, role, native_language):
+        consumer = ChatConsumer()
+        consumer.user = SimpleNamespace(role=role, native_language=native_language)
+        consumer.session = SimpleNamespace(refugee=SimpleNamespace(native_language='ar'))
+        consumer.translator = MagicMock(atranslate=AsyncMock(return_value="Hei"))
+        return consumer
+
+    def test_language_pair_matches_the_celery_task(self):
+        refugee = self.consumer_for('REFUGEE', 'ar')
+        nurse = self.consumer_for('NURSE', 'no')
+
+        self.assertEqual(async_to_sync(refugee.translate_inline)("مرحبا"), "Hei")
+        refugee.translator.atranslate.assert_awaited_once_with("مرحبا", 'ar', 'no')
+        async_to_sync(nurse.translate_inline)("Hei")
+        nurse.translator.atranslate.assert_awaited_once_with("Hei", 'no', 'ar')
+
+    @override_settings(TRANSLATION_INLINE_TIMEOUT=0.01)
+    def test_slow_translation_is_left_to_celery(self):
+        """
+        بعد انتهاء المهلة تُحفظ الرسالة بدون ترجمة وتترجمها Celery
+        Past the budget the message is stored untranslated and Celery translates it
+        """
+        consumer = self.consumer_for('REFUGEE', 'ar')
+
+        async def slow(*args):
+            await asyncio.sleep(1)
+        consumer.translator.atranslate = slow
+
+        self.assertIsNone(async_to_sync(consumer.translate_inline)("مرحبا"))
+
+    @override_settings(TRANSLATION_INLINE_TIMEOUT=0)
+    def test_disabled_budget_skips_the_translator(self):
+        consumer = self.consumer_for('REFUGEE', 'ar')
+
+        self.assertIsNone(async_to_sync(consumer.translate_inline)("مرحبا"))
+        consumer.translator.atranslate.assert_not_awaited()
+
+
+@patch('apps.chat.consumers.ChatConsumer.mark_read')
+@patch('apps.chat.consumers.Outbox')
+@patch('apps.chat.consumers.PresenceService.online_sides', new_callable=AsyncMock, return_value=set())
+@patch('apps.chat.consumers.PresenceService.touch', new_callable=AsyncMock, return_value=False)
+class ConsumerAuthorizationTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='ws_refugee', password='password123', role='REFUGEE')
+        self.stranger = User.objects.create_user(username='ws_stranger', password='password123', role='REFUGEE')
+        self.nurse = User.objects.create_user(username='ws_nurse', password='password123', role='NURSE', is_staff=True)
+        self.session = ChatSession.objects.create(refugee=self.refugee)
+
+    def connect_as(self, user, session_id=None):
+        consumer = ChatConsumer()
+        consumer.scope = {
+            'user': user,
+            'url_route': {'kwargs': {'session_id': session_id or self.session.id}},
+            'subprotocols': [],
+            'query_string': b'',
+        }
+        consumer.channel_name = 'test-channel'
+        consumer.channel_layer = MagicMock(group_add=AsyncMock(), group_send=AsyncMock())
+        consumer.accept = AsyncMock()
+        consumer.close = AsyncMock()
+        async_to_sync(consumer.connect)()
+        return consumer
+
+    def test_session_owner_is_accepted_and_session_is_cached(self, *mocks):
+        """
+        الجلسة والمشاركون يُحمّلون مرة واحدة عند الاتصال / Session and participants are loaded once on connect
+        """
+        consumer = self.connect_as(self.refugee)
+
+        consumer.accept.assert_awaited_once()
+        consumer.close.assert_not_awaited()
+        consumer.channel_layer.group_add.assert_awaited_once_with(f'chat_{self.session.id}', 'test-channel')
+        with self.assertNumQueries(0):
+            self.assertEqual(consumer.session.refugee.username, 'ws_refugee')
+
+    def test_staff_is_accepted(self, *mocks):
+        self.connect_as(self.nurse).accept.assert_awaited_once()
+
+    def test_other_refugee_is_rejected(self, *mocks):
+        consumer = self.connect_as(self.stranger)
+
+        consumer.close.assert_awaited_once()
+        consumer.accept.assert_not_awaited()
+        consumer.channel_layer.group_add.assert_not_awaited()
+
+    def test_anonymous_socket_is_rejected(self, *mocks):
+        consumer = self.connect_as(AnonymousUser())
+
+        consumer.close.assert_awaited_once()
+        consumer.accept.assert_not_awaited()
+
+    def test_unknown_session_is_rejected(self, *mocks):
+        consumer = self.connect_as(self.refugee, session_id=uuid.uuid4())
+
+        consumer.close.assert_awaited_once()
+        consumer.accept.assert_not_awaited()
+
+
+class ReadWatermarkTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='read_refugee', password='password123', role='REFUGEE')
+        self.nurse = User.objects.create_user(username='read_nurse', password='password123', role='NURSE', is_staff=True)
+        self.session = ChatSession.objects.create(refugee=self.refugee, nurse=self.nurse)
+
+    def consumer_for(self, user):
+        consumer = ChatConsumer()
+        consumer.user = user
+        consumer.session_id = str(self.session.id)
+        consumer.room_group_name = f'chat_{self.session.id}'
+        consumer.channel_layer = MagicMock(group_send=AsyncMock())
+        return consumer
+
+    @override_settings(READ_RECEIPT_DEBOUNCE_SECONDS=0)
+    @patch('apps.chat.consumers.PresenceService.online_sides', new_callable=AsyncMock, return_value={'staff'})
+    def test_mark_read_calls_are_debounced_into_one_write_and_receipt(self, mock_online):
+        """
+        عدة mark_read خلال فترة التأجيل = كتابة واحدة وإشعار واحد
+        Several mark_read calls inside the window = one watermark write and one receipt
+        """
+        consumer = self.consumer_for(self.refugee)
+
+        async def burst():
+            consumer.mark_read()
+            task = consumer.read_flush_task
+            consumer.mark_read()
+            consumer.mark_read()
+            self.assertIs(consumer.read_flush_task, task)
+            await task
+
+        async_to_sync(burst)()
+
+        consumer.channel_layer.group_send.assert_awaited_once()
+        group, event = consumer.channel_layer.group_send.await_args.args
+        self.assertEqual(group, f'chat_{self.session.id}')
+        self.assertEqual((event['type'], event['reader_id']), ('read_receipt_event', self.refugee.id))
+        self.session.refresh_from_db()
+        self.assertIsNotNone(self.session.refugee_read_at)
+        self.assertIsNone(self.session.staff_read_at)
+
+    @patch('apps.chat.consumers.PresenceService.online_sides', new_callable=AsyncMock, return_value={'staff'})
+    def test_watermark_only_moves_forward(self, mock_online):
+        later = timezone.now()
+        ChatSession.objects.filter(id=self.session.id).update(refugee_read_at=later)
+        consumer = self.consumer_for(self.refugee)
+        consumer.pending_read_at = later - timedelta(minutes=5)
+
+        async_to_sync(consumer.flush_read)()
+
+        consumer.channel_layer.group_send.assert_not_awaited()
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.refugee_read_at, later)
+
+    def test_apply_read_watermarks_backfills_is_read(self):
+        now = timezone.now()
+        read = Message.objects.create(session=self.session, sender=self.refugee, text_original="lest")
+        unread = Message.objects.create(session=self.session, sender=self.refugee, text_original="ulest")
+        reply = Message.objects.create(session=self.session, sender=self.nurse, text_original="svar")
+        Message.objects.filter(id__in=[read.id, reply.id]).update(timestamp=now - timedelta(minutes=2))
+        Message.objects.filter(id=unread.id).update(timestamp=now)
+        ChatSession.objects.filter(id=self.session.id).update(
+            staff_read_at=now - timedelta(minutes=1), refugee_read_at=now - timedelta(minutes=1)
+        )
+
+        self.assertTrue(Message.objects.select_related('session').get(id=read.id).is_seen)
+        apply_read_watermarks()
+
+        flags = dict(Message.objects.values_list('id', 'is_read'))
+        self.assertEqual((flags[read.id], flags[reply.id], flags[unread.id]), (True, True, False))
+
+
+class FakeSortedSets:
+    """أوامر المجموعات المرتبة المستخدمة في PresenceService / The sorted-set commands PresenceService uses"""
+    def __init__(self):
+        self.sets = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    async def zrangebyscore(self, key, low, high):
+        return self.run('zrangebyscore', key, low, high)
+
+    def run(self, command, key, *args):
+        members = self.sets.setdefault(key, {})
+        if command == 'zremrangebyscore':
+            for member in [m for m, score in members.items() if args[0] <= score <= args[1]]:
+                del members[member]
+        elif command == 'zrange':
+            return [m.encode() for m in members]
+        elif command == 'zrangebyscore':
+            return [m.encode() for m, score in members.items() if score >= args[0]]
+        elif command == 'zadd':
+            members.update(args[0])
+        elif command == 'zrem':
+            members.pop(args[0], None)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.queued = []
+
+    def __getattr__(self, command):
+        return lambda *args: self.queued.append((command, args))
+
+    async def execute(self):
+        return [self.redis.run(command, *args) for command, args in self.queued]
+
+
+@override_settings(PRESENCE_TTL_SECONDS=60)
+class PresenceServiceTest(SimpleTestCase):
+    session_id = 'session-1'
+    refugee = SimpleNamespace(id=1, is_staff=False)
+    nurse = SimpleNamespace(id=2, is_staff=True)
+
+    def setUp(self):
+        self.redis = FakeSortedSets()
+        self.now = 1000.0
+        # ساعة مزيفة لهذه الوحدة فقط / A fake clock for this module only
+        clock = SimpleNamespace(time=lambda: self.now)
+        for target, value in (('get_async_redis', MagicMock(return_value=self.redis)), ('time', clock)):
+            patcher = patch(f'apps.chat.services.presence_service.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def touch(self, user, channel):
+        return async_to_sync(PresenceService.touch)(self.session_id, user, channel)
+
+    def leave(self, user, channel):
+        return async_to_sync(PresenceService.leave)(self.session_id, user, channel)
+
+    def online(self):
+        return async_to_sync(PresenceService.online_sides)(self.session_id)
+
+    def test_join_transitions_only_for_the_first_connection_of_a_side(self):
+        self.assertTrue(self.touch(self.refugee, 'tab-1'))
+        self.assertFalse(self.touch(self.refugee, 'tab-2'))  # تبويب ثانٍ / A second tab
+        self.assertFalse(self.touch(self.refugee, 'tab-1'))  # نبضة / Heartbeat
+        self.assertTrue(self.touch(self.nurse, 'admin'))
+        self.assertEqual(self.online(), {'refugee', 'staff'})
+
+    def test_leave_transitions_when_the_last_connection_goes(self):
+        self.touch(self.refugee, 'tab-1')
+        self.touch(self.refugee, 'tab-2')
+
+        self.assertFalse(self.leave(self.refugee, 'tab-1'))
+        self.assertTrue(self.leave(self.refugee, 'tab-2'))
+        self.assertEqual(self.online(), set())
+
+    def test_connections_without_heartbeat_age_out(self):
+        """
+        عامل متوقف بدون disconnect: الاتصال يختفي بعد انتهاء المدة
+        A worker that died without disconnect: the connection drops out after the TTL
+        """
+        self.touch(self.refugee, 'tab-1')
+        self.now += 30
+        self.assertEqual(self.online(), {'refugee'})
+
+        self.now += 31
+        self.assertEqual(self.online(), set())
+        self.assertTrue(self.touch(self.refugee, 'tab-1'))  # عاد متصلاً / Back online
+
+    def test_redis_unavailable_fails_open(self):
+        with patch('apps.chat.services.presence_service.get_async_redis', side_effect=ConnectionError('down')):
+            self.assertIsNone(self.online())
+            self.assertFalse(self.touch(self.refugee, 'tab-1'))
+            self.assertFalse(self.leave(self.refugee, 'tab-1'))
+
+
+class MsgpackCodecTest(SimpleTestCase):
+    refugee = SimpleNamespace(id=1, is_staff=False)
+    nurse = SimpleNamespace(id=2, is_staff=True)
+
+    def message(self, sender_id, **extra):
+        return {
+            'type': 'chat_message', 'id': 'abc', 'seq': 5, 'sender_id': sender_id,
+            'text_original': 'مرحبا', 'text_translated': 'Hei', 'ai_analysis': 'ok',
+            'timestamp': '2026-01-01T00:00:00+00:00', 'image_url': None, **extra,
+        }
+
+    def test_compact_uses_short_keys_epoch_times_and_drops_nulls(self):
+        compact = MsgpackCodec().compact(self.message(1))
+
+        self.assertEqual(compact['t'], 'chat_message')
+        self.assertEqual(compact['q'], 5)
+        self.assertEqual(compact['m'], 1767225600000)
+        self.assertNotIn('g', compact)
+
+    def test_nested_messages_are_compacted(self):
+        compact = MsgpackCodec().compact({'type': 'sync', 'messages': [self.message(1)], 'has_more': False})
+
+        self.assertEqual(compact['ms'][0]['o'], 'مرحبا')
+        self.assertFalse(compact['h'])
+
+    def test_viewer_only_gets_the_text_it_displays(self):
+        """
+        اللاجئ: نصه الأصلي فقط، وترجمة الطرف الآخر فقط، وبدون تحليل طبي
+        Refugee: own original, the other side's translation, never the AI analysis
+        """
+        codec = MsgpackCodec()
+
+        own = codec.compact(self.message(1), viewer=self.refugee)
+        other = codec.compact(self.message(2), viewer=self.refugee)
+        voice = codec.compact(self.message(2, audio_url='/a.webm'), viewer=self.refugee)
+        staff = codec.compact(self.message(1), viewer=self.nurse)
+
+        self.assertEqual((own.get('o'), own.get('r'), own.get('a')), ('مرحبا', None, None))
+        self.assertEqual((other.get('o'), other.get('r'), other.get('a')), (None, 'Hei', None))
+        self.assertEqual((voice.get('o'), voice.get('r')), ('مرحبا', 'Hei'))
+        self.assertEqual((staff.get('o'), staff.get('r'), staff.get('a')), ('مرحبا', 'Hei', 'ok'))
+
+    def test_encode_decode_round_trip(self):
+        codec = MsgpackCodec()
+        frame = codec.encode(self.message(1))
+
+        self.assertEqual(frame[:1], RAW)
+        self.assertEqual(MsgpackCodec.decode(frame), codec.compact(self.message(1)))
+
+    @override_settings(WS_DEFLATE_MIN_BYTES=64)
+    def test_large_frames_are_deflated(self):
+        codec = MsgpackCodec(deflate=True)
+        event = {'type': 'sync', 'messages': [self.message(1)] * 20, 'has_more': False}
+        frame = codec.encode(event)
+
+        self.assertEqual(frame[:1], DEFLATED)
+        self.assertLess(len(frame), len(MsgpackCodec().encode(event)))
+        self.assertEqual(MsgpackCodec.decode(frame), codec.compact(event))
+
+    def test_negotiate_follows_client_order_and_setting(self):
+        self.assertEqual(negotiate([MSGPACK_DEFLATE, MSGPACK]).subprotocol, MSGPACK_DEFLATE)
+        self.assertEqual(negotiate(['unknown', MSGPACK]).subprotocol, MSGPACK)
+        self.assertIsInstance(negotiate([]), JsonCodec)
+        with self.settings(WS_COMPACT_PROTOCOL_ENABLED=False):
+            self.assertIsInstance(negotiate([MSGPACK]), JsonCodec)
+
+
+class StaffInboxTest(TestCase):
+    def setUp(self):
+        self.refugee = User.objects.create_user(username='inbox_refugee', password='password123', role='REFUGEE')
+        self.nurse = User.objects.create_user(username='inbox_nurse', password='password123', role='NURSE', is_staff=True)
+        self.session = ChatSession.objects.create(refugee=self.refugee, nurse=self.nurse)
+        layer = patch('apps.chat.services.inbox_service.get_channel_layer')
+        self.layer = layer.start().return_value
+        self.layer.group_send = AsyncMock()
+        self.addCleanup(layer.stop)
+
+    def published(self):
+        return [call.args for call in self.layer.group_send.await_args_list]
+
+    def test_unread_count_uses_the_staff_watermark(self):
+        """
+        فقط رسائل اللاجئ بعد علامة قراءة الطاقم / Only refugee messages after the staff watermark
+        """
+        now = timezone.now()
+        old = Message.objects.create(session=self.session, sender=self.refugee, text_original="gammel")
+        new = Message.objects.create(session=self.session, sender=self.refugee, text_original="ny")
+        Message.objects.create(session=self.session, sender=self.nurse, text_original="svar")
+        self.assertEqual(StaffInboxService.unread_count(self.session.id), 2)
+
+        Message.objects.filter(id=old.id).update(timestamp=now - timedelta(minutes=5))
+        Message.objects.filter(id=new.id).update(timestamp=now)
+        ChatSession.objects.filter(id=self.session.id).update(staff_read_at=now - timedelta(minutes=1))
+        self.assertEqual(StaffInboxService.unread_count(self.session.id), 1)
+
+    def test_message_created_publishes_to_the_inbox_group(self):
+        message = Message.objects.create(session=self.session, sender=self.refugee, text_original="hjelp")
+
+        StaffInboxService.message_created(message, from_staff=False)
+
+        group, event = self.published()[0]
+        self.assertEqual((group, event['type']), (StaffInboxService.GROUP, 'inbox_event'))
+        self.assertEqual(event['payload']['type'], 'new_message')
+        self.assertEqual(event['payload']['session_id'], str(self.session.id))
+        self.assertEqual((event['payload']['from_staff'], event['payload']['unread']), (False, 1))
+
+    def test_batch_is_one_event_and_one_count(self):
+        """
+        دفعة من 3 رسائل = حدث واحد واستعلام COUNT واحد
+        A batch of three messages = one event and one COUNT query
+        """
+        messages = [
+            Message.objects.create(session=self.session, sender=self.refugee, text_original=text)
+            for text in ("en", "to", "tre")
+        ]
+
+        with self.assertNumQueries(1):
+            StaffInboxService.messages_created(messages, from_staff=False)
+
+        self.assertEqual(len(self.published()), 1)
+        payload = self.published()[0][1]['payload']
+        self.assertEqual((payload['message_id'], payload['count'], payload['unread']), (str(messages[-1].id), 3, 3))
+
+    def test_staff_reply_skips_the_unread_count(self):
+        message = Message.objects.create(session=self.session, sender=self.nurse, text_original="svar")
+
+        with self.assertNumQueries(0):
+            StaffInboxService.message_created(message, from_staff=True)
+
+        self.assertNotIn('unread', self.published()[0][1]['payload'])
+
+    def test_priority_is_published_only_when_it_changes(self):
+        TriageService.escalate_session(self.session.id)
+        TriageService.escalate_session(self.session.id)
+        TriageService.deescalate_session(self.session.id)
+
+        payloads = [event['payload'] for _, event in self.published()]
+        self.assertEqual([(p['type'], p['priority']) for p in payloads], [('priority', 2), ('priority', 1)])
+
+    def test_publish_failure_is_swallowed(self):
+        self.layer.group_send.side_effect = ConnectionError('down')
+        StaffInboxService.publish('unread', self.session.id, unread=0)
+
+    @patch('apps.chat.consumers.PresenceService.online_sides', new_callable=AsyncMock, return_value=set())
+    def test_staff_read_publishes_the_new_unread_count(self, mock_online):
+        Message.objects.create(session=self.session, sender=self.refugee, text_original="hei")
+        consumer = ChatConsumer()
+        consumer.user = self.nurse
+        consumer.session_id = str(self.session.id)
+        consumer.room_group_name = f'chat_{self.session.id}'
+        consumer.channel_layer = MagicMock(group_send=AsyncMock())
+        consumer.pending_read_at = timezone.now()
+
+        async_to_sync(consumer.flush_read)()
+
+        group, event = consumer.channel_layer.group_send.await_args.args
+        self.assertEqual(group, StaffInboxService.GROUP)
+        self.assertEqual((event['payload']['type'], event['payload']['unread']), ('unread', 0))
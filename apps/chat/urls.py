@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import chat_room, upload_image
+from .views import chat_room, upload_image, chat_history
 
 urlpatterns = [
     path('', chat_room, name='chat_room'),
     path('upload/', upload_image, name='chat_upload_image'),
+    path('history/', chat_history, name='chat_history'),
 ]
\ No newline at end of file
@@ -1,40 +1,104 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_GET
 from django.db import transaction
+from django.db.models import Q
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import time
+import uuid
 import traceback
 
 from .models import ChatSession, Message
-from apps.core.services import AzureTranslator 
+from .services.ui_catalog_service import UICatalogService
+from .services.notification_service import NotificationService
+from .wire import wire_manifest
+from apps.core.rate_limit import RequestThrottle
 # 🛑 استيراد المهام
 from .tasks import transcribe_voice_note, process_message_ai
 
+upload_throttle = RequestThrottle('upload')
+
+
 @login_required
 def chat_room(request):
     user = request.user
     if user.is_staff:
         return redirect('admin:index')
     
-    base_warning = "🔒 For your privacy, do not write your name or health ID here. We identify you automatically."
-    privacy_warning = base_warning 
-
-    if user.native_language and user.native_language != 'en':
-        try:
-            translator = AzureTranslator()
-            privacy_warning = translator.translate(base_warning, 'en', user.native_language)
-        except:
-            pass
+    # النصوص مترجمة مسبقاً عند النشر (warm_ui_catalog) بدون أي اتصال بـ Azure هنا
+    # Strings are pre-translated at deploy time (warm_ui_catalog), no Azure call here
+    ui = UICatalogService.get(user.native_language)
 
     session, created = ChatSession.objects.get_or_create(refugee=user)
-    
+
+    # آخر N رسالة فقط؛ الأقدم تُجلب عند التمرير (chat_history)
+    # Only the latest N messages; older pages are fetched on scroll (chat_history)
+    page_size = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+    messages, has_older = _history_page(session, None, page_size)
+
     return render(request, 'chat/room.html', {
         'session': session,
-        'chat_messages': session.messages.all(),
-        'privacy_warning': privacy_warning 
+        'chat_messages': messages,
+        'has_older': has_older,
+        'older_cursor': _history_cursor(messages[0]) if messages else '',
+        'last_seq': session.last_seq,
+        'wire_protocol': wire_manifest(),
+        'batch_max': getattr(settings, 'WS_MESSAGE_BATCH_MAX', 50),
+        'privacy_warning': ui['privacy_warning'],
+        'ui': ui,
+    })
+
+
+def _history_cursor(message):
+    return f"{message.timestamp.isoformat()}|{message.id}"
+
+
+def _history_page(session, before, limit):
+    """
+    صفحة keyset: الرسائل الأقدم من المؤشر، بالترتيب الزمني
+    Keyset page: messages older than the cursor (timestamp, id), returned oldest first
+    """
+    qs = session.messages.all()
+    if before:
+        timestamp, message_id = before
+        qs = qs.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+    page = list(qs.order_by('-timestamp', '-id').decrypted()[:limit + 1])
+    has_more = len(page) > limit
+    return page[:limit][::-1], has_more
+
+
+@login_required
+@require_GET
+def chat_history(request):
+    user = request.user
+    try:
+        session_id = uuid.UUID(request.GET.get('session_id') or '')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid session'}, status=400)
+    session = get_object_or_404(ChatSession, id=session_id)
+    if not user.is_staff and session.refugee_id != user.id:
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    before = None
+    if request.GET.get('before'):
+        try:
+            raw_timestamp, message_id = request.GET['before'].split('|', 1)
+            before = (parse_datetime(raw_timestamp), uuid.UUID(message_id))
+        except ValueError:
+            before = None
+        if not before or before[0] is None:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    page_size = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+    messages, has_more = _history_page(session, before, page_size)
+    return JsonResponse({
+        'messages': [NotificationService.serialize(m) | {'is_read': m.is_seen} for m in messages],
+        'has_more': has_more,
+        'cursor': _history_cursor(messages[0]) if messages else None,
     })
 
 
@@ -50,6 +114,12 @@ def upload_image(request):
     if not session_id or (not image_file and not audio_file):
         return JsonResponse({'error': 'No file or session provided'}, status=400)
 
+    retry_after = upload_throttle.check(user)
+    if retry_after:
+        response = JsonResponse({'error': 'Too many uploads, please wait.', 'retry_after': round(retry_after, 1)}, status=429)
+        response['Retry-After'] = str(max(1, round(retry_after)))
+        return response
+
     try:
         session = ChatSession.objects.get(id=session_id)
         if session.refugee != user and session.nurse != user:
@@ -87,6 +157,7 @@ def upload_image(request):
                     payload = {
                         'type': 'chat_message',
                         'id': str(message.id),
+                        'seq': message.seq,
                         'sender_id': user.id,
                         'text_original': message.text_original,
                         'text_translated': "",
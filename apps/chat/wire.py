@@ -0,0 +1,148 @@
+# apps/chat/wire.py
+import json
+import zlib
+import logging
+from datetime import datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# بروتوكول مضغوط اختياري عبر WebSocket subprotocol (العملاء القدامى يبقون على JSON)
+# Opt-in compact protocol negotiated as a WebSocket subprotocol (old clients stay on JSON)
+#
+#   chat.msgpack.v1          -> binary frame: 0x00 + msgpack(compact event)
+#   chat.msgpack.deflate.v1  -> as above, or 0x01 + raw-deflate(msgpack) when it is large
+#
+# Daphne does not negotiate permessage-deflate, so compression happens here.
+# ==============================================================================
+MSGPACK = 'chat.msgpack.v1'
+MSGPACK_DEFLATE = 'chat.msgpack.deflate.v1'
+
+RAW = b'\x00'
+DEFLATED = b'\x01'
+
+# أسماء قصيرة للحقول المتكررة / Short codes for the keys repeated in every event
+FIELD_CODES = {
+    'type': 't',
+    'id': 'i',
+    'seq': 'q',
+    'version': 'n',
+    'sender_id': 's',
+    'text_original': 'o',
+    'text_translated': 'r',
+    'ai_analysis': 'a',
+    'is_urgent': 'u',
+    'timestamp': 'm',
+    'is_read': 'd',
+    'image_url': 'g',
+    'audio_url': 'v',
+    'messages': 'ms',
+    'patches': 'ps',
+    'has_more': 'h',
+    'reader_id': 'rd',
+    'read_at': 'ra',
+    'side': 'sd',
+    'online': 'on',
+    'is_typing': 'ty',
+}
+
+# حقول الوقت تُرسل كـ epoch بالمللي ثانية بدل نص ISO / Times go out as epoch ms instead of ISO strings
+TIME_FIELDS = {'timestamp', 'read_at'}
+
+
+class JsonCodec:
+    """البروتوكول الحالي (نص JSON) / Current protocol (JSON text frames)"""
+    subprotocol = None
+    binary = False
+
+    def encode(self, event, viewer=None):
+        return json.dumps(event)
+
+
+class MsgpackCodec:
+    """
+    MessagePack بأسماء حقول قصيرة، ونرسل لكل مستلم النص الذي يعرضه فقط
+    MessagePack with short keys; each recipient only gets the text it displays.
+    """
+    binary = True
+
+    def __init__(self, deflate=False):
+        self.deflate = deflate
+        self.subprotocol = MSGPACK_DEFLATE if deflate else MSGPACK
+        self.min_deflate = getattr(settings, 'WS_DEFLATE_MIN_BYTES', 256)
+
+    @staticmethod
+    def _time(value):
+        try:
+            return int(datetime.fromisoformat(value).timestamp() * 1000)
+        except (TypeError, ValueError):
+            return value
+
+    def compact(self, event, viewer=None):
+        if isinstance(event, list):
+            return [self.compact(item, viewer) for item in event]
+        if not isinstance(event, dict):
+            return event
+
+        event = dict(event)
+        # اللاجئ يرى نصه الأصلي ونص الطرف الآخر المترجم فقط، والتحليل الطبي للممرضين فقط
+        # A refugee sees own original and others' translation; the AI analysis is for staff only
+        if viewer is not None and not viewer.is_staff and 'sender_id' in event:
+            event.pop('ai_analysis', None)
+            if event.get('sender_id') == viewer.id:
+                event.pop('text_translated', None)
+            elif event.get('text_translated') and not event.get('audio_url'):
+                # الرسائل الصوتية تعرض النص الأصلي تحت المشغل / Voice notes show the original under the player
+                event.pop('text_original', None)
+
+        compacted = {}
+        for key, value in event.items():
+            if value is None:
+                continue
+            if key in TIME_FIELDS:
+                value = self._time(value)
+            compacted[FIELD_CODES.get(key, key)] = self.compact(value, viewer)
+        return compacted
+
+    def encode(self, event, viewer=None):
+        import msgpack
+        packed = msgpack.packb(self.compact(event, viewer), use_bin_type=True)
+        if self.deflate and len(packed) >= self.min_deflate:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated = compressor.compress(packed) + compressor.flush()
+            if len(deflated) < len(packed):
+                return DEFLATED + deflated
+        return RAW + packed
+
+    @staticmethod
+    def decode(frame):
+        """إطارات العميل الثنائية (msgpack بأسماء كاملة) / Binary client frames (msgpack, full key names)"""
+        import msgpack
+        body = frame[1:]
+        if frame[:1] == DEFLATED:
+            body = zlib.decompress(body, -15)
+        return msgpack.unpackb(body, raw=False)
+
+
+def negotiate(subprotocols):
+    """
+    يختار أول بروتوكول مدعوم بترتيب العميل / Picks the first supported subprotocol in client order
+    """
+    if getattr(settings, 'WS_COMPACT_PROTOCOL_ENABLED', True):
+        for name in subprotocols or []:
+            if name == MSGPACK_DEFLATE:
+                return MsgpackCodec(deflate=True)
+            if name == MSGPACK:
+                return MsgpackCodec()
+    return JsonCodec()
+
+
+def wire_manifest():
+    """جدول الأسماء للمتصفح (json_script) / Key table for the browser (rendered with json_script)"""
+    return {
+        'enabled': getattr(settings, 'WS_COMPACT_PROTOCOL_ENABLED', True),
+        'codes': FIELD_CODES,
+        'time_fields': sorted(TIME_FIELDS),
+    }
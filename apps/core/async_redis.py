@@ -0,0 +1,19 @@
+# apps/core/async_redis.py
+import asyncio
+import weakref
+
+from django.conf import settings
+
+# عميل Redis غير متزامن لكل حلقة أحداث (الاتصالات مرتبطة بالحلقة)
+# One asyncio Redis client per event loop (connections are bound to their loop)
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis():
+    import redis.asyncio as aioredis
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(settings.REDIS_URL)
+        _clients[loop] = client
+    return client
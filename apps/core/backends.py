@@ -0,0 +1,205 @@
+# apps/core/backends.py
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from types import SimpleNamespace
+
+import httpx
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# 1. Registry (اختيار الخدمة من الإعدادات / backend selected from settings)
+# ==============================================================================
+# translation -> class with fetch_translation / fetch_translations (like AzureClient)
+# vision / transcription -> factory returning an OpenAI-compatible client (or None)
+BACKEND_REGISTRY = {
+    'translation': {
+        'azure': 'apps.core.services.AzureClient',
+        'stub': 'apps.core.backends.StubTranslationClient',
+    },
+    'vision': {
+        'azure': 'apps.core.backends.azure_vision_client',
+        'stub': 'apps.core.backends.StubOpenAIClient',
+    },
+    'transcription': {
+        'azure': 'apps.core.backends.azure_transcription_client',
+        'stub': 'apps.core.backends.StubOpenAIClient',
+    },
+}
+
+
+def get_backend(kind):
+    name = getattr(settings, 'AI_BACKENDS', {}).get(kind, 'azure')
+    try:
+        path = BACKEND_REGISTRY[kind][name]
+    except KeyError:
+        raise ValueError(f"Unknown AI backend '{name}' for '{kind}'")
+    return import_string(path)()
+
+
+def azure_vision_client():
+    api_key = getattr(settings, 'AZURE_OPENAI_KEY', None)
+    endpoint = getattr(settings, 'AZURE_OPENAI_ENDPOINT', None)
+    if not (api_key and endpoint):
+        return None
+    from openai import AzureOpenAI
+    return AzureOpenAI(api_key=api_key, api_version="2024-12-01-preview", azure_endpoint=endpoint)
+
+
+def azure_transcription_client():
+    from openai import AzureOpenAI
+    return AzureOpenAI(
+        api_key=settings.AZURE_OPENAI_KEY,
+        api_version="2024-02-01",
+        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT
+    )
+
+
+# ==============================================================================
+# 2. Deterministic stub (لاختبار الحمل بدون شبكة / offline load testing)
+# ==============================================================================
+class StubFaults:
+    """
+    محاكاة زمن الاستجابة والأخطاء و429 بشكل قابل للتكرار (بذرة ثابتة)
+    Reproducible latency, error and 429 injection driven by AI_STUB_OPTIONS:
+        latency_distribution: 'fixed' | 'uniform' | 'normal' | 'lognormal'
+        latency_ms:           median latency
+        latency_jitter:       spread (ms for uniform/normal, sigma for lognormal)
+        error_rate:           share of calls failing with a 503
+        throttle_rate:        share of calls failing with a 429
+        retry_after:          Retry-After seconds sent with injected 429s
+        seed:                 RNG seed, same seed = same sequence
+    """
+    _lock = threading.Lock()
+    _rng = None
+
+    def __init__(self):
+        options = getattr(settings, 'AI_STUB_OPTIONS', {})
+        self.distribution = options.get('latency_distribution', 'lognormal')
+        self.latency_ms = float(options.get('latency_ms', 80))
+        self.jitter = float(options.get('latency_jitter', 0.5))
+        self.error_rate = float(options.get('error_rate', 0.0))
+        self.throttle_rate = float(options.get('throttle_rate', 0.0))
+        self.retry_after = int(options.get('retry_after', 2))
+        with StubFaults._lock:
+            if StubFaults._rng is None:
+                StubFaults._rng = random.Random(options.get('seed', 42))
+
+    @classmethod
+    def reseed(cls, seed):
+        with cls._lock:
+            cls._rng = random.Random(seed)
+
+    def _draw(self):
+        with StubFaults._lock:
+            rng = StubFaults._rng
+            if self.distribution == 'fixed':
+                latency = self.latency_ms
+            elif self.distribution == 'uniform':
+                latency = rng.uniform(self.latency_ms - self.jitter, self.latency_ms + self.jitter)
+            elif self.distribution == 'normal':
+                latency = rng.gauss(self.latency_ms, self.jitter)
+            else:
+                latency = rng.lognormvariate(math.log(max(self.latency_ms, 1)), self.jitter)
+            roll = rng.random()
+        return max(0.0, latency) / 1000, roll
+
+    def _outcome(self, roll):
+        if roll < self.throttle_rate:
+            return 'throttle'
+        if roll < self.throttle_rate + self.error_rate:
+            return 'error'
+        return 'ok'
+
+    def apply(self):
+        """ينام ثم يعيد 'ok' أو 'throttle' أو 'error' / Sleeps, then returns the injected outcome"""
+        latency, roll = self._draw()
+        time.sleep(latency)
+        return self._outcome(roll)
+
+    async def aapply(self):
+        latency, roll = self._draw()
+        await asyncio.sleep(latency)
+        return self._outcome(roll)
+
+
+def _stub_http_error(status_code, retry_after=None):
+    request = httpx.Request('POST', 'http://stub.invalid/translate')
+    headers = {'Retry-After': str(retry_after)} if retry_after else {}
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"{status_code} injected by stub", request=request, response=response)
+
+
+class StubTranslationClient:
+    """
+    بديل لـ AzureClient: نفس الواجهة ونفس أنواع الأخطاء (لتمر عبر RetryPolicy والقاطع)
+    Drop-in for AzureClient raising the same httpx errors, so retries,
+    throttling and the circuit breaker are exercised exactly as in production.
+    """
+    MAX_BATCH_SIZE = 100
+    MAX_BATCH_CHARS = 50000
+
+    def __init__(self):
+        self.faults = StubFaults()
+
+    def fetch_translation(self, text, src, dest):
+        results = self.fetch_translations([text], src, dest)
+        return results[0] if results else None
+
+    def fetch_translations(self, texts, src, dest):
+        return self._result(self.faults.apply(), texts, dest)
+
+    async def afetch_translations(self, texts, src, dest):
+        return self._result(await self.faults.aapply(), texts, dest)
+
+    def _result(self, outcome, texts, dest):
+        if outcome == 'throttle':
+            raise _stub_http_error(429, self.faults.retry_after)
+        if outcome == 'error':
+            raise _stub_http_error(503)
+        return [f"[{dest}] {text}" for text in texts]
+
+
+class StubAPIError(Exception):
+    """يشبه أخطاء openai (فيها status_code) / Mimics openai errors (carries status_code)"""
+    def __init__(self, status_code):
+        self.status_code = status_code
+        super().__init__(f"{status_code} injected by stub")
+
+
+class StubOpenAIClient:
+    """
+    بديل لعميل AzureOpenAI يغطي chat.completions و audio.transcriptions
+    Stand-in for the AzureOpenAI client covering chat.completions and audio.transcriptions.
+    """
+    def __init__(self):
+        self.faults = StubFaults()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._transcribe))
+
+    def _check(self):
+        outcome = self.faults.apply()
+        if outcome == 'throttle':
+            raise StubAPIError(429)
+        if outcome == 'error':
+            raise StubAPIError(503)
+
+    def _complete(self, **kwargs):
+        self._check()
+        content = (
+            "- **Funn:** Stub-analyse\n"
+            "- **Mulig årsak:** Ingen (testdata)\n"
+            "- **Anbefaling:** Contact a doctor"
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def _transcribe(self, **kwargs):
+        self._check()
+        return SimpleNamespace(text="Stub transcription")
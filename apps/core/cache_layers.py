@@ -0,0 +1,249 @@
+# apps/core/cache_layers.py
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class LocalLRUCache:
+    """
+    كاش محلي داخل العملية (L1) بحجم محدود ومدة صلاحية
+    Bounded in-process LRU (L1) with a per-entry TTL.
+    """
+    def __init__(self, max_size=2048, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                # انتهت الصلاحية / Expired entries count as a miss and an eviction
+                del self._data[key]
+                self.misses += 1
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class RedisCacheLayer:
+    """
+    طبقة Redis المشتركة بين كل العمليات (L2)
+    Shared Redis tier (L2) on top of Django's cache framework.
+    Redis evicts keys on its own, so evictions are read from the server INFO.
+    With encrypt=True values are stored as Fernet ciphertext (same keys and format as
+    EncryptedTextField), so patient text never sits in Redis as plaintext.
+    """
+    def __init__(self, alias='default', ttl=86400, encrypt=False):
+        self.alias = alias
+        self.ttl = ttl
+        self.encrypt = encrypt
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _seal(self, value):
+        if not self.encrypt:
+            return value
+        from apps.chat.crypto import build_fernet, current_keys, encrypt_one
+        return encrypt_one(build_fernet(current_keys()), value)
+
+    def _open(self, value):
+        if not self.encrypt or value is None:
+            return value
+        from apps.chat.crypto import build_fernet, current_keys, decrypt_one, DECRYPT_ERROR
+        plain = decrypt_one(build_fernet(current_keys()), value)
+        # مفتاح قديم أو قيمة غير مشفرة: نعاملها كغياب / Unknown key or legacy plaintext: treat as a miss
+        return None if plain == DECRYPT_ERROR else plain
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get(self, key):
+        try:
+            value = self._open(self.backend.get(key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ L2 cache read error: {e}")
+            return None
+        return self._count(value)
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, self._seal(value), timeout=self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ L2 cache write error: {e}")
+
+    async def aget(self, key):
+        try:
+            value = self._open(await self.backend.aget(key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ L2 cache read error: {e}")
+            return None
+        return self._count(value)
+
+    async def aset(self, key, value):
+        try:
+            await self.backend.aset(key, self._seal(value), timeout=self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ L2 cache write error: {e}")
+
+    def _server_evictions(self):
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection(self.alias).info('stats').get('evicted_keys')
+        except Exception:
+            return None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'evictions': self._server_evictions(),
+        }
+
+
+class UsageTracker:
+    """
+    تتبع استخدام الكاش بالكتابة المؤجلة: عدادات في الذاكرة تُدفع إلى Redis على دفعات،
+    ثم مهمة Celery دورية تكتبها في قاعدة البيانات.
+    Write-behind usage tracking: hits are counted in memory, pushed to Redis in
+    batches, and a periodic Celery task applies them to TranslationCache rows.
+    """
+    PENDING_KEY = 'tr_usage:pending'
+    STATS_KEY = 'tr_usage:stats'
+
+    def __init__(self, push_every=100, push_interval=10):
+        self.push_every = push_every
+        self.push_interval = push_interval
+        self._pending = {}
+        self._misses = 0
+        self._count = 0
+        self._last_push = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _redis(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def record_hit(self, text_hash, src, dest):
+        with self._lock:
+            field = f"{text_hash}|{src}|{dest}"
+            self._pending[field] = self._pending.get(field, 0) + 1
+            self._count += 1
+        self._maybe_push()
+
+    def record_miss(self):
+        with self._lock:
+            self._misses += 1
+            self._count += 1
+        self._maybe_push()
+
+    def _maybe_push(self):
+        if self._count >= self.push_every or time.monotonic() - self._last_push >= self.push_interval:
+            self.push()
+
+    def push(self):
+        with self._lock:
+            pending, misses = self._pending, self._misses
+            self._pending, self._misses, self._count = {}, 0, 0
+            self._last_push = time.monotonic()
+        if not pending and not misses:
+            return
+        try:
+            pipe = self._redis().pipeline()
+            for field, count in pending.items():
+                pipe.hincrby(self.PENDING_KEY, field, count)
+            pipe.hincrby(self.STATS_KEY, 'hits', sum(pending.values()))
+            pipe.hincrby(self.STATS_KEY, 'misses', misses)
+            pipe.execute()
+        except Exception as e:
+            # العدادات للإحصاء فقط، فقدانها مقبول / Counters are best-effort, losing them is fine
+            logger.warning(f"⚠️ Usage tracker push failed: {e}")
+
+    def drain(self):
+        """
+        يسحب كل العدادات المعلقة بشكل ذري / Atomically take every pending counter.
+        Returns {(hash, src, dest): hits}.
+        """
+        redis = self._redis()
+        processing_key = f"{self.PENDING_KEY}:processing"
+        try:
+            redis.rename(self.PENDING_KEY, processing_key)
+        except Exception:
+            # لا توجد عدادات معلقة / Nothing pending
+            return {}
+        raw = redis.hgetall(processing_key)
+        redis.delete(processing_key)
+        usage = {}
+        for field, count in raw.items():
+            text_hash, src, dest = field.decode().split('|')
+            usage[(text_hash, src, dest)] = int(count)
+        return usage
+
+    def stats(self):
+        try:
+            raw = self._redis().hgetall(self.STATS_KEY)
+        except Exception:
+            return {'hits': 0, 'misses': 0, 'hit_ratio': None}
+        hits = int(raw.get(b'hits', 0))
+        misses = int(raw.get(b'misses', 0))
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 3) if total else None,
+        }
+
+
+usage_tracker = UsageTracker()
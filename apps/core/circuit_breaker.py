@@ -0,0 +1,168 @@
+# apps/core/circuit_breaker.py
+import time
+import asyncio
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """الدائرة مفتوحة: فشل فوري بدون انتظار المهلة / Circuit is open: fail fast without waiting for timeouts"""
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f"Circuit '{name}' is open")
+
+
+class CircuitBreaker:
+    """
+    قاطع دائرة مشترك بين كل العمال (الحالة في Redis)
+    Circuit breaker whose state lives in Redis, so every worker sees it.
+
+    closed    -> calls go through; `failure_threshold` consecutive failures open it.
+    open      -> calls fail immediately with CircuitOpen for `recovery_timeout` seconds.
+    half_open -> one probe call is let through; success closes, failure re-opens.
+    """
+    METRICS_KEY = 'cb:metrics'
+
+    def __init__(self, name, failure_threshold=None, recovery_timeout=None, is_outage=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5)
+        self.recovery_timeout = recovery_timeout or getattr(settings, 'CIRCUIT_BREAKER_RECOVERY_TIMEOUT', 30)
+        # هل الخطأ يعني أن الخدمة معطلة؟ (429 أو 400 لا تعني ذلك)
+        # Does this error mean the service is down? (a 429 or a 400 does not)
+        self.is_outage = is_outage or (lambda error: True)
+        self.key = f"cb:{name}"
+        self._state = CLOSED
+        self._failures = 0
+
+    def _redis(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def _transition(self, redis, state):
+        pipe = redis.pipeline()
+        mapping = {'state': state, 'failures': 0}
+        if state == OPEN:
+            mapping['opened_at'] = str(time.time())
+        pipe.hset(self.key, mapping=mapping)
+        pipe.hincrby(self.METRICS_KEY, f"{self.name}:{state}", 1)
+        pipe.execute()
+        log = logger.info if state == CLOSED else logger.warning
+        log(f"🔌 Circuit '{self.name}' -> {state.upper()}")
+
+    def allow(self):
+        try:
+            redis = self._redis()
+            state, failures, opened_at = redis.hmget(self.key, 'state', 'failures', 'opened_at')
+        except Exception as e:
+            logger.warning(f"⚠️ Circuit breaker unavailable ({self.name}), allowing call: {e}")
+            return True
+
+        self._state = state.decode() if state else CLOSED
+        self._failures = int(failures or 0)
+        if self._state == CLOSED:
+            return True
+
+        if time.time() - float(opened_at or 0) < self.recovery_timeout:
+            return False
+
+        # مكالمة تجريبية واحدة فقط لكل العمال / Exactly one probe across all workers
+        if redis.set(f"{self.key}:probe", 1, nx=True, ex=self.recovery_timeout):
+            if self._state != HALF_OPEN:
+                self._transition(redis, HALF_OPEN)
+                self._state = HALF_OPEN
+            return True
+        return False
+
+    async def aallow(self):
+        """
+        فحص للقراءة فقط على حلقة الأحداث: المكالمة التجريبية تبقى لعمال Celery
+        Read-only check for the event loop: only a closed circuit lets the call through,
+        the half-open probe is left to the Celery workers.
+        """
+        try:
+            from apps.core.async_redis import get_async_redis
+            state = await asyncio.wait_for(get_async_redis().hget(self.key, 'state'), timeout=1)
+        except Exception as e:
+            logger.warning(f"⚠️ Circuit breaker unavailable ({self.name}), allowing call: {e}")
+            return True
+        return (state.decode() if state else CLOSED) == CLOSED
+
+    def record_success(self):
+        if self._state == CLOSED and not self._failures:
+            return
+        try:
+            redis = self._redis()
+            if self._state != CLOSED:
+                self._transition(redis, CLOSED)
+                redis.delete(f"{self.key}:probe")
+            else:
+                redis.hset(self.key, 'failures', 0)
+        except Exception as e:
+            logger.warning(f"⚠️ Circuit breaker write failed ({self.name}): {e}")
+
+    def record_failure(self):
+        try:
+            redis = self._redis()
+            if self._state == HALF_OPEN:
+                self._transition(redis, OPEN)
+                redis.delete(f"{self.key}:probe")
+                return
+            failures = redis.hincrby(self.key, 'failures', 1)
+            if failures >= self.failure_threshold:
+                self._transition(redis, OPEN)
+        except Exception as e:
+            logger.warning(f"⚠️ Circuit breaker write failed ({self.name}): {e}")
+
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if self.is_outage(e):
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+def breaker_snapshot(names):
+    """
+    حالة كل قاطع وعدد التحولات لكل حالة / State of each breaker plus transition counters
+    """
+    snapshot = []
+    try:
+        from django_redis import get_redis_connection
+        redis = get_redis_connection('default')
+        metrics = {k.decode(): int(v) for k, v in redis.hgetall(CircuitBreaker.METRICS_KEY).items()}
+        for name in names:
+            state = redis.hget(f"cb:{name}", 'state')
+            snapshot.append({
+                'name': name,
+                'state': state.decode() if state else CLOSED,
+                'opened': metrics.get(f"{name}:{OPEN}", 0),
+                'half_opened': metrics.get(f"{name}:{HALF_OPEN}", 0),
+                'closed': metrics.get(f"{name}:{CLOSED}", 0),
+            })
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read circuit breaker metrics: {e}")
+    return snapshot
+
+
+def is_openai_outage(error):
+    """أخطاء 4xx من Azure OpenAI (فلتر المحتوى، 429) لا تعني أن الخدمة معطلة / 4xx don't mean an outage"""
+    status = getattr(error, 'status_code', None)
+    return not (status and 400 <= status < 500)
+
+
+# أسماء الخدمات الخارجية / External dependency names
+TRANSLATOR = 'azure_translator'
+VISION = 'azure_openai_vision'
+WHISPER = 'azure_openai_whisper'
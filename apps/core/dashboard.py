@@ -11,6 +11,9 @@ from django.utils.translation import gettext_lazy as _
 # Import models
 from apps.accounts.models import User
 from apps.chat.models import ChatSession, EpidemicAlert
+from apps.core.rate_limit import get_translator_limiter
+from apps.core.circuit_breaker import breaker_snapshot, TRANSLATOR, VISION, WHISPER
+from apps.chat.outbox import outbox_snapshot
 
 @method_decorator(staff_member_required, name='dispatch')
 class MedicalDashboardView(TemplateView):
@@ -127,4 +130,19 @@ class MedicalDashboardView(TemplateView):
             "active_now": ChatSession.objects.filter(is_active=True).count()
         }
 
+        # 4. استهلاك حصص Azure (لمعرفة مدى قربنا من السقف)
+        # 4. Azure quota utilisation (how close we are to the ceiling)
+        context['translator_quotas'] = [
+            {"name": name, **data, "percent": max(0, min(100, int(data["utilisation"] * 100)))}
+            for name, data in get_translator_limiter().utilisation().items()
+        ]
+
+        # 5. حالة قواطع الدوائر لكل خدمة خارجية
+        # 5. Circuit breaker state per external service
+        context['circuit_breakers'] = breaker_snapshot([TRANSLATOR, VISION, WHISPER])
+
+        # 6. تسليم WebSocket: الدمج والإسقاط وفصل العملاء البطيئين
+        # 6. WebSocket delivery: coalesced, dropped and evicted slow consumers
+        context['ws_outbox'] = outbox_snapshot()
+
         return context
\ No newline at end of file
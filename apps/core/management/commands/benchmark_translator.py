@@ -0,0 +1,103 @@
+import json
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+import requests
+
+from apps.core.services import AzureClient
+
+
+class _StubTranslatorHandler(BaseHTTPRequestHandler):
+    """خادم محلي يحاكي Azure Translator / Local stub mimicking Azure Translator v3"""
+    protocol_version = "HTTP/1.1"  # ضروري لإبقاء الاتصال مفتوحاً / needed for keep-alive
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'[]')
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.dumps([
+            {'translations': [{'text': item['text'][::-1], 'to': 'xx'}]} for item in body
+        ]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark the old per-call requests client against the pooled httpx clients (sync, threads and async), using a local stub server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--latency-ms', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        concurrency = options['concurrency']
+        _StubTranslatorHandler.latency = options['latency_ms'] / 1000
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _StubTranslatorHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+        try:
+            with override_settings(
+                AZURE_TRANSLATOR_KEY='benchmark',
+                AZURE_TRANSLATOR_ENDPOINT=endpoint,
+                AZURE_TRANSLATOR_REGION='local',
+            ):
+                texts = [f"hei {i}" for i in range(total)]
+
+                # requests.post بدون جلسة = العميل القديم، اتصال جديد لكل طلب
+                # Module-level requests.post: the previous client, one new connection per call
+                legacy = AzureClient(http=requests)
+                started = time.perf_counter()
+                for text in texts:
+                    legacy.fetch_translation(text, 'no', 'en')
+                self._report("requests (new connection per call)", total, time.perf_counter() - started)
+
+                pooled = AzureClient()
+                started = time.perf_counter()
+                for text in texts:
+                    pooled.fetch_translation(text, 'no', 'en')
+                self._report("httpx pooled, sync (Celery)", total, time.perf_counter() - started)
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    list(executor.map(lambda text: pooled.fetch_translation(text, 'no', 'en'), texts))
+                self._report(f"httpx pooled, threads={concurrency}", total, time.perf_counter() - started)
+
+                started = time.perf_counter()
+                asyncio.run(self._run_async(pooled, texts, concurrency))
+                self._report(f"httpx async, concurrency={concurrency}", total, time.perf_counter() - started)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    async def _run_async(self, client, texts, concurrency):
+        # مثل ChatConsumer: عدة مهام على حلقة واحدة تشترك في مجمع httpx / Like ChatConsumer: many tasks on one loop sharing the pool
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(text):
+            async with semaphore:
+                return await client.afetch_translations([text], 'no', 'en')
+
+        await asyncio.gather(*(one(text) for text in texts))
+
+    def _report(self, label, total, elapsed):
+        self.stdout.write(
+            f"{label:<40} {total / elapsed:8.1f} req/s   {elapsed * 1000 / total:7.2f} ms/req"
+        )
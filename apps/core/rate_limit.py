@@ -0,0 +1,286 @@
+# apps/core/rate_limit.py
+import time
+import asyncio
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TranslatorThrottled(Exception):
+    """
+    يُرفع عند تجاوز الحصة بدلاً من النوم داخل العامل، لكي تعيد المهمة جدولة نفسها
+    Raised instead of sleeping in the worker, so the Celery task can reschedule itself.
+    """
+    def __init__(self, retry_after, quota=None):
+        self.retry_after = max(1, int(round(retry_after)))
+        self.quota = quota
+        super().__init__(f"Throttled on '{quota or 'azure'}', retry after {self.retry_after}s")
+
+
+def retry_after_seconds(response, default):
+    """قراءة ترويسة Retry-After من رد Azure / Read the Retry-After header (seconds form)"""
+    if response is None:
+        return default
+    value = response.headers.get('Retry-After')
+    try:
+        return max(1, int(float(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+# ==============================================================================
+# Token bucket مشترك بين كل العمال (Lua = عملية ذرية واحدة)
+# Token bucket shared by every worker (one atomic Lua call for all quotas)
+# ==============================================================================
+# KEYS: one hash per quota. ARGV: now, then (rate, capacity, requested) per key.
+# Either every bucket has enough tokens and all are charged, or none is charged
+# and the longest wait is returned.
+TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local states = {}
+local wait = 0
+local blocked = 0
+for i, key in ipairs(KEYS) do
+    local base = 2 + (i - 1) * 3
+    local rate = tonumber(ARGV[base])
+    local capacity = tonumber(ARGV[base + 1])
+    local requested = math.min(tonumber(ARGV[base + 2]), capacity)
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    if tokens < requested then
+        local needed = (requested - tokens) / rate
+        if needed > wait then
+            wait = needed
+            blocked = i
+        end
+    end
+    states[i] = {tokens, requested, capacity, rate}
+end
+for i, key in ipairs(KEYS) do
+    local s = states[i]
+    local tokens = s[1]
+    if blocked == 0 then
+        tokens = tokens - s[2]
+        redis.call('HINCRBY', key, 'granted', math.floor(s[2]))
+    elseif blocked == i then
+        redis.call('HINCRBY', key, 'throttled', 1)
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now), 'capacity', tostring(s[3]))
+    redis.call('EXPIRE', key, math.ceil(s[3] / s[4]) * 2 + 60)
+end
+return {blocked, tostring(wait)}
+"""
+
+
+class Quota:
+    def __init__(self, name, per_minute):
+        self.name = name
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+
+    @property
+    def key(self):
+        return f"ratelimit:{self.name}"
+
+
+class DistributedRateLimiter:
+    """
+    محدد معدل موزع فوق Redis يبقينا تحت حصص Azure قبل أن نحصل على 429
+    Redis-backed limiter keeping all workers under the Azure quotas ahead of time.
+    Fails open when Redis is unreachable.
+    """
+    _script = None
+    _async_script = None
+
+    def __init__(self, quotas):
+        self.quotas = {quota.name: quota for quota in quotas}
+
+    def _redis(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def _get_script(self, redis):
+        if DistributedRateLimiter._script is None:
+            DistributedRateLimiter._script = redis.register_script(TOKEN_BUCKET_LUA)
+        return DistributedRateLimiter._script
+
+    def acquire(self, **amounts):
+        """
+        acquire(azure_translator_chars=120, azure_translator_requests=1)
+        Raises TranslatorThrottled with the wait needed when any quota is exhausted.
+        """
+        quotas, args = self._plan(amounts)
+        if not quotas:
+            return
+        try:
+            redis = self._redis()
+            blocked, wait = self._get_script(redis)(keys=[q.key for q in quotas], args=args, client=redis)
+        except Exception as e:
+            logger.warning(f"⚠️ Rate limiter unavailable, allowing call: {e}")
+            return
+        self._raise_if_blocked(quotas, blocked, wait)
+
+    async def aacquire(self, **amounts):
+        """نفس acquire على عميل redis.asyncio / acquire() on the per-loop redis.asyncio client"""
+        quotas, args = self._plan(amounts)
+        if not quotas:
+            return
+        try:
+            from apps.core.async_redis import get_async_redis
+            redis = get_async_redis()
+            if DistributedRateLimiter._async_script is None:
+                DistributedRateLimiter._async_script = redis.register_script(TOKEN_BUCKET_LUA)
+            blocked, wait = await asyncio.wait_for(
+                DistributedRateLimiter._async_script(keys=[q.key for q in quotas], args=args, client=redis), timeout=1
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Rate limiter unavailable, allowing call: {e}")
+            return
+        self._raise_if_blocked(quotas, blocked, wait)
+
+    def _plan(self, amounts):
+        quotas = [self.quotas[name] for name in amounts if name in self.quotas]
+        args = [time.time()]
+        for quota in quotas:
+            args.extend([quota.rate, quota.capacity, amounts[quota.name]])
+        return quotas, args
+
+    @staticmethod
+    def _raise_if_blocked(quotas, blocked, wait):
+        if int(blocked):
+            quota = quotas[int(blocked) - 1]
+            raise TranslatorThrottled(float(wait), quota=quota.name)
+
+    def _penalty(self, retry_after):
+        now = str(time.time())
+        return {
+            quota.key: {
+                'tokens': str(-quota.rate * retry_after),
+                'ts': now,
+                'capacity': str(quota.capacity),
+            }
+            for quota in self.quotas.values()
+        }
+
+    def penalise(self, retry_after):
+        """
+        عند وصول 429 نفرغ كل الدلاء لكي يتوقف كل العمال حتى Retry-After
+        On a 429, drain every bucket so all workers back off until Retry-After.
+        """
+        try:
+            redis = self._redis()
+            pipe = redis.pipeline()
+            for key, mapping in self._penalty(retry_after).items():
+                pipe.hset(key, mapping=mapping)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Could not record 429 penalty: {e}")
+
+    async def apenalise(self, retry_after):
+        try:
+            from apps.core.async_redis import get_async_redis
+            pipe = get_async_redis().pipeline()
+            for key, mapping in self._penalty(retry_after).items():
+                pipe.hset(key, mapping=mapping)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Could not record 429 penalty: {e}")
+
+    def utilisation(self):
+        """
+        نسبة الاستهلاك لكل حصة / Per-quota utilisation (0..1) plus granted/throttled counters
+        """
+        report = {}
+        try:
+            redis = self._redis()
+            now = time.time()
+            for quota in self.quotas.values():
+                data = {k.decode(): v.decode() for k, v in redis.hgetall(quota.key).items()}
+                tokens = float(data.get('tokens', quota.capacity))
+                elapsed = max(0.0, now - float(data.get('ts', now)))
+                tokens = min(quota.capacity, tokens + elapsed * quota.rate)
+                report[quota.name] = {
+                    'utilisation': round(1 - tokens / quota.capacity, 3),
+                    'granted': int(data.get('granted', 0)),
+                    'throttled': int(data.get('throttled', 0)),
+                    'capacity_per_minute': quota.capacity,
+                }
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read rate limiter metrics: {e}")
+        return report
+
+
+def get_translator_limiter():
+    return DistributedRateLimiter([
+        Quota('azure_translator_chars', getattr(settings, 'AZURE_TRANSLATOR_CHARS_PER_MINUTE', 33000)),
+        Quota('azure_translator_requests', getattr(settings, 'AZURE_TRANSLATOR_REQUESTS_PER_MINUTE', 600)),
+    ])
+
+
+# ==============================================================================
+# Throttle لكل مستخدم (WebSocket و HTTP) بنفس سكربت Lua: رحلة واحدة ذرية إلى Redis
+# Per-user throttle for WebSocket frames and HTTP views, same Lua script: one atomic round trip
+# ==============================================================================
+class RequestThrottle:
+    """
+    الحدود من RATE_LIMITS حسب نقطة الوصول والدور / Limits come from RATE_LIMITS per endpoint and role:
+        RATE_LIMITS = {'ws_message': {'REFUGEE': 30, 'STAFF': None, 'default': 30}, ...}
+    Values are requests per minute (also the burst size); None means unlimited.
+    check()/acheck() return 0 when allowed, else the seconds to wait. Fails open.
+    """
+    _scripts = {}
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def quota_for(self, user):
+        limits = getattr(settings, 'RATE_LIMITS', {}).get(self.endpoint, {})
+        role = 'STAFF' if user.is_staff else getattr(user, 'role', None)
+        per_minute = limits.get(role, limits.get('default'))
+        if not per_minute:
+            return None
+        return Quota(f"{self.endpoint}:{user.id}", per_minute)
+
+    @staticmethod
+    def _args(quota, cost):
+        # طلب أكبر من الدلو يُحسب كدلو كامل (وإلا لن يمر أبداً) / Costs above the burst size count as a full bucket
+        return [time.time(), quota.rate, quota.capacity, min(cost, quota.capacity)]
+
+    def check(self, user, cost=1):
+        quota = self.quota_for(user)
+        if quota is None:
+            return 0
+        try:
+            from django_redis import get_redis_connection
+            redis = get_redis_connection('default')
+            script = RequestThrottle._scripts.get('sync')
+            if script is None:
+                script = RequestThrottle._scripts['sync'] = redis.register_script(TOKEN_BUCKET_LUA)
+            blocked, wait = script(keys=[quota.key], args=self._args(quota, cost), client=redis)
+        except Exception as e:
+            logger.warning(f"⚠️ Throttle unavailable ({self.endpoint}), allowing request: {e}")
+            return 0
+        return float(wait) if int(blocked) else 0
+
+    async def acheck(self, user, cost=1):
+        quota = self.quota_for(user)
+        if quota is None:
+            return 0
+        try:
+            from apps.core.async_redis import get_async_redis
+            redis = get_async_redis()
+            script = RequestThrottle._scripts.get('async')
+            if script is None:
+                script = RequestThrottle._scripts['async'] = redis.register_script(TOKEN_BUCKET_LUA)
+            # نمرر العميل الحالي لأن العميل مرتبط بحلقة الأحداث / Pass the current client: clients are per loop
+            blocked, wait = await asyncio.wait_for(
+                script(keys=[quota.key], args=self._args(quota, cost), client=redis), timeout=1
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Throttle unavailable ({self.endpoint}), allowing request: {e}")
+            return 0
+        return float(wait) if int(blocked) else 0
@@ -1,39 +1,119 @@
-import requests
+import httpx
+import asyncio
 import logging
+import threading
+import weakref
 import uuid
 import time
+import json
 from django.conf import settings
 from django.apps import apps
 from django.db import IntegrityError # 🛑 1. إضافة هذا الاستيراد
 
+from .cache_layers import LocalLRUCache, RedisCacheLayer, usage_tracker
+from .rate_limit import TranslatorThrottled, get_translator_limiter, retry_after_seconds
+from .single_flight import SingleFlight
+from .circuit_breaker import CircuitBreaker, CircuitOpen, TRANSLATOR
+from .backends import get_backend
+
 logger = logging.getLogger(__name__)
 
 # ==============================================================================
 # 1. Cache Repository (مسؤول عن قاعدة البيانات فقط)
 # ==============================================================================
 class CacheRepository:
+    """
+    كاش بثلاث طبقات: ذاكرة العملية (L1) ثم Redis (L2) ثم قاعدة البيانات (الطبقة الباردة)
+    Three tiers: in-process LRU (L1), Redis (L2), then Postgres as the cold tier.
+    L1 is shared by every repository in the process, so repeated phrases
+    never pay a DB query or a Fernet decrypt.
+    """
+    _local = None
+    _shared = None
+    _db_stats = {'hits': 0, 'misses': 0}
+
     def __init__(self):
         # نجلبه ديناميكياً لتجنب مشاكل الاستيراد الدائري
         self.model = apps.get_model('chat', 'TranslationCache')
+        self.local = self.get_local_tier()
+        self.shared = self.get_shared_tier()
+        self.use_shared = getattr(settings, 'TRANSLATION_CACHE_L2_ENABLED', True)
+
+    @classmethod
+    def get_local_tier(cls):
+        if cls._local is None:
+            cls._local = LocalLRUCache(
+                max_size=getattr(settings, 'TRANSLATION_CACHE_L1_SIZE', 2048),
+                ttl=getattr(settings, 'TRANSLATION_CACHE_L1_TTL', 3600),
+            )
+        return cls._local
+
+    @classmethod
+    def get_shared_tier(cls):
+        if cls._shared is None:
+            # الترجمات بيانات مرضى: تُخزن مشفرة في Redis / Translations are patient data: encrypted in Redis
+            cls._shared = RedisCacheLayer(ttl=getattr(settings, 'TRANSLATION_CACHE_L2_TTL', 86400), encrypt=True)
+        return cls._shared
+
+    @classmethod
+    def stats(cls):
+        """عدادات كل طبقة لضبط الأحجام / Per-tier counters for sizing the cache"""
+        return {
+            'l1': cls.get_local_tier().stats(),
+            'l2': cls.get_shared_tier().stats(),
+            'db': dict(cls._db_stats),
+        }
+
+    def make_key(self, text_hash, src, dest):
+        return f"tr:{src}:{dest}:{text_hash}"
+
+    def _remember(self, key, translated_text):
+        self.local.set(key, translated_text)
+        if self.use_shared:
+            self.shared.set(key, translated_text)
 
     def get(self, text, src, dest):
         try:
             text_hash = self.model.make_hash(text)
+            key = self.make_key(text_hash, src, dest)
+
+            # 1. L1 (بدون شبكة / no network)
+            cached = self.local.get(key)
+            if cached is not None:
+                usage_tracker.record_hit(text_hash, src, dest)
+                return cached
+
+            # 2. L2 (Redis)
+            if self.use_shared:
+                cached = self.shared.get(key)
+                if cached is not None:
+                    self.local.set(key, cached)
+                    usage_tracker.record_hit(text_hash, src, dest)
+                    return cached
+
+            # 3. قاعدة البيانات / Cold tier
             cached = self.model.objects.filter(
                 source_hash=text_hash,
                 source_language=src,
                 target_language=dest
             ).first()
             if cached:
-                logger.info("✅ Cache HIT")
+                self._db_stats['hits'] += 1
+                logger.info("✅ Cache HIT (DB)")
+                self._remember(key, cached.translated_text)
+                usage_tracker.record_hit(text_hash, src, dest)
                 return cached.translated_text
+            self._db_stats['misses'] += 1
+            usage_tracker.record_miss()
         except Exception as e:
             logger.warning(f"⚠️ Cache read error: {e}")
         return None
 
     def save(self, text, translated_text, src, dest):
+        text_hash = self.model.make_hash(text)
+        # نملأ الطبقات السريعة عند الكتابة / Populate the fast tiers on write
+        self._remember(self.make_key(text_hash, src, dest), translated_text)
         try:
-            text_hash = self.model.make_hash(text)
             self.model.objects.create(
                 source_hash=text_hash,
                 source_language=src,
@@ -51,45 +131,229 @@ class CacheRepository:
             logger.error(f"❌ Cache write error: {e}")
 
 
+    async def aget(self, text, src, dest):
+        """نسخة غير متزامنة لـ get / Async variant of get() for the consumer path"""
+        try:
+            text_hash = self.model.make_hash(text)
+            key = self.make_key(text_hash, src, dest)
+
+            cached = self.local.get(key)
+            if cached is not None:
+                usage_tracker.record_hit(text_hash, src, dest)
+                return cached
+
+            if self.use_shared:
+                cached = await self.shared.aget(key)
+                if cached is not None:
+                    self.local.set(key, cached)
+                    usage_tracker.record_hit(text_hash, src, dest)
+                    return cached
+
+            cached = await self.model.objects.filter(
+                source_hash=text_hash,
+                source_language=src,
+                target_language=dest
+            ).afirst()
+            if cached:
+                self._db_stats['hits'] += 1
+                self.local.set(key, cached.translated_text)
+                if self.use_shared:
+                    await self.shared.aset(key, cached.translated_text)
+                usage_tracker.record_hit(text_hash, src, dest)
+                return cached.translated_text
+            self._db_stats['misses'] += 1
+            usage_tracker.record_miss()
+        except Exception as e:
+            logger.warning(f"⚠️ Cache read error: {e}")
+        return None
+
+    async def asave(self, text, translated_text, src, dest):
+        text_hash = self.model.make_hash(text)
+        key = self.make_key(text_hash, src, dest)
+        self.local.set(key, translated_text)
+        if self.use_shared:
+            await self.shared.aset(key, translated_text)
+        try:
+            await self.model.objects.acreate(
+                source_hash=text_hash,
+                source_language=src,
+                target_language=dest,
+                source_text=text,
+                translated_text=translated_text
+            )
+        except IntegrityError:
+            pass
+        except Exception as e:
+            logger.error(f"❌ Cache write error: {e}")
+
+
 # ==============================================================================
 # 2. Azure Client (مسؤول عن الاتصال الخارجي فقط)
 # ==============================================================================
+_http_client = None
+_http_client_lock = threading.Lock()
+# كل حلقة أحداث لها عميلها الخاص (اتصالات httpx مرتبطة بالحلقة)
+# One async client per event loop (httpx connections are bound to their loop)
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+def _http_client_options():
+    http2 = getattr(settings, 'TRANSLATOR_HTTP2', False)
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ TRANSLATOR_HTTP2 is on but 'h2' is not installed, using HTTP/1.1.")
+            http2 = False
+    return {
+        'http2': http2,
+        'timeout': httpx.Timeout(getattr(settings, 'TRANSLATOR_TIMEOUT', 5)),
+        'limits': httpx.Limits(
+            max_connections=getattr(settings, 'TRANSLATOR_MAX_CONNECTIONS', 20),
+            max_keepalive_connections=getattr(settings, 'TRANSLATOR_MAX_KEEPALIVE', 10),
+            keepalive_expiry=30,
+        ),
+    }
+
+
+def get_http_client():
+    """
+    عميل httpx واحد لكل عملية (Celery): اتصالات TLS دائمة بدل مصافحة جديدة لكل ترجمة
+    One httpx.Client per process for the sync (Celery) path, so translations reuse
+    keep-alive connections instead of paying a new handshake per call.
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(**_http_client_options())
+    return _http_client
+
+
+def get_async_http_client():
+    """نفس المجمع لحلقة الأحداث الحالية (ChatConsumer) / Same pool for the running event loop (ChatConsumer)"""
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(**_http_client_options())
+        _async_http_clients[loop] = client
+    return client
+
+
 class AzureClient:
-    def __init__(self):
+    # حدود Azure Translator v3 لكل طلب / Azure Translator v3 per-request limits
+    MAX_BATCH_SIZE = 100
+    MAX_BATCH_CHARS = 50000
+
+    def __init__(self, http=None):
         self.api_key = getattr(settings, 'AZURE_TRANSLATOR_KEY', None)
         self.endpoint = getattr(settings, 'AZURE_TRANSLATOR_ENDPOINT', '')
         self.region = getattr(settings, 'AZURE_TRANSLATOR_REGION', 'global')
+        self.limiter = get_translator_limiter()
+        # المسار المتزامن فقط؛ المسار غير المتزامن يأخذ عميل حلقته / Sync path only; the async path uses its loop's client
+        self.http = http or get_http_client()
+        self.timeout = getattr(settings, 'TRANSLATOR_TIMEOUT', 5)
         
         if self.endpoint and not self.endpoint.endswith('/translate'):
             self.endpoint = f"{self.endpoint.rstrip('/')}/translate"
 
     def fetch_translation(self, text, src, dest):
+        results = self.fetch_translations([text], src, dest)
+        return results[0] if results else None
+
+    def fetch_translations(self, texts, src, dest):
+        """
+        ترجمة عدة نصوص في طلب واحد (Azure يقبل حتى 100 نص لكل طلب)
+        Translate several texts per HTTP call (Azure v3 accepts up to 100 per request).
+        Returns a list aligned with `texts` (None where Azure returned nothing).
+        """
         if not self.api_key or not self.endpoint:
             raise ValueError("Azure Credentials Missing")
 
-        params = {
-            'api-version': '3.0',
-            'from': src,
-            'to': dest
+        results = []
+        for chunk in self._chunk(texts):
+            results.extend(self._post_batch(chunk, src, dest))
+        return results
+
+    async def afetch_translations(self, texts, src, dest):
+        """نفس fetch_translations على حلقة الأحداث / fetch_translations awaited on the event loop"""
+        if not self.api_key or not self.endpoint:
+            raise ValueError("Azure Credentials Missing")
+
+        results = []
+        for chunk in self._chunk(texts):
+            results.extend(await self._apost_batch(chunk, src, dest))
+        return results
+
+    def _chunk(self, texts):
+        chunk, chars = [], 0
+        for text in texts:
+            if chunk and (len(chunk) >= self.MAX_BATCH_SIZE or chars + len(text) > self.MAX_BATCH_CHARS):
+                yield chunk
+                chunk, chars = [], 0
+            chunk.append(text)
+            chars += len(text)
+        if chunk:
+            yield chunk
+
+    def _request(self, texts, src, dest):
+        return {
+            'params': {
+                'api-version': '3.0',
+                'from': src,
+                'to': dest
+            },
+            'headers': {
+                'Ocp-Apim-Subscription-Key': self.api_key,
+                'Ocp-Apim-Subscription-Region': self.region,
+                'Content-type': 'application/json',
+                'X-ClientTraceId': str(uuid.uuid4())
+            },
+            'json': [{'text': text} for text in texts],
         }
-        headers = {
-            'Ocp-Apim-Subscription-Key': self.api_key,
-            'Ocp-Apim-Subscription-Region': self.region,
-            'Content-type': 'application/json',
-            'X-ClientTraceId': str(uuid.uuid4())
+
+    @staticmethod
+    def _cost(texts):
+        return {
+            'azure_translator_chars': sum(len(text) for text in texts),
+            'azure_translator_requests': 1,
         }
-        body = [{'text': text}]
 
-        response = requests.post(self.endpoint, params=params, headers=headers, json=body, timeout=5)
-        
+    @staticmethod
+    def _parse(response, count):
         if response.status_code == 200:
-            data = response.json()
-            if data and len(data) > 0:
-                return data[0]['translations'][0]['text']
-            return None
-        
+            data = response.json() or []
+            results = []
+            for i in range(count):
+                try:
+                    results.append(data[i]['translations'][0]['text'])
+                except (IndexError, KeyError, TypeError):
+                    results.append(None)
+            return results
+
         # نرفع الخطأ لكي تتعامل معه سياسة إعادة المحاولة
         response.raise_for_status()
+        return [None] * count
+
+    def _post_batch(self, texts, src, dest):
+        # نحجز من الحصة المشتركة قبل الإرسال (يرفع TranslatorThrottled إذا امتلأت)
+        # Reserve from the shared quotas first (raises TranslatorThrottled when exhausted)
+        self.limiter.acquire(**self._cost(texts))
+
+        response = self.http.post(self.endpoint, timeout=self.timeout, **self._request(texts, src, dest))
+        if response.status_code == 429:
+            # نبلغ كل العمال بالتوقف حتى Retry-After / Make every worker back off until Retry-After
+            self.limiter.penalise(retry_after_seconds(response, 2))
+        return self._parse(response, len(texts))
+
+    async def _apost_batch(self, texts, src, dest):
+        await self.limiter.aacquire(**self._cost(texts))
+
+        client = get_async_http_client()
+        response = await client.post(self.endpoint, timeout=self.timeout, **self._request(texts, src, dest))
+        if response.status_code == 429:
+            await self.limiter.apenalise(retry_after_seconds(response, 2))
+        return self._parse(response, len(texts))
 
 
 # ==============================================================================
@@ -100,47 +364,203 @@ class RetryPolicy:
         self.max_retries = max_retries
         self.delay_factor = delay_factor
 
+    def _status_error(self, e, attempt):
+        # إذا كان الخطأ 429 لا ننام داخل العامل: نرفع TranslatorThrottled لتعيد المهمة جدولة نفسها
+        # On 429 don't sleep in the worker: raise TranslatorThrottled so the task reschedules itself
+        if e.response.status_code == 429:
+            retry_after = retry_after_seconds(e.response, (attempt + 1) * self.delay_factor)
+            logger.warning(f"⏳ Rate limited (429). Deferring for {retry_after}s...")
+            return TranslatorThrottled(retry_after, quota='azure_429')
+        # أخطاء أخرى (400, 500) لا نعيد المحاولة
+        logger.error(f"❌ HTTP Error: {e}")
+        return e
+
     def execute(self, func, *args, **kwargs):
         """
         ينفذ أي دالة ويمرر لها معاملاتها، ويعيد المحاولة عند الفشل
+        Network errors are retried straight away on a fresh pooled connection (no sleep);
+        the Celery retry and the circuit breaker provide the backoff.
         """
         last_exception = None
-        
+
         for attempt in range(self.max_retries):
             try:
                 return func(*args, **kwargs)
-            
-            except requests.exceptions.HTTPError as e:
-                # إذا كان الخطأ 429 (Too Many Requests) نعيد المحاولة
-                if e.response.status_code == 429:
-                    wait_time = (attempt + 1) * self.delay_factor
-                    logger.warning(f"⏳ Rate limited (429). Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                    last_exception = e
-                    continue
-                # أخطاء أخرى (400, 500) لا نعيد المحاولة
-                logger.error(f"❌ HTTP Error: {e}")
-                raise e
-
-            except requests.exceptions.RequestException as e:
-                # مشاكل في الشبكة
+            except httpx.HTTPStatusError as e:
+                raise self._status_error(e, attempt) from e
+            except httpx.TransportError as e:
+                # مشاكل في الشبكة (غالباً اتصال قديم أغلقه الخادم)
                 logger.warning(f"⚠️ Network error (Attempt {attempt+1}): {e}")
-                time.sleep(1)
                 last_exception = e
-        
+
         # إذا استنفدنا المحاولات
         if last_exception:
             raise last_exception
 
+    async def aexecute(self, func, *args, **kwargs):
+        """نسخة execute لدوال async / execute() for coroutine functions"""
+        last_exception = None
+
+        for attempt in range(self.max_retries):
+            try:
+                return await func(*args, **kwargs)
+            except httpx.HTTPStatusError as e:
+                raise self._status_error(e, attempt) from e
+            except httpx.TransportError as e:
+                logger.warning(f"⚠️ Network error (Attempt {attempt+1}): {e}")
+                last_exception = e
+
+        if last_exception:
+            raise last_exception
+
+
+def is_translator_outage(error):
+    """
+    فقط أخطاء الشبكة و5xx تفتح الدائرة، وليس 429 أو 4xx
+    Only network errors and 5xx open the circuit, not throttling or 4xx.
+    """
+    if isinstance(error, TranslatorThrottled):
+        return False
+    response = getattr(error, 'response', None)
+    if response is not None and 400 <= response.status_code < 500:
+        return False
+    return True
+
+
+# ==============================================================================
+# 4. Translation Batcher (تجميع الطلبات المتزامنة في طلب واحد)
+# ==============================================================================
+class TranslationBatcher:
+    """
+    يجمع طلبات الترجمة المتزامنة من عدة مهام Celery لنفس زوج اللغات
+    خلال نافذة زمنية قصيرة، ثم يرسلها لـ Azure في طلب واحد.
+    Micro-batcher shared by all Celery workers through Redis: requests for the
+    same (source, target) pair are queued for a few milliseconds, one worker
+    becomes the leader, sends them as a single Azure call and fans the results
+    back out to each waiting task through per-request result keys.
+    """
+    KEY_PREFIX = 'tr_batch'
+
+    def __init__(self, client, retry_policy, window_ms=None, wait_timeout=None):
+        self.client = client
+        self.retry_policy = retry_policy
+        self.window = (window_ms if window_ms is not None else getattr(settings, 'TRANSLATION_BATCH_WINDOW_MS', 25)) / 1000
+        self.wait_timeout = wait_timeout if wait_timeout is not None else getattr(settings, 'TRANSLATION_BATCH_WAIT_TIMEOUT', 15)
+
+    def _direct(self, text, src, dest):
+        return self.retry_policy.execute(self.client.fetch_translation, text, src, dest)
+
+    def translate(self, text, src, dest):
+        try:
+            from django_redis import get_redis_connection
+            redis = get_redis_connection('default')
+        except Exception as e:
+            # بدون Redis نعود للطلب المباشر / Without Redis fall back to a direct call
+            logger.warning(f"⚠️ Batcher unavailable, calling Azure directly: {e}")
+            return self._direct(text, src, dest)
+
+        request_id = uuid.uuid4().hex
+        queue_key = f"{self.KEY_PREFIX}:{src}:{dest}"
+        leader_key = f"{queue_key}:leader"
+        result_key = f"{self.KEY_PREFIX}:result:{request_id}"
+
+        try:
+            redis.rpush(queue_key, json.dumps({'id': request_id, 'text': text}))
+            redis.expire(queue_key, 60)
+
+            deadline = time.monotonic() + self.wait_timeout
+            first_round = True
+            while time.monotonic() < deadline:
+                # أول من يحصل على القفل يصبح القائد ويرسل الدفعة
+                # First task to grab the lock becomes the leader and flushes the batch
+                lock_ms = int((self.wait_timeout + self.window) * 1000)
+                if redis.set(leader_key, request_id, nx=True, px=lock_ms):
+                    try:
+                        if first_round:
+                            time.sleep(self.window)
+                        self._flush(redis, queue_key, src, dest)
+                    finally:
+                        if redis.get(leader_key) == request_id.encode():
+                            redis.delete(leader_key)
+                first_round = False
+
+                popped = redis.blpop(result_key, timeout=1)
+                if popped:
+                    payload = json.loads(popped[1])
+                    if payload.get('throttled'):
+                        raise TranslatorThrottled(payload['throttled'])
+                    if payload.get('error'):
+                        raise RuntimeError(payload['error'])
+                    return payload.get('text')
+        except (RuntimeError, TranslatorThrottled):
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Batcher error, calling Azure directly: {e}")
+            return self._direct(text, src, dest)
+
+        logger.warning("⏳ Batched translation timed out, calling Azure directly.")
+        return self._direct(text, src, dest)
+
+    def _flush(self, redis, queue_key, src, dest):
+        while True:
+            pipe = redis.pipeline()
+            pipe.lrange(queue_key, 0, AzureClient.MAX_BATCH_SIZE - 1)
+            pipe.ltrim(queue_key, AzureClient.MAX_BATCH_SIZE, -1)
+            raw_items, _ = pipe.execute()
+            if not raw_items:
+                return
+
+            items = [json.loads(raw) for raw in raw_items]
+            try:
+                results = self.retry_policy.execute(
+                    self.client.fetch_translations,
+                    [item['text'] for item in items], src, dest
+                )
+                payloads = [{'text': text} for text in results]
+                logger.info(f"📦 Batched {len(items)} translations ({src}->{dest}) in one call")
+            except TranslatorThrottled as e:
+                payloads = [{'throttled': e.retry_after}] * len(items)
+            except Exception as e:
+                payloads = [{'error': str(e)}] * len(items)
+
+            pipe = redis.pipeline()
+            for item, payload in zip(items, payloads):
+                result_key = f"{self.KEY_PREFIX}:result:{item['id']}"
+                pipe.rpush(result_key, json.dumps(payload))
+                pipe.expire(result_key, 60)
+            pipe.execute()
+
 
 # ==============================================================================
-# 4. Azure Translator Service (المنسق / الواجهة الرئيسية)
+# 5. Azure Translator Service (المنسق / الواجهة الرئيسية)
 # ==============================================================================
 class AzureTranslator:
     def __init__(self):
         self.cache = CacheRepository()
-        self.client = AzureClient()
+        # Azure أو البديل المحلي حسب AI_BACKENDS / Azure or the local stub, per AI_BACKENDS
+        self.client = get_backend('translation')
         self.retry_policy = RetryPolicy()
+        self.batcher = TranslationBatcher(self.client, self.retry_policy)
+        self.use_batching = getattr(settings, 'TRANSLATION_BATCHING_ENABLED', True)
+        self.single_flight = SingleFlight(
+            'translate',
+            lock_ttl=15,
+            wait_timeout=getattr(settings, 'SINGLE_FLIGHT_WAIT_TIMEOUT', 10),
+        )
+        self.breaker = CircuitBreaker(TRANSLATOR, is_outage=is_translator_outage)
+
+    def _fetch(self, text, source_lang, target_lang):
+        # إذا كانت Azure معطلة نفشل فوراً (CircuitOpen) بدلاً من انتظار المهلة
+        # If Azure is down, fail fast (CircuitOpen) instead of waiting out the timeout
+        return self.breaker.call(self._fetch_from_azure, text, source_lang, target_lang)
+
+    def _fetch_from_azure(self, text, source_lang, target_lang):
+        if self.use_batching:
+            return self.batcher.translate(text, source_lang, target_lang)
+        return self.retry_policy.execute(
+            self.client.fetch_translation, 
+            text, source_lang, target_lang
+        )
 
     def translate(self, text, source_lang, target_lang):
         # 1. فحوصات سريعة
@@ -152,11 +572,13 @@ class AzureTranslator:
         if cached_result:
             return cached_result
 
-        # 3. الاتصال بـ Azure (عبر سياسة إعادة المحاولة)
+        # 3. الاتصال بـ Azure: طلب واحد فقط لكل نص متطابق قيد التنفيذ
+        # 3. Call Azure: only one in-flight request per identical text
         try:
-            translated_text = self.retry_policy.execute(
-                self.client.fetch_translation, 
-                text, source_lang, target_lang
+            flight_key = f"{source_lang}:{target_lang}:{self.cache.model.make_hash(text)}"
+            translated_text = self.single_flight.run(
+                flight_key,
+                lambda: self._fetch(text, source_lang, target_lang)
             )
             
             if translated_text:
@@ -164,6 +586,12 @@ class AzureTranslator:
                 self.cache.save(text, translated_text, source_lang, target_lang)
                 return translated_text
 
+        except TranslatorThrottled:
+            # المهمة تعيد جدولة نفسها (retry countdown) / The calling task reschedules itself
+            raise
+        except CircuitOpen as e:
+            logger.warning(f"🔌 {e}, returning original text.")
+            return text
         except Exception as e:
             # الفشل الآمن (Graceful Degradation)
             import traceback
@@ -175,4 +603,83 @@ class AzureTranslator:
             
             return text
 
-        return text
\ No newline at end of file
+        return text
+
+    def translate_many(self, texts, source_lang, target_lang):
+        """
+        ترجمة قائمة نصوص: الكاش أولاً ثم طلب واحد لـ Azure لكل ما تبقى
+        Translate a list of texts: cache first, then one batched Azure call for the misses.
+        """
+        results = list(texts)
+        if source_lang == target_lang:
+            return results
+
+        missing = []
+        for i, text in enumerate(texts):
+            if not text:
+                results[i] = ""
+                continue
+            cached_result = self.cache.get(text, source_lang, target_lang)
+            if cached_result:
+                results[i] = cached_result
+            else:
+                missing.append(i)
+
+        if not missing:
+            return results
+
+        try:
+            translated = self.breaker.call(
+                self.retry_policy.execute,
+                self.client.fetch_translations,
+                [texts[i] for i in missing], source_lang, target_lang
+            )
+            for i, translated_text in zip(missing, translated):
+                if translated_text:
+                    self.cache.save(texts[i], translated_text, source_lang, target_lang)
+                    results[i] = translated_text
+        except TranslatorThrottled:
+            raise
+        except Exception as e:
+            logger.error(f"💀 Batch translation failed: {e}")
+
+        return results
+
+
+# ==============================================================================
+# 6. Async Translator (المسار المباشر من ChatConsumer بدون قفزات خيوط)
+# ==============================================================================
+class AsyncAzureTranslator:
+    """
+    نسخة غير متزامنة من AzureTranslator يستدعيها ChatConsumer مباشرة
+    Async twin of AzureTranslator that ChatConsumer awaits directly: the cache tiers,
+    the shared quotas and the breaker state are awaited on the event loop and Azure is
+    called on the per-loop httpx pool, so there is no sync_to_async thread hop.
+    AzureTranslator stays the sync facade for Celery on the per-process pool.
+    """
+    def __init__(self):
+        self.cache = CacheRepository()
+        self.client = get_backend('translation')
+        self.retry_policy = RetryPolicy()
+        self.breaker = CircuitBreaker(TRANSLATOR, is_outage=is_translator_outage)
+
+    async def atranslate(self, text, source_lang, target_lang):
+        """
+        يرفع الأخطاء بدلاً من إعادة النص الأصلي: المستدعي يترك الرسالة لـ Celery
+        Raises instead of degrading to the original text, so the caller can leave the message to Celery.
+        """
+        if not text: return ""
+        if source_lang == target_lang: return text
+
+        cached_result = await self.cache.aget(text, source_lang, target_lang)
+        if cached_result:
+            return cached_result
+
+        if not await self.breaker.aallow():
+            raise CircuitOpen(self.breaker.name)
+
+        results = await self.retry_policy.aexecute(self.client.afetch_translations, [text], source_lang, target_lang)
+        translated_text = results[0] if results else None
+        if translated_text:
+            await self.cache.asave(text, translated_text, source_lang, target_lang)
+        return translated_text
@@ -0,0 +1,91 @@
+# apps/core/single_flight.py
+import json
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    طلب واحد فقط لكل مفتاح يصل إلى الخدمة الخارجية، والباقي ينتظرون نتيجته
+    Only one caller per key reaches the external API; concurrent callers with
+    the same key (in any worker) wait on a Redis result key for a bounded time.
+    If the leader fails, the next waiter takes the lock and tries itself.
+    Shared results hold patient text, so they are published as Fernet ciphertext
+    (same keys as EncryptedTextField); a result that cannot be decrypted counts as absent.
+    """
+    def __init__(self, namespace, lock_ttl=30, wait_timeout=10, result_ttl=30, poll_interval=0.05):
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+    def _redis(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def _seal(self, result):
+        from apps.chat.crypto import build_fernet, current_keys
+        return build_fernet(current_keys()).encrypt(json.dumps(result).encode('utf-8'))
+
+    def _open(self, cached):
+        from cryptography.fernet import InvalidToken
+        from apps.chat.crypto import build_fernet, current_keys
+        try:
+            return json.loads(build_fernet(current_keys()).decrypt(cached))
+        except (InvalidToken, TypeError, ValueError):
+            return None
+
+    def run(self, key, func):
+        try:
+            redis = self._redis()
+        except Exception as e:
+            logger.warning(f"⚠️ Single-flight unavailable ({self.namespace}): {e}")
+            return func()
+
+        lock_key = f"sf:{self.namespace}:{key}:lock"
+        result_key = f"sf:{self.namespace}:{key}:result"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+
+        try:
+            while time.monotonic() < deadline:
+                cached = redis.get(result_key)
+                shared = self._open(cached) if cached is not None else None
+                if shared is not None:
+                    logger.info(f"🔁 Single-flight shared result ({self.namespace})")
+                    return shared
+
+                if redis.set(lock_key, token, nx=True, ex=self.lock_ttl):
+                    break
+                time.sleep(self.poll_interval)
+            else:
+                # انتهت مهلة الانتظار: ننفذ بأنفسنا / Waited long enough, call directly
+                logger.warning(f"⏳ Single-flight wait timed out ({self.namespace}), calling directly.")
+                return func()
+        except Exception as e:
+            logger.warning(f"⚠️ Single-flight error ({self.namespace}): {e}")
+            return func()
+
+        # نحن القائد / We are the leader
+        try:
+            cached = redis.get(result_key)
+            shared = self._open(cached) if cached is not None else None
+            if shared is not None:
+                return shared
+            result = func()
+            if result is not None:
+                try:
+                    redis.set(result_key, self._seal(result), ex=self.result_ttl)
+                except Exception as e:
+                    logger.warning(f"⚠️ Single-flight publish failed ({self.namespace}): {e}")
+            return result
+        finally:
+            try:
+                if redis.get(lock_key) == token.encode():
+                    redis.delete(lock_key)
+            except Exception:
+                pass
@@ -1,3 +1,427 @@
-from django.test import TestCase
+import httpx
+from types import SimpleNamespace
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch, MagicMock, AsyncMock, PropertyMock  # أداة المحاكاة (Mocking) / Mocking tool
 
-# Create your tests here.
+from .services import AzureClient, RetryPolicy, AsyncAzureTranslator
+from .rate_limit import TranslatorThrottled, RequestThrottle
+from .cache_layers import LocalLRUCache, RedisCacheLayer
+from .single_flight import SingleFlight
+from .circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN
+from .backends import StubTranslationClient, StubFaults, get_backend
+
+
+@override_settings(AZURE_TRANSLATOR_KEY='test-key', AZURE_TRANSLATOR_ENDPOINT='https://example.test')
+@patch('apps.core.rate_limit.DistributedRateLimiter.acquire')
+class AzureClientBatchTest(SimpleTestCase):
+    def _fake_response(self, texts):
+        response = MagicMock(status_code=200)
+        response.json.return_value = [{'translations': [{'text': t.upper()}]} for t in texts]
+        return response
+
+    @patch('apps.core.services.get_http_client')
+    def test_fetch_translations_chunks_per_azure_limit(self, mock_session, mock_acquire):
+        """
+        250 نصاً يجب أن تُرسل في 3 طلبات فقط، مع الحفاظ على الترتيب
+        250 texts must go out in 3 requests only, keeping the order
+        """
+        mock_post = mock_session.return_value.post
+        mock_post.side_effect = lambda url, params, headers, json, timeout: self._fake_response(
+            [item['text'] for item in json]
+        )
+        texts = [f"hei {i}" for i in range(250)]
+
+        results = AzureClient().fetch_translations(texts, 'no', 'en')
+
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(results, [t.upper() for t in texts])
+
+    @patch('apps.core.services.get_http_client')
+    def test_fetch_translation_uses_batch_path(self, mock_session, mock_acquire):
+        mock_post = mock_session.return_value.post
+        mock_post.return_value = self._fake_response(["hei"])
+
+        self.assertEqual(AzureClient().fetch_translation("hei", 'no', 'en'), "HEI")
+        self.assertEqual(mock_post.call_args.kwargs['json'], [{'text': 'hei'}])
+
+
+    def test_clients_share_one_pooled_session(self, mock_acquire):
+        """
+        كل العملاء في العملية يستخدمون نفس المجمع (اتصالات دائمة)
+        Every client in the process reuses the same keep-alive pool
+        """
+        self.assertIs(AzureClient().http, AzureClient().http)
+        self.assertIsInstance(AzureClient().http, httpx.Client)
+
+    @patch('apps.core.rate_limit.DistributedRateLimiter.aacquire', new_callable=AsyncMock)
+    @patch('apps.core.services.get_async_http_client')
+    def test_afetch_translations_uses_the_loop_pool(self, mock_client, mock_aacquire, mock_acquire):
+        mock_client.return_value.post = AsyncMock(return_value=self._fake_response(["hei"]))
+
+        self.assertEqual(async_to_sync(AzureClient().afetch_translations)(["hei"], 'no', 'en'), ["HEI"])
+        mock_aacquire.assert_awaited_once_with(azure_translator_chars=3, azure_translator_requests=1)
+        mock_acquire.assert_not_called()
+
+
+class RetryPolicyThrottleTest(SimpleTestCase):
+    def test_429_defers_with_retry_after_instead_of_sleeping(self):
+        """
+        429 يجب ألا ينام داخل العامل، بل يرفع TranslatorThrottled بقيمة Retry-After
+        A 429 must not sleep in the worker; it raises TranslatorThrottled with Retry-After
+        """
+        response = MagicMock(status_code=429, headers={'Retry-After': '7'})
+        error = httpx.HTTPStatusError("429", request=MagicMock(), response=response)
+        func = MagicMock(side_effect=error)
+
+        with patch('apps.core.services.time.sleep') as mock_sleep:
+            with self.assertRaises(TranslatorThrottled) as ctx:
+                RetryPolicy().execute(func)
+
+        self.assertEqual(ctx.exception.retry_after, 7)
+        self.assertEqual(func.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_network_errors_retry_without_sleeping(self):
+        """
+        خطأ الشبكة يُعاد فوراً على اتصال جديد بدون حجز الخيط
+        A network error is retried straight away on a fresh connection, without blocking the thread
+        """
+        func = MagicMock(side_effect=[httpx.ConnectError("reset"), "ok"])
+
+        with patch('apps.core.services.time.sleep') as mock_sleep:
+            self.assertEqual(RetryPolicy().execute(func), "ok")
+
+        self.assertEqual(func.call_count, 2)
+        mock_sleep.assert_not_called()
+
+    def test_async_retries_give_up_after_max_retries(self):
+        func = AsyncMock(side_effect=httpx.ReadTimeout("slow"))
+
+        with self.assertRaises(httpx.ReadTimeout):
+            async_to_sync(RetryPolicy(max_retries=2).aexecute)(func)
+        self.assertEqual(func.await_count, 2)
+
+
+@override_settings(AI_BACKENDS={'translation': 'stub'}, AI_STUB_OPTIONS={'latency_distribution': 'fixed', 'latency_ms': 0})
+@patch('apps.core.services.CacheRepository.asave', new_callable=AsyncMock)
+@patch('apps.core.services.CacheRepository.aget', new_callable=AsyncMock, return_value=None)
+class AsyncAzureTranslatorTest(SimpleTestCase):
+    def translate(self, text="hei"):
+        return async_to_sync(AsyncAzureTranslator().atranslate)(text, 'no', 'ar')
+
+    @patch('apps.core.circuit_breaker.CircuitBreaker.aallow', new_callable=AsyncMock, return_value=True)
+    def test_miss_is_fetched_and_cached(self, mock_allow, mock_aget, mock_asave):
+        self.assertEqual(self.translate(), "[ar] hei")
+        mock_asave.assert_awaited_once_with("hei", "[ar] hei", 'no', 'ar')
+
+    @patch('apps.core.backends.StubTranslationClient.afetch_translations', new_callable=AsyncMock)
+    def test_cache_hit_skips_azure(self, mock_fetch, mock_aget, mock_asave):
+        mock_aget.return_value = "مرحبا"
+
+        self.assertEqual(self.translate(), "مرحبا")
+        mock_fetch.assert_not_awaited()
+        mock_asave.assert_not_awaited()
+
+    @patch('apps.core.circuit_breaker.CircuitBreaker.aallow', new_callable=AsyncMock, return_value=False)
+    @patch('apps.core.backends.StubTranslationClient.afetch_translations', new_callable=AsyncMock)
+    def test_open_circuit_fails_fast(self, mock_fetch, mock_allow, mock_aget, mock_asave):
+        """
+        الدائرة المفتوحة ترفع CircuitOpen بدل إعادة النص الأصلي (المستدعي يترك الرسالة لـ Celery)
+        An open circuit raises CircuitOpen instead of returning the original text (the caller defers to Celery)
+        """
+        with self.assertRaises(CircuitOpen):
+            self.translate()
+        mock_fetch.assert_not_awaited()
+
+
+@override_settings(AI_BACKENDS={'translation': 'stub'})
+class StubBackendTest(SimpleTestCase):
+    def test_registry_returns_stub_from_settings(self):
+        self.assertIsInstance(get_backend('translation'), StubTranslationClient)
+
+    @override_settings(AI_STUB_OPTIONS={'latency_distribution': 'fixed', 'latency_ms': 0, 'throttle_rate': 1.0, 'retry_after': 3})
+    def test_stub_injects_429_with_retry_after(self):
+        StubFaults.reseed(1)
+        with self.assertRaises(httpx.HTTPStatusError) as ctx:
+            StubTranslationClient().fetch_translations(["hei"], 'no', 'ar')
+        self.assertEqual(ctx.exception.response.status_code, 429)
+        self.assertEqual(ctx.exception.response.headers['Retry-After'], '3')
+
+    @override_settings(AI_STUB_OPTIONS={'latency_distribution': 'fixed', 'latency_ms': 0})
+    def test_stub_is_deterministic(self):
+        StubFaults.reseed(1)
+        self.assertEqual(StubTranslationClient().fetch_translations(["hei", "takk"], 'no', 'ar'), ["[ar] hei", "[ar] takk"])
+
+
+class LocalLRUCacheTest(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        lru = LocalLRUCache(max_size=2, ttl=60)
+        lru.set('a', 'hei')
+        lru.set('b', 'takk')
+        lru.get('a')            # 'a' أصبح الأحدث / 'a' is now most recent
+        lru.set('c', 'hallo')   # يطرد 'b' / evicts 'b'
+
+        self.assertEqual(lru.get('a'), 'hei')
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.stats()['evictions'], 1)
+        self.assertEqual(lru.stats()['hits'], 2)
+        self.assertEqual(lru.stats()['misses'], 1)
+
+    def test_expired_entries_are_misses(self):
+        lru = LocalLRUCache(max_size=10, ttl=-1)
+        lru.set('a', 'hei')
+        self.assertIsNone(lru.get('a'))
+
+
+class FakeCacheBackend:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+
+class EncryptedL2CacheTest(SimpleTestCase):
+    def test_values_are_stored_as_ciphertext(self):
+        """
+        الترجمة لا تُخزن كنص واضح في Redis / Translations never reach Redis as plaintext
+        """
+        store = FakeCacheBackend()
+        layer = RedisCacheLayer(encrypt=True)
+        with patch.object(RedisCacheLayer, 'backend', new_callable=PropertyMock, return_value=store):
+            layer.set('tr:ar:no:abc', 'Jeg har vondt i magen')
+
+            self.assertNotIn('vondt', store.data['tr:ar:no:abc'])
+            self.assertEqual(layer.get('tr:ar:no:abc'), 'Jeg har vondt i magen')
+
+    def test_legacy_plaintext_entries_are_misses(self):
+        store = FakeCacheBackend()
+        store.data['tr:ar:no:abc'] = 'plain text from an older release'
+        layer = RedisCacheLayer(encrypt=True)
+        with patch.object(RedisCacheLayer, 'backend', new_callable=PropertyMock, return_value=store):
+            self.assertIsNone(layer.get('tr:ar:no:abc'))
+            self.assertEqual(layer.stats()['misses'], 1)
+
+
+
+class FakeRedis:
+    """نسخة مصغرة من أوامر Redis المستخدمة في SingleFlight / Minimal Redis used by SingleFlight"""
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        entry = self.data.setdefault(key, {})
+        for name, item in (mapping or {field: value}).items():
+            entry[name] = str(item).encode()
+
+    def hmget(self, key, *fields):
+        entry = self.data.get(key, {})
+        return [entry.get(name) for name in fields]
+
+    def hincrby(self, key, field, amount=1):
+        entry = self.data.setdefault(key, {})
+        entry[field] = str(int(entry.get(field, 0)) + amount).encode()
+        return int(entry[field])
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.flight = SingleFlight('test', wait_timeout=0.2, poll_interval=0.01)
+        patcher = patch.object(SingleFlight, '_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_leader_publishes_encrypted_result_and_releases_lock(self):
+        """
+        القائد ينشر النتيجة مشفرة ويحرر القفل / The leader publishes ciphertext and releases the lock
+        """
+        func = MagicMock(return_value={'text': 'Jeg har vondt i magen'})
+
+        self.assertEqual(self.flight.run('k', func), {'text': 'Jeg har vondt i magen'})
+        func.assert_called_once()
+        self.assertNotIn('sf:test:k:lock', self.redis.data)
+        self.assertNotIn(b'vondt', self.redis.data['sf:test:k:result'])
+
+    def test_follower_reuses_shared_result(self):
+        self.redis.data['sf:test:k:lock'] = b'other-worker'
+        self.redis.data['sf:test:k:result'] = self.flight._seal('hei')
+        func = MagicMock(return_value='should not run')
+
+        self.assertEqual(self.flight.run('k', func), 'hei')
+        func.assert_not_called()
+
+    def test_plaintext_result_is_ignored(self):
+        """
+        نتيجة قديمة بنص واضح لا تُقرأ / A plaintext result from an older release is not trusted
+        """
+        self.redis.data['sf:test:k:result'] = b'"plain"'
+        self.assertEqual(self.flight.run('k', lambda: 'fresh'), 'fresh')
+
+    def test_wait_timeout_calls_directly(self):
+        """
+        القفل عند عامل آخر ولم تصل نتيجة: ننفذ بأنفسنا / Lock held elsewhere and no result: call directly
+        """
+        self.redis.data['sf:test:k:lock'] = b'other-worker'
+        func = MagicMock(return_value='direct')
+
+        self.assertEqual(self.flight.run('k', func), 'direct')
+        func.assert_called_once()
+        self.assertEqual(self.redis.data['sf:test:k:lock'], b'other-worker')
+
+    def test_redis_unavailable_calls_directly(self):
+        with patch.object(SingleFlight, '_redis', side_effect=ConnectionError('down')):
+            self.assertEqual(self.flight.run('k', lambda: 'direct'), 'direct')
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch.object(CircuitBreaker, '_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def breaker(self):
+        # كائن جديد لكل طلب كما في المهام / A fresh instance per call, as the tasks do
+        return CircuitBreaker('whisper', failure_threshold=2, recovery_timeout=30)
+
+    def state(self):
+        return self.redis.data['cb:whisper']['state'].decode()
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            breaker = self.breaker()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+
+        self.assertEqual(self.state(), OPEN)
+        self.assertFalse(self.breaker().allow())
+
+    def test_success_resets_failure_count(self):
+        breaker = self.breaker()
+        breaker.allow()
+        breaker.record_failure()
+        breaker = self.breaker()
+        breaker.allow()
+        breaker.record_success()
+
+        breaker = self.breaker()
+        breaker.allow()
+        breaker.record_failure()
+        self.assertEqual(self.redis.data['cb:whisper']['failures'], b'1')
+
+    def test_half_open_probe_closes_or_reopens(self):
+        """
+        بعد فترة التعافي: مكالمة تجريبية واحدة تغلق الدائرة أو تعيد فتحها
+        After the cooldown one probe is let through; success closes, failure re-opens
+        """
+        self.redis.hset('cb:whisper', mapping={'state': OPEN, 'failures': 0, 'opened_at': 0})
+
+        probe = self.breaker()
+        self.assertTrue(probe.allow())
+        self.assertEqual(self.state(), HALF_OPEN)
+        self.assertFalse(self.breaker().allow())  # مكالمة تجريبية واحدة فقط / Only one probe
+        probe.record_failure()
+        self.assertEqual(self.state(), OPEN)
+
+        self.redis.hset('cb:whisper', 'opened_at', 0)
+        probe = self.breaker()
+        self.assertTrue(probe.allow())
+        probe.record_success()
+        self.assertEqual(self.state(), CLOSED)
+        self.assertNotIn('cb:whisper:probe', self.redis.data)
+
+    def test_redis_unavailable_allows_calls(self):
+        with patch.object(CircuitBreaker, '_redis', side_effect=ConnectionError('down')):
+            self.assertTrue(self.breaker().allow())
+
+
+@override_settings(RATE_LIMITS={'ws_message': {'REFUGEE': 30, 'STAFF': None, 'default': 10}})
+class RequestThrottleTest(SimpleTestCase):
+    refugee = SimpleNamespace(id=7, is_staff=False, role='REFUGEE')
+    staff = SimpleNamespace(id=8, is_staff=True, role='NURSE')
+
+    def setUp(self):
+        self.throttle = RequestThrottle('ws_message')
+        # السكربت يُسجل مرة لكل عملية: نبدأ كل اختبار بدونه / The script is cached per process: start clean
+        patcher = patch.dict(RequestThrottle._scripts, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def redis_with(self, result, script_class=MagicMock):
+        redis = MagicMock()
+        redis.register_script.return_value = script_class(return_value=result)
+        return redis
+
+    def test_quota_depends_on_role(self):
+        self.assertEqual(self.throttle.quota_for(self.refugee).capacity, 30)
+        self.assertEqual(self.throttle.quota_for(SimpleNamespace(id=9, is_staff=False, role=None)).capacity, 10)
+        self.assertIsNone(self.throttle.quota_for(self.staff))
+
+    @patch('django_redis.get_redis_connection')
+    def test_check_allows_blocks_and_reports_wait(self, mock_connection):
+        mock_connection.return_value = self.redis_with([0, 0])
+        self.assertEqual(self.throttle.check(self.refugee), 0)
+
+        mock_connection.return_value = self.redis_with([1, '2.5'])
+        RequestThrottle._scripts.clear()
+        self.assertEqual(self.throttle.check(self.refugee), 2.5)
+
+    @patch('django_redis.get_redis_connection')
+    def test_unlimited_role_never_reaches_redis(self, mock_connection):
+        self.assertEqual(self.throttle.check(self.staff, cost=1000), 0)
+        mock_connection.assert_not_called()
+
+    @patch('django_redis.get_redis_connection')
+    def test_cost_is_clamped_to_bucket_capacity(self, mock_connection):
+        """
+        دفعة أكبر من الدلو تُحسب كدلو كامل وإلا لن تمر أبداً
+        A batch larger than the bucket is charged as a full bucket, otherwise it could never pass
+        """
+        redis = mock_connection.return_value = self.redis_with([0, 0])
+
+        self.throttle.check(self.refugee, cost=500)
+        self.throttle.check(self.refugee, cost=3)
+
+        costs = [call.kwargs['args'][3] for call in redis.register_script.return_value.call_args_list]
+        self.assertEqual(costs, [30, 3])
+        self.assertEqual(redis.register_script.return_value.call_args.kwargs['keys'], ['ratelimit:ws_message:7'])
+
+    @patch('django_redis.get_redis_connection', side_effect=ConnectionError('down'))
+    def test_check_fails_open(self, mock_connection):
+        self.assertEqual(self.throttle.check(self.refugee), 0)
+
+    @patch('apps.core.async_redis.get_async_redis')
+    def test_acheck_uses_async_client_and_clamps_cost(self, mock_redis):
+        redis = mock_redis.return_value = self.redis_with([1, 4.0], script_class=AsyncMock)
+
+        self.assertEqual(async_to_sync(self.throttle.acheck)(self.refugee, cost=100), 4.0)
+        script = redis.register_script.return_value
+        self.assertEqual(script.await_args.kwargs['args'][3], 30)
+        self.assertIs(script.await_args.kwargs['client'], redis)
+
+    @patch('apps.core.async_redis.get_async_redis', side_effect=ConnectionError('down'))
+    def test_acheck_fails_open(self, mock_redis):
+        self.assertEqual(async_to_sync(self.throttle.acheck)(self.refugee), 0)
@@ -2,28 +2,32 @@ import base64
 import logging
 import hashlib
 import os
-from openai import AzureOpenAI
 from django.conf import settings
 from django.core.files.base import ContentFile # ضروري لحفظ نسخة الكاش / Necessary to save cache copy
 
+from .single_flight import SingleFlight
+from .backends import get_backend
+from .circuit_breaker import CircuitBreaker, CircuitOpen, VISION, is_openai_outage
+
 logger = logging.getLogger(__name__)
 
 class MedicalImageAnalyzer:
     def __init__(self):
-        self.api_key = getattr(settings, 'AZURE_OPENAI_KEY', None)
-        self.endpoint = getattr(settings, 'AZURE_OPENAI_ENDPOINT', None)
-        
-        if self.api_key and self.endpoint:
-            self.client = AzureOpenAI(
-                api_key=self.api_key,  
-                api_version="2024-12-01-preview", 
-                azure_endpoint=self.endpoint
-            )
-        else:
-            self.client = None
+        # Azure OpenAI أو البديل المحلي حسب AI_BACKENDS (None إذا لم تُضبط المفاتيح)
+        # Azure OpenAI or the local stub, per AI_BACKENDS (None when keys are missing)
+        self.client = get_backend('vision')
             
         self.deployment_name = getattr(settings, 'AZURE_OPENAI_DEPLOYMENT_NAME', 'gpt-4o')
 
+        # نفس الصورة المرسلة عدة مرات = طلب واحد فقط لـ Azure
+        # The same image sent several times = one Azure call only
+        self.single_flight = SingleFlight(
+            'vision',
+            lock_ttl=60,
+            wait_timeout=getattr(settings, 'SINGLE_FLIGHT_VISION_WAIT_TIMEOUT', 40),
+        )
+        self.breaker = CircuitBreaker(VISION, is_outage=is_openai_outage)
+
     def analyze(self, image_field):
         """
         يستقبل كائن الملف (File Object) بدلاً من المسار (Path)
@@ -65,59 +69,73 @@ class MedicalImageAnalyzer:
                 logger.info(f"🚀 Image Analysis Cache HIT: {sha256_hash[:10]}")
                 return cached_entry.analysis_result
 
-            # 4. التجهيز للإرسال (Base64 Encoding)
-            # 4. Prepare for sending (Base64 Encoding)
-            encoded_image = base64.b64encode(image_data).decode('utf-8')
-
-            # 5. إرسال الطلب لـ Azure OpenAI
-            # 5. Send request to Azure OpenAI
-            # تعديل: تخفيف القيود لتجنب (Jailbreak Detection)
-            # Fix: Relax constraints to avoid (Jailbreak Detection)
-            prompt = """
-            Describe the medical symptoms visible in this image.
-            Provide any observation in Norwegian using this format:
-            - **Funn:** [Observations]
-            - **Mulig årsak:** [Possible causes based on visual evidence]
-            - **Anbefaling:** [General suggestion which must end with: Contact a doctor]
-            
-            Disclaimer: This is for informational purposes only.
-            """
-
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[
-                    { "role": "system", "content": "You are a helpful assistant that describes images." },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}},
-                        ],
-                    }
-                ],
-                max_tokens=400,
-                timeout=25
+            # 4. طلب واحد لكل بصمة قيد التنفيذ (الباقون ينتظرون النتيجة)
+            # 4. One in-flight request per hash (others wait for its result)
+            return self.single_flight.run(
+                sha256_hash,
+                lambda: self._analyze_and_cache(image_field, image_data, sha256_hash)
             )
-            
-            result_text = response.choices[0].message.content
-
-            # 6. حفظ النتيجة + نسخة من الصورة في الكاش
-            # 6. Save result + image copy to cache
-            try:
-                # نستخدم ContentFile لحفظ البيانات الثنائية كملف جديد في الكاش
-                # Use ContentFile to save binary data as a new file in cache
-                file_name = os.path.basename(image_field.name)
-                
-                ImageAnalysisCache.objects.create(
-                    image_hash=sha256_hash,
-                    analysis_result=result_text,
-                    cached_image=ContentFile(image_data, name=file_name)
-                )
-            except Exception as db_err:
-                logger.error(f"Failed to save image cache: {db_err}")
-
-            return result_text
 
+        except CircuitOpen as e:
+            logger.warning(f"🔌 {e}, skipping image analysis.")
+            return "⚠️ AI Analysis temporarily unavailable."
         except Exception as e:
             logger.error(f"Image Analysis Failed: {e}")
-            return f"⚠️ AI Analysis Failed: {str(e)}"
\ No newline at end of file
+            return f"⚠️ AI Analysis Failed: {str(e)}"
+
+    def _analyze_and_cache(self, image_field, image_data, sha256_hash):
+        from apps.chat.models import ImageAnalysisCache
+
+        # 4. التجهيز للإرسال (Base64 Encoding)
+        # 4. Prepare for sending (Base64 Encoding)
+        encoded_image = base64.b64encode(image_data).decode('utf-8')
+
+        # 5. إرسال الطلب لـ Azure OpenAI
+        # 5. Send request to Azure OpenAI
+        # تعديل: تخفيف القيود لتجنب (Jailbreak Detection)
+        # Fix: Relax constraints to avoid (Jailbreak Detection)
+        prompt = """
+        Describe the medical symptoms visible in this image.
+        Provide any observation in Norwegian using this format:
+        - **Funn:** [Observations]
+        - **Mulig årsak:** [Possible causes based on visual evidence]
+        - **Anbefaling:** [General suggestion which must end with: Contact a doctor]
+        
+        Disclaimer: This is for informational purposes only.
+        """
+
+        response = self.breaker.call(
+            self.client.chat.completions.create,
+            model=self.deployment_name,
+            messages=[
+                { "role": "system", "content": "You are a helpful assistant that describes images." },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}},
+                    ],
+                }
+            ],
+            max_tokens=400,
+            timeout=25
+        )
+        
+        result_text = response.choices[0].message.content
+
+        # 6. حفظ النتيجة + نسخة من الصورة في الكاش
+        # 6. Save result + image copy to cache
+        try:
+            # نستخدم ContentFile لحفظ البيانات الثنائية كملف جديد في الكاش
+            # Use ContentFile to save binary data as a new file in cache
+            file_name = os.path.basename(image_field.name)
+            
+            ImageAnalysisCache.objects.create(
+                image_hash=sha256_hash,
+                analysis_result=result_text,
+                cached_image=ContentFile(image_data, name=file_name)
+            )
+        except Exception as db_err:
+            logger.error(f"Failed to save image cache: {db_err}")
+
+        return result_text
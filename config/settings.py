@@ -33,6 +33,22 @@ DEBUG = env.bool('DJANGO_DEBUG', not IN_RENDER_DEPLOYMENT)
 SECRET_KEY = env('DJANGO_SECRET_KEY')
 DB_ENCRYPTION_KEY = env('DB_ENCRYPTION_KEY')
 
+# تدوير المفاتيح (MultiFernet): المفتاح الجديد أولاً ثم القديم، ثم شغّل rotate_encryption_keys
+# وبعد انتهاء المهمة يمكن حذف المفتاح القديم من القائمة
+DB_ENCRYPTION_KEYS = env.list('DB_ENCRYPTION_KEYS', default=[DB_ENCRYPTION_KEY])
+KEY_ROTATION_BATCH_SIZE = env.int('KEY_ROTATION_BATCH_SIZE', default=500)
+KEY_ROTATION_ROWS_PER_SECOND = env.int('KEY_ROTATION_ROWS_PER_SECOND', default=200)
+KEY_ROTATION_MAX_SECONDS = env.int('KEY_ROTATION_MAX_SECONDS', default=240)
+
+# ضغط النصوص الطويلة (zlib) قبل التشفير ابتداءً من هذا الحجم بالبايت (0 = تعطيل)
+DB_ENCRYPTION_COMPRESS_MIN_BYTES = env.int('DB_ENCRYPTION_COMPRESS_MIN_BYTES', default=512)
+
+# فك/تشفير بالجملة (التصدير والمهام الخلفية): 'thread' أو 'process' أو 'serial'
+# عمال Celery لا يمكنهم استخدام 'process' (عمليات daemon)
+DB_CRYPTO_POOL = env('DB_CRYPTO_POOL', default='thread')
+DB_CRYPTO_WORKERS = env.int('DB_CRYPTO_WORKERS', default=4)
+DB_CRYPTO_CHUNK_SIZE = env.int('DB_CRYPTO_CHUNK_SIZE', default=500)
+
 # السماح لجميع النطاقات (Render يدير الـ Routing، ومحلياً نحتاج localhost)
 ALLOWED_HOSTS = ["*"]
 
@@ -118,6 +134,48 @@ else:
 # 🗄️ REDIS & CACHE
 # ==============================================================================
 
+# الحضور: الاتصال يعتبر قائماً ما دامت آخر نبضة أحدث من هذه المدة (ثوانٍ)
+PRESENCE_TTL_SECONDS = env.int('PRESENCE_TTL_SECONDS', default=60)
+
+# عدد الرسائل في كل صفحة من سجل المحادثة
+CHAT_HISTORY_PAGE_SIZE = env.int('CHAT_HISTORY_PAGE_SIZE', default=50)
+
+# أقصى عدد رسائل تُرسل عند إعادة الاتصال (أكثر من ذلك = إعادة تحميل الصفحة)
+SYNC_MAX_MESSAGES = env.int('SYNC_MAX_MESSAGES', default=200)
+
+# تأجيل ودمج إشعارات القراءة (ثوانٍ)
+READ_RECEIPT_DEBOUNCE_SECONDS = env.float('READ_RECEIPT_DEBOUNCE_SECONDS', default=2.0)
+
+# بروتوكول WebSocket المضغوط (msgpack) للعملاء الذين يطلبونه؛ الباقون على JSON
+WS_COMPACT_PROTOCOL_ENABLED = env.bool('WS_COMPACT_PROTOCOL_ENABLED', default=True)
+
+# الإطارات الأصغر من هذا (بايت) لا تُضغط بـ deflate
+WS_DEFLATE_MIN_BYTES = env.int('WS_DEFLATE_MIN_BYTES', default=256)
+
+# طابور الإرسال لكل اتصال: فوق HIGH_WATER تُدمج أحداث الكتابة/القراءة، وفوق MAX_DEPTH يُفصل العميل
+WS_OUTBOX_HIGH_WATER = env.int('WS_OUTBOX_HIGH_WATER', default=50)
+WS_OUTBOX_MAX_DEPTH = env.int('WS_OUTBOX_MAX_DEPTH', default=200)
+
+# عميل لم يؤكد استلام رسالة خلال هذه المدة (ثوانٍ) يعتبر عالقاً
+WS_ACK_TIMEOUT_SECONDS = env.int('WS_ACK_TIMEOUT_SECONDS', default=60)
+
+# أقصى عدد رسائل في إطار message_batch واحد (طابور عدم الاتصال في المتصفح)
+WS_MESSAGE_BATCH_MAX = env.int('WS_MESSAGE_BATCH_MAX', default=50)
+
+# حدود الطلبات لكل دقيقة حسب نقطة الوصول والدور (None = بلا حد)
+RATE_LIMITS = {
+    'ws_message': {
+        'REFUGEE': env.int('RATE_LIMIT_WS_MESSAGES_REFUGEE', default=30),
+        'STAFF': None,
+        'default': env.int('RATE_LIMIT_WS_MESSAGES_DEFAULT', default=30),
+    },
+    'upload': {
+        'REFUGEE': env.int('RATE_LIMIT_UPLOADS_REFUGEE', default=10),
+        'STAFF': env.int('RATE_LIMIT_UPLOADS_STAFF', default=60),
+        'default': env.int('RATE_LIMIT_UPLOADS_DEFAULT', default=10),
+    },
+}
+
 # في Render نأخذه من متغيرات البيئة، محلياً نأخذه من .env
 REDIS_URL = env('REDIS_URL', default='redis://redis:6379/0')
 
@@ -163,6 +221,18 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.chat.tasks.delete_old_data',
         'schedule': crontab(hour=3, minute=0), 
     },
+    'translation-cache-usage-every-minute': {
+        'task': 'apps.chat.tasks.flush_translation_cache_usage',
+        'schedule': crontab(minute='*'),
+    },
+    'translation-cache-eviction-hourly': {
+        'task': 'apps.chat.tasks.evict_translation_cache',
+        'schedule': crontab(minute=30),
+    },
+    'read-watermarks-every-10-minutes': {
+        'task': 'apps.chat.tasks.apply_read_watermarks',
+        'schedule': crontab(minute='*/10'),
+    },
 }
 
 # ==============================================================================
@@ -247,6 +317,57 @@ AZURE_OPENAI_ENDPOINT = env('AZURE_OPENAI_ENDPOINT', default='')
 AZURE_OPENAI_KEY = env('AZURE_OPENAI_KEY', default='')
 AZURE_OPENAI_DEPLOYMENT_NAME = env('AZURE_OPENAI_DEPLOYMENT_NAME', default='gpt-4o')
 
+# تجميع طلبات الترجمة المتزامنة (Micro-batching) عبر Redis
+TRANSLATION_BATCHING_ENABLED = env.bool('TRANSLATION_BATCHING_ENABLED', default=True)
+TRANSLATION_BATCH_WINDOW_MS = env.int('TRANSLATION_BATCH_WINDOW_MS', default=25)
+TRANSLATION_BATCH_WAIT_TIMEOUT = env.int('TRANSLATION_BATCH_WAIT_TIMEOUT', default=15)
+
+# كاش الترجمة بطبقتين: L1 داخل العملية + L2 في Redis (قاعدة البيانات هي الطبقة الباردة)
+TRANSLATION_CACHE_L1_SIZE = env.int('TRANSLATION_CACHE_L1_SIZE', default=2048)
+TRANSLATION_CACHE_L1_TTL = env.int('TRANSLATION_CACHE_L1_TTL', default=3600)
+TRANSLATION_CACHE_L2_ENABLED = env.bool('TRANSLATION_CACHE_L2_ENABLED', default=True)
+TRANSLATION_CACHE_L2_TTL = env.int('TRANSLATION_CACHE_L2_TTL', default=86400)
+
+# حجم جدول TranslationCache الأقصى وسياسة الإخلاء ('lru' أو 'lfu')
+TRANSLATION_CACHE_MAX_ROWS = env.int('TRANSLATION_CACHE_MAX_ROWS', default=50000)
+TRANSLATION_CACHE_EVICTION_POLICY = env('TRANSLATION_CACHE_EVICTION_POLICY', default='lru')
+
+# عميل الترجمة (httpx): مجمع اتصالات دائمة لكل عملية ولكل حلقة أحداث
+TRANSLATOR_HTTP2 = env.bool('TRANSLATOR_HTTP2', default=False)
+TRANSLATOR_TIMEOUT = env.float('TRANSLATOR_TIMEOUT', default=5.0)
+TRANSLATOR_MAX_CONNECTIONS = env.int('TRANSLATOR_MAX_CONNECTIONS', default=20)
+TRANSLATOR_MAX_KEEPALIVE = env.int('TRANSLATOR_MAX_KEEPALIVE', default=10)
+# مهلة الترجمة المباشرة في ChatConsumer (ثوانٍ، 0 = تعطيل)؛ بعدها تتولى Celery الترجمة
+TRANSLATION_INLINE_TIMEOUT = env.float('TRANSLATION_INLINE_TIMEOUT', default=1.0)
+
+# حصص Azure Translator المشتركة بين كل العمال (Token bucket في Redis)
+AZURE_TRANSLATOR_CHARS_PER_MINUTE = env.int('AZURE_TRANSLATOR_CHARS_PER_MINUTE', default=33000)
+AZURE_TRANSLATOR_REQUESTS_PER_MINUTE = env.int('AZURE_TRANSLATOR_REQUESTS_PER_MINUTE', default=600)
+
+# Single-flight: أقصى مدة انتظار لنتيجة طلب مطابق قيد التنفيذ (بالثواني)
+SINGLE_FLIGHT_WAIT_TIMEOUT = env.int('SINGLE_FLIGHT_WAIT_TIMEOUT', default=10)
+SINGLE_FLIGHT_VISION_WAIT_TIMEOUT = env.int('SINGLE_FLIGHT_VISION_WAIT_TIMEOUT', default=40)
+
+# قاطع الدائرة: عدد الأخطاء المتتالية قبل الفتح، ومدة الفتح قبل المحاولة التجريبية (ثوانٍ)
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = env.int('CIRCUIT_BREAKER_FAILURE_THRESHOLD', default=5)
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = env.int('CIRCUIT_BREAKER_RECOVERY_TIMEOUT', default=30)
+
+# اختيار خدمات الذكاء الاصطناعي: 'azure' (الإنتاج) أو 'stub' (اختبار الحمل بدون شبكة)
+AI_BACKENDS = {
+    'translation': env('AI_TRANSLATION_BACKEND', default='azure'),
+    'vision': env('AI_VISION_BACKEND', default='azure'),
+    'transcription': env('AI_TRANSCRIPTION_BACKEND', default='azure'),
+}
+AI_STUB_OPTIONS = {
+    'latency_distribution': env('AI_STUB_LATENCY_DISTRIBUTION', default='lognormal'),
+    'latency_ms': env.float('AI_STUB_LATENCY_MS', default=80.0),
+    'latency_jitter': env.float('AI_STUB_LATENCY_JITTER', default=0.5),
+    'error_rate': env.float('AI_STUB_ERROR_RATE', default=0.0),
+    'throttle_rate': env.float('AI_STUB_THROTTLE_RATE', default=0.0),
+    'retry_after': env.int('AI_STUB_RETRY_AFTER', default=2),
+    'seed': env.int('AI_STUB_SEED', default=42),
+}
+
 # ==============================================================================
 # 🎨 STATIC & MEDIA & STORAGE
 # ==============================================================================
@@ -7,6 +7,9 @@ set -o nounset
 echo "Running migrations..."
 python manage.py migrate
 
+echo "Warming UI string catalog..."
+python manage.py warm_ui_catalog || echo "⚠️ UI catalog warm-up failed, pages show English until Celery rebuilds it."
+
 echo "Collecting static files..."
 python manage.py collectstatic --no-input
 
@@ -22,6 +22,99 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // =========================================================
+    // 1.5 صندوق الوارد المباشر لقائمة المحادثات (Live Inbox)
+    // اتصال واحد لكل الجلسات بدل التحديث اليدوي
+    // One socket for every session instead of reloading the changelist
+    // =========================================================
+    if (/\/chat\/chatsession\/?$/.test(window.location.pathname)) {
+        connectInbox();
+    }
+
+    function connectInbox() {
+        const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+        const inboxSocket = new WebSocket(protocol + window.location.host + '/ws/staff/inbox/');
+
+        inboxSocket.onmessage = function(e) {
+            const data = JSON.parse(e.data);
+            const badge = document.querySelector(`[data-inbox-session="${data.session_id}"]`);
+
+            // جلسة غير ظاهرة في هذه الصفحة (جديدة أو في صفحة أخرى)
+            // Session not on this page (new, filtered or paginated away)
+            if (!badge) {
+                if (data.type === 'new_message' && !data.from_staff) showInboxNotice();
+                return;
+            }
+            const row = badge.closest('tr');
+
+            if (data.type === 'priority') {
+                setPriority(badge, data.priority);
+                moveRow(row, badge);
+            } else if (data.type === 'unread' || data.type === 'new_message') {
+                setUnread(data.session_id, data.unread);
+                if (data.type === 'new_message') {
+                    const cells = row ? row.querySelectorAll('td, th') : [];
+                    const activityCell = Array.from(cells).find(c => c.className.includes('field-last_activity'));
+                    if (activityCell) activityCell.innerText = new Date(data.timestamp).toLocaleString();
+                    moveRow(row, badge);
+                    if (!data.from_staff) flashRow(row);
+                }
+            }
+        };
+
+        inboxSocket.onclose = function() {
+            setTimeout(connectInbox, 5000);
+        };
+    }
+
+    function setPriority(badge, priority) {
+        badge.dataset.priority = priority;
+        const pill = badge.firstElementChild;
+        if (!pill) return;
+        const urgent = Number(priority) === 2;
+        pill.className = urgent
+            ? 'bg-red-600 text-white p-2 rounded-md font-bold text-center w-full shadow-sm text-xs animate-pulse'
+            : 'bg-green-600 text-white p-2 rounded-md text-center w-full shadow-sm text-xs';
+        pill.innerText = urgent ? '🚨 DOCTOR' : '✅ NURSE';
+    }
+
+    function setUnread(sessionId, count) {
+        const unread = document.querySelector(`[data-inbox-unread="${sessionId}"]`);
+        if (!unread || count === undefined) return;
+        unread.innerText = count;
+        unread.style.display = count ? '' : 'none';
+    }
+
+    // نفس ترتيب القائمة: الأولوية ثم آخر نشاط / Same order as the changelist: priority, then latest activity
+    function moveRow(row, badge) {
+        if (!row || !row.parentNode) return;
+        const priority = Number(badge.dataset.priority);
+        const target = Array.from(row.parentNode.querySelectorAll('[data-inbox-session]'))
+            .find(b => b !== badge && Number(b.dataset.priority) <= priority);
+        const targetRow = target ? target.closest('tr') : null;
+        if (targetRow && targetRow !== row) {
+            row.parentNode.insertBefore(row, targetRow);
+        } else if (!targetRow) {
+            row.parentNode.appendChild(row);
+        }
+    }
+
+    function flashRow(row) {
+        if (!row) return;
+        row.style.transition = 'background-color 1s';
+        row.style.backgroundColor = '#fef9c3';
+        setTimeout(() => row.style.backgroundColor = '', 1500);
+    }
+
+    function showInboxNotice() {
+        if (document.getElementById('inbox-notice')) return;
+        const notice = document.createElement('div');
+        notice.id = 'inbox-notice';
+        notice.innerHTML = '🔔 New messages in other conversations — <a href="" style="text-decoration:underline;">refresh</a>';
+        notice.style.cssText = "position: fixed; top: 10px; left: 50%; transform: translateX(-50%); background: #1d4ed8; color: white; padding: 8px 16px; border-radius: 8px; z-index: 99999; animation: slideDown 0.3s;";
+        document.body.appendChild(notice);
+    }
+
      // =========================================================
     // 2. منطق الردود الجاهزة (Canned Responses) - مخصص لـ Unfold
     // =========================================================
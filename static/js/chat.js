@@ -6,11 +6,37 @@ function initChat(config) {
     const currentUserId = config.userId;
     const csrfToken = config.csrfToken;
     const uploadUrl = config.uploadUrl;
+    const nurseLabel = config.nurseLabel || 'Nurse';
+    const nurseOnlineText = config.nurseOnline || 'Nurse is online';
+    const nurseTypingText = config.nurseTyping || 'Nurse is typing...';
     
     const STORAGE_KEY = `offline_queue_${sessionId}`;
 
     let chatSocket = null;
     let reconnectInterval = null;
+    // آخر رقم تسلسلي رأيناه: نرسله عند إعادة الاتصال لنستلم ما فاتنا فقط
+    // Highest sequence number seen: sent on reconnect so we only receive what we missed
+    let lastSeq = config.lastSeq || 0;
+
+    // السجل الأقدم يُجلب عند التمرير للأعلى / Older history is fetched when scrolling up
+    let olderCursor = config.olderCursor || null;
+    let hasOlder = !!config.hasOlder;
+
+    // جدول الأسماء القصيرة من الخادم (apps/chat/wire.py) / Short-key table from the server (apps/chat/wire.py)
+    const wireEl = document.getElementById('wire-protocol');
+    const wire = wireEl ? JSON.parse(wireEl.textContent) : {enabled: false, codes: {}, time_fields: []};
+    wire.timeFields = wire.time_fields || [];
+    const wireNames = Object.fromEntries(Object.entries(wire.codes || {}).map(([name, code]) => [code, name]));
+    let frameQueue = Promise.resolve();
+    let loadingOlder = false;
+    let heartbeatInterval = null;
+    let ackTimeout = null;
+    let pendingBatch = null;
+    // أقصى عدد رسائل في إطار message_batch (WS_MESSAGE_BATCH_MAX) / Max texts per message_batch frame
+    let batchMax = config.batchMax || 50;
+    let nurseOnline = false;
+    let nurseTyping = false;
+    let typingTimeout = null;
 
     // --- Voice Recording Variables ---
     let mediaRecorder = null;
@@ -20,10 +46,15 @@ function initChat(config) {
     function connect() {
         const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
         const host = window.location.host;
-        const socketUrl = `${protocol}${host}/ws/chat/${sessionId}/`;
+        const socketUrl = `${protocol}${host}/ws/chat/${sessionId}/?cursor=${lastSeq}`;
         
         console.log("Connecting to:", socketUrl);
-        chatSocket = new WebSocket(socketUrl);
+        // البروتوكول المضغوط اختياري: الخادم يختار أو يبقى على JSON
+        // Compact protocol is opt-in: the server picks one of these or stays on JSON
+        const subprotocols = compactProtocols();
+        chatSocket = subprotocols.length ? new WebSocket(socketUrl, subprotocols) : new WebSocket(socketUrl);
+        chatSocket.binaryType = 'arraybuffer';
+        frameQueue = Promise.resolve();
 
         chatSocket.onopen = function() {
             console.log("Connected!");
@@ -38,32 +69,110 @@ function initChat(config) {
                 reconnectInterval = null;
             }
 
+            // نبضة كل 25 ثانية لإبقاء الحضور (مدة الصلاحية 60 ثانية في الخادم)
+            // Heartbeat every 25s keeps presence alive (server TTL is 60s)
+            if (!heartbeatInterval) {
+                heartbeatInterval = setInterval(() => sendFrame({'type': 'heartbeat', 'seq': lastSeq}), 25000);
+            }
+            // أول تأكيد استلام يفعّل مراقبة العميل البطيء في الخادم / The first ack turns on slow-client tracking
+            sendFrame({'type': 'ack', 'seq': lastSeq});
+
             processOfflineQueue();
         };
 
         chatSocket.onmessage = function(e) {
-            const data = JSON.parse(e.data);
-            
+            if (typeof e.data === 'string') {
+                dispatch(JSON.parse(e.data));
+                return;
+            }
+            // فك الإطارات الثنائية غير متزامن: نسلسلها للحفاظ على الترتيب
+            // Binary frames decode asynchronously; chain them to keep arrival order
+            frameQueue = frameQueue
+                .then(() => decodeFrame(e.data))
+                .then(dispatch)
+                .catch(err => console.error("Frame decode error:", err));
+        };
+
+        function dispatch(data) {
             if (data.type === 'read_receipt') {
-                markAllAsRead();
+                if (String(data.reader_id) !== currentUserId) {
+                    markAllAsRead();
+                }
+            } else if (data.type === 'sync') {
+                if (data.has_more) {
+                    window.location.reload();
+                    return;
+                }
+                data.messages.forEach(m => handleMessage(m));
+                scheduleAck();
+                if (data.messages.some(m => String(m.sender_id) !== currentUserId)) {
+                    chatSocket.send(JSON.stringify({'type': 'mark_read'}));
+                }
+            } else if (data.type === 'presence') {
+                if (data.side === 'staff') {
+                    nurseOnline = data.online;
+                    if (!data.online) nurseTyping = false;
+                    renderPeerStatus();
+                }
+            } else if (data.type === 'typing') {
+                if (data.side === 'staff') {
+                    nurseTyping = data.is_typing;
+                    renderPeerStatus();
+                }
+            } else if (data.type === 'message_patch') {
+                applyPatch(data);
+            } else if (data.type === 'patch_batch') {
+                data.patches.forEach(p => applyPatch(p));
+            } else if (data.type === 'message_batch') {
+                if (pendingBatch && data.messages.some(m => String(m.sender_id) === currentUserId)) {
+                    // الجزء السابق وصل: نرسل التالي / Previous chunk stored: send the next one
+                    pendingBatch = null;
+                    processOfflineQueue();
+                }
+                data.messages.forEach(m => handleMessage(m));
+                scheduleAck();
+                if (data.messages.some(m => String(m.sender_id) !== currentUserId)) {
+                    chatSocket.send(JSON.stringify({'type': 'mark_read'}));
+                }
             } else if (data.type === 'error_alert') {
+                if (data.batch_max) {
+                    // الدفعة أكبر من حد الخادم: لم يُحفظ شيء، نعيد إرسالها على أجزاء
+                    // Batch over the server limit: nothing was stored, resend it in smaller chunks
+                    batchMax = data.batch_max;
+                    if (pendingBatch) requeueBatch(0);
+                    return;
+                }
+                if (pendingBatch && data.retry_after) requeueBatch(data.retry_after);
                 showError(data.error);
             } else if (data.type === 'chat_message') {
                 if (String(data.sender_id) !== currentUserId) {
                     chatSocket.send(JSON.stringify({'type': 'mark_read'}));
                 }
                 handleMessage(data);
+                scheduleAck();
             }
-        };
+        }
 
-        chatSocket.onclose = function() {
+        chatSocket.onclose = function(e) {
             console.log("Socket closed, reconnecting...");
+            clearInterval(heartbeatInterval);
+            heartbeatInterval = null;
+            nurseOnline = false;
+            nurseTyping = false;
+            renderPeerStatus();
             const statusDot = document.querySelector('.status-dot');
             if(statusDot) {
                 statusDot.style.color = 'red';
                 statusDot.innerText = '● offline';
             }
 
+            // الخادم فصلنا لأننا متأخرون: نعيد الاتصال فوراً ونستلم ما فاتنا في 'sync'
+            // Evicted as a slow consumer: reconnect at once and catch up through 'sync'
+            if (e.code === 4008) {
+                connect();
+                return;
+            }
+
             if (!reconnectInterval){
                 reconnectInterval = setInterval(connect, 5000);
             }
@@ -75,18 +184,144 @@ function initChat(config) {
         };
     }
 
+    // ==========================================================================
+    // البروتوكول الثنائي (msgpack + deflate) / Compact binary protocol (msgpack + deflate)
+    // ==========================================================================
+    function compactProtocols() {
+        if (!wire.enabled) return [];
+        // deflate يحتاج DecompressionStream / deflate needs DecompressionStream
+        if ('DecompressionStream' in window) return ['chat.msgpack.deflate.v1', 'chat.msgpack.v1'];
+        return ['chat.msgpack.v1'];
+    }
+
+    async function decodeFrame(buffer) {
+        let body = new Uint8Array(buffer);
+        const flag = body[0];
+        body = body.subarray(1);
+        if (flag === 1) {
+            const stream = new Blob([body]).stream().pipeThrough(new DecompressionStream('deflate-raw'));
+            body = new Uint8Array(await new Response(stream).arrayBuffer());
+        }
+        return expandFrame(msgpackDecode(body));
+    }
+
+    // يعيد الأسماء الكاملة والأوقات بصيغة ISO / Restores full key names and ISO timestamps
+    function expandFrame(value) {
+        if (Array.isArray(value)) return value.map(expandFrame);
+        if (value === null || typeof value !== 'object' || value instanceof Uint8Array) return value;
+        const out = {};
+        for (const [code, item] of Object.entries(value)) {
+            const key = wireNames[code] || code;
+            out[key] = (wire.timeFields.includes(key) && typeof item === 'number')
+                ? new Date(item).toISOString()
+                : expandFrame(item);
+        }
+        return out;
+    }
+
+    // فك msgpack مصغر (الأنواع التي يرسلها الخادم فقط) / Minimal msgpack decoder (only what the server sends)
+    function msgpackDecode(bytes) {
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        const utf8 = new TextDecoder();
+        let pos = 0;
+
+        function str(len) { const v = utf8.decode(bytes.subarray(pos, pos + len)); pos += len; return v; }
+        function bin(len) { const v = bytes.slice(pos, pos + len); pos += len; return v; }
+        function arr(len) { const v = []; for (let i = 0; i < len; i++) v.push(read()); return v; }
+        function map(len) { const v = {}; for (let i = 0; i < len; i++) { const k = read(); v[k] = read(); } return v; }
+        function u8() { return view.getUint8(pos++); }
+        function u16() { const v = view.getUint16(pos); pos += 2; return v; }
+        function u32() { const v = view.getUint32(pos); pos += 4; return v; }
+
+        function read() {
+            const b = u8();
+            if (b <= 0x7f) return b;
+            if (b >= 0xe0) return b - 0x100;
+            if ((b & 0xf0) === 0x80) return map(b & 0x0f);
+            if ((b & 0xf0) === 0x90) return arr(b & 0x0f);
+            if ((b & 0xe0) === 0xa0) return str(b & 0x1f);
+            let v;
+            switch (b) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return bin(u8());
+                case 0xc5: return bin(u16());
+                case 0xc6: return bin(u32());
+                case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+                case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+                case 0xcc: return u8();
+                case 0xcd: return u16();
+                case 0xce: return u32();
+                case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+                case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+                case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+                case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+                case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+                case 0xd9: return str(u8());
+                case 0xda: return str(u16());
+                case 0xdb: return str(u32());
+                case 0xdc: return arr(u16());
+                case 0xdd: return arr(u32());
+                case 0xde: return map(u16());
+                case 0xdf: return map(u32());
+            }
+            throw new Error(`Unsupported msgpack byte 0x${b.toString(16)}`);
+        }
+        return read();
+    }
+
+    // تأكيد الاستلام مجمّع: إطار واحد بعد توقف الرسائل لثانية / Batched ack: one frame once messages pause for 1s
+    function scheduleAck() {
+        clearTimeout(ackTimeout);
+        ackTimeout = setTimeout(() => sendFrame({'type': 'ack', 'seq': lastSeq}), 1000);
+    }
+
+    function sendFrame(frame) {
+        if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+            chatSocket.send(JSON.stringify(frame));
+        }
+    }
+
+    function renderPeerStatus() {
+        const peerStatus = document.getElementById('peer-status');
+        if (!peerStatus) return;
+        peerStatus.innerText = nurseTyping ? nurseTypingText : nurseOnlineText;
+        peerStatus.style.display = (nurseOnline || nurseTyping) ? 'inline' : 'none';
+    }
+
     function processOfflineQueue() {
-        const queue = JSON.parse(localStorage.getItem(STORAGE_KEY) || '[]');
+        const queue = JSON.parse(localStorage.getItem(STORAGE_KEY) || '[]')
+            .filter(text => typeof text === 'string' && text.trim());
         if (queue.length > 0 && chatSocket.readyState === WebSocket.OPEN) {
             console.log(`Sending ${queue.length} offline messages...`);
-            queue.forEach(msgText => {
-                chatSocket.send(JSON.stringify({message: msgText}));
-            });
-            localStorage.removeItem(STORAGE_KEY);
+            if (queue.length === 1) {
+                chatSocket.send(JSON.stringify({message: queue[0]}));
+                localStorage.removeItem(STORAGE_KEY);
+            } else {
+                // إطار واحد لكل batchMax رسالة؛ الباقي يبقى في الطابور حتى يؤكد الخادم هذا الجزء
+                // One frame per batchMax texts; the rest stays queued until the server confirms this chunk
+                const batch = queue.slice(0, batchMax);
+                chatSocket.send(JSON.stringify({'type': 'message_batch', 'messages': batch}));
+                pendingBatch = batch;
+                localStorage.setItem(STORAGE_KEY, JSON.stringify(queue.slice(batch.length)));
+            }
             document.querySelectorAll('.message.pending').forEach(el => el.remove());
+            loadInitialPending();
         }
     }
 
+    // الدفعة رُفضت بسبب حد السرعة: نعيدها للطابور ونحاول لاحقاً
+    // Batch rejected by the rate limit: put it back in the queue and retry later
+    function requeueBatch(retryAfter) {
+        const queue = JSON.parse(localStorage.getItem(STORAGE_KEY) || '[]');
+        localStorage.setItem(STORAGE_KEY, JSON.stringify(pendingBatch.concat(queue)));
+        pendingBatch = null;
+        document.querySelectorAll('.message.pending').forEach(el => el.remove());
+        loadInitialPending();
+        setTimeout(processOfflineQueue, (retryAfter ?? 5) * 1000);
+    }
+
     function saveToQueueAndShow(msgText) {
         const queue = JSON.parse(localStorage.getItem(STORAGE_KEY) || '[]');
         queue.push(msgText);
@@ -145,7 +380,35 @@ function initChat(config) {
     }
 
     // 🛑 الدالة التي تم تعديلها لحل مشكلة اختفاء الصور
-    function handleMessage(data){
+    function loadOlder() {
+        if (!hasOlder || loadingOlder || !olderCursor || !config.historyUrl) return;
+        loadingOlder = true;
+        const log = document.querySelector('#chat-log');
+        const previousHeight = log.scrollHeight;
+
+        fetch(`${config.historyUrl}?session_id=${sessionId}&before=${encodeURIComponent(olderCursor)}`)
+        .then(res => res.json())
+        .then(data => {
+            // الصفحة مرتبة من الأقدم: نضيف من الأحدث إلى الأعلى / Page is oldest-first: prepend newest-first
+            (data.messages || []).slice().reverse().forEach(m => handleMessage(m, {prepend: true}));
+            hasOlder = !!data.has_more;
+            olderCursor = data.cursor || olderCursor;
+            // نحافظ على موضع القراءة / Keep the reading position
+            log.scrollTop = log.scrollHeight - previousHeight;
+        })
+        .catch(err => console.error(err))
+        .finally(() => { loadingOlder = false; });
+    }
+
+    const chatLog = document.querySelector('#chat-log');
+    if (chatLog) {
+        chatLog.addEventListener('scroll', () => {
+            if (chatLog.scrollTop < 80) loadOlder();
+        });
+    }
+
+    function handleMessage(data, options = {}){
+        if (data.seq && data.seq > lastSeq) lastSeq = data.seq;
         const msgId = data.is_pending ? data.id : `msg-${data.id}`;
         let div = document.getElementById(msgId);
 
@@ -165,7 +428,12 @@ function initChat(config) {
         if (!div) {
             div = document.createElement('div');
             div.id = msgId;
-            document.querySelector('#chat-log').appendChild(div);
+            const log = document.querySelector('#chat-log');
+            if (options.prepend) {
+                log.insertBefore(div, log.firstChild);
+            } else {
+                log.appendChild(div);
+            }
         }
 
         let msgClass = (String(data.sender_id) === currentUserId) ? "sent" : "received";
@@ -173,7 +441,8 @@ function initChat(config) {
 
         let senderLabel = "";
         if(String(data.sender_id) !== currentUserId){
-            senderLabel = '<span class="sender-label">Nurse 👩‍⚕️</span>';
+            const safeLabel = nurseLabel.replace(/</g,"&lt;").replace(/>/g,"&gt;");
+            senderLabel = `<span class="sender-label">${safeLabel} 👩‍⚕️</span>`;
         }
 
         // بناء المحتوى (صورة أو نص)
@@ -194,7 +463,7 @@ function initChat(config) {
                     <source src="${data.audio_url}" type="audio/webm">
                     Your browser does not support audio.
                 </audio>
-                <div style="font-size:0.8em; margin-top:5px;">${data.text_original || ""}</div>
+                <div class="audio-caption" style="font-size:0.8em; margin-top:5px;">${(data.text_original || "").replace(/</g,"&lt;").replace(/>/g,"&gt;")}</div>
              `;
         } else {
             let text = "";
@@ -233,8 +502,39 @@ function initChat(config) {
         // تحديث الكلاس والمحتوى
         div.className = `message ${msgClass}`;
         div.innerHTML = senderLabel + bodyHtml + metaHtml;
+        if (data.version && data.version > Number(div.dataset.version || 0)) div.dataset.version = data.version;
         
-        scrollToBottom();
+        if (!options.prepend) scrollToBottom();
+    }
+
+    // دمج تحديث جزئي (message_patch) في الرسالة الموجودة بدون إعادة بنائها
+    // Merge a message_patch into the existing bubble instead of rebuilding it
+    function applyPatch(patch) {
+        const div = document.getElementById(`msg-${patch.id}`);
+        // رسالة غير معروضة (صفحة أقدم): ستصل كاملة عند تحميلها / Not rendered yet: it arrives whole when loaded
+        if (!div) return;
+        // تحديث قديم وصل متأخراً / Stale patch arriving out of order
+        if (patch.version <= Number(div.dataset.version || 0)) return;
+        div.dataset.version = patch.version;
+
+        if (patch.image_url) {
+            const img = div.querySelector('img.chat-image');
+            if (img) {
+                img.src = patch.image_url + (patch.image_url.includes('?') ? '' : '?v=' + new Date().getTime());
+                img.parentNode.href = patch.image_url;
+            }
+        }
+        if (patch.audio_url) {
+            const source = div.querySelector('audio.chat-audio source');
+            if (source) source.src = patch.audio_url;
+        }
+
+        const isOwn = String(patch.sender_id) === currentUserId;
+        const text = isOwn ? patch.text_original : (patch.text_translated || patch.text_original);
+        if (text && !div.querySelector('img.chat-image')) {
+            const target = div.querySelector('.audio-caption') || div.querySelector('.msg-body');
+            if (target) target.textContent = text;
+        }
     }
 
     // --- Image Upload ---
@@ -378,7 +678,18 @@ function initChat(config) {
 
     if(textInput) {
         textInput.onkeyup = function(e){
-            if(e.key === "Enter") submitBtn.click();
+            if(e.key === "Enter") {
+                submitBtn.click();
+                clearTimeout(typingTimeout);
+                typingTimeout = null;
+                sendFrame({'type': 'typing', 'is_typing': false});
+                return;
+            }
+            // الخادم يدمج إشارات "يكتب"، ونرسل "توقف" بعد 3 ثوانٍ من السكون
+            // The server coalesces "typing"; we send "stopped" after 3s idle
+            sendFrame({'type': 'typing', 'is_typing': true});
+            clearTimeout(typingTimeout);
+            typingTimeout = setTimeout(() => sendFrame({'type': 'typing', 'is_typing': false}), 3000);
         };
     }
 